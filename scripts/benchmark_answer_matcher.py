@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""Compare `AnswerMatcher` (Aho–Corasick) against the per-answer `best_subspan_em` loop.
+
+Predictions are synthetic "whole context window" strings of `--prediction-words` words, and each
+example has a list of `--num-answers` aliases that (mostly) don't occur in the prediction, which is
+the worst case for the per-answer loop. Times are per example, and the automaton's build time is
+reported separately from matching (a dataset-wide automaton is built once and reused).
+
+Running:
+
+```
+python -u ./scripts/benchmark_answer_matcher.py \
+    --prediction-words 100 2000 20000 \
+    --num-answers 1 10 100 1000
+```
+
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+
+from lost_in_the_middle.metrics import AnswerMatcher, ahocorasick, best_subspan_em
+
+logger = logging.getLogger(__name__)
+
+
+def random_word(rng):
+    return "".join(rng.choices("abcdefghijklmnopqrstuvwxyz", k=rng.randint(3, 9)))
+
+
+def main(prediction_words, num_answers, num_examples):
+    rng = random.Random(0)
+    vocabulary = [random_word(rng) for _ in range(5000)]
+    backends = {"python": False}
+    if ahocorasick is not None:
+        backends["pyahocorasick"] = True
+    else:
+        logger.warning("pyahocorasick is not installed, only benchmarking the pure-Python automaton")
+
+    header = f"{'words':>8} {'answers':>8} {'loop (ms)':>10}"
+    for backend in backends:
+        header += f" {backend + ' build/match (ms)':>36} {'speedup':>8}"
+    logger.info(header)
+    for num_words in prediction_words:
+        predictions = [" ".join(rng.choices(vocabulary, k=num_words)) for _ in range(num_examples)]
+        for num_example_answers in num_answers:
+            # Multi-word aliases rarely occur in the prediction, so every alias has to be checked.
+            ground_truths = [
+                [" ".join(rng.choices(vocabulary, k=3)) for _ in range(num_example_answers)]
+                for _ in range(num_examples)
+            ]
+            # Normalize all of the gold answers up front, so neither approach pays for it below.
+            AnswerMatcher.from_ground_truths(ground_truths, use_pyahocorasick=False)
+
+            start = time.perf_counter()
+            loop_scores = [
+                best_subspan_em(prediction, answers) for prediction, answers in zip(predictions, ground_truths)
+            ]
+            loop_seconds = time.perf_counter() - start
+            row = f"{num_words:>8} {num_example_answers:>8} {loop_seconds * 1000 / num_examples:>10.3f}"
+
+            for use_pyahocorasick in backends.values():
+                start = time.perf_counter()
+                matcher = AnswerMatcher.from_ground_truths(ground_truths, use_pyahocorasick=use_pyahocorasick)
+                build_seconds = time.perf_counter() - start
+
+                start = time.perf_counter()
+                matcher_scores = [
+                    matcher.best_subspan_em(prediction, key=key) for key, prediction in enumerate(predictions)
+                ]
+                match_seconds = time.perf_counter() - start
+
+                if loop_scores != matcher_scores:
+                    raise ValueError("AnswerMatcher and best_subspan_em disagree")
+                build_and_match = (
+                    f"{build_seconds * 1000 / num_examples:.3f} / {match_seconds * 1000 / num_examples:.3f}"
+                )
+                row += f" {build_and_match:>36} {loop_seconds / (build_seconds + match_seconds):>8.2f}"
+            logger.info(row)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--prediction-words", help="Lengths (in words) of the predictions", type=int, nargs="+", default=[100, 2000]
+    )
+    parser.add_argument(
+        "--num-answers", help="Numbers of answer aliases per example", type=int, nargs="+", default=[1, 10, 100, 1000]
+    )
+    parser.add_argument("--num-examples", help="# of examples per configuration", type=int, default=20)
+    args = parser.parse_args()
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(args.prediction_words, args.num_answers, args.num_examples)
+    logger.info("finished running %s", sys.argv[0])
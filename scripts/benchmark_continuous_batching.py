@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""Compare greedy generation with continuous batching against static batches, on CPU.
+
+Runs a randomly-initialized Llama, so it needs no downloads, on synthetic prompts of random tokens (between
+`--min-prompt-tokens` and `--max-prompt-tokens`). So that responses end at different steps, as real ones
+do, a random `--end-token-fraction` of the vocabulary are end-of-sequence tokens. Static batches are formed
+by length with `get_batches` and run with `model.generate`, as `get_responses.py` does by default; the
+continuous batcher admits the same prompts in the same order. The new tokens of both are checked to be
+identical, and throughput is the number of new tokens (up to the end token of each response) per second
+of generation.
+
+Running:
+
+```
+python -u ./scripts/benchmark_continuous_batching.py --num-threads 8 --batch-size 8 --max-new-tokens 64
+```
+
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+
+from lost_in_the_middle.batching import get_batches
+from lost_in_the_middle.continuous_batching import ContinuousBatcher
+from lost_in_the_middle.cpu_backend import configure_cpu_threads
+from lost_in_the_middle.throughput import ThroughputMeter
+
+logger = logging.getLogger(__name__)
+
+PAD_TOKEN_ID = 0
+VOCAB_SIZE = 32000
+
+
+def main(
+    num_prompts,
+    min_prompt_tokens,
+    max_prompt_tokens,
+    batch_size,
+    max_new_tokens,
+    end_token_fraction,
+    hidden_size,
+    num_hidden_layers,
+    num_threads,
+    num_interop_threads,
+):
+    configure_cpu_threads(num_threads, num_interop_threads)
+    rng = random.Random(0)
+    all_prompt_input_ids = [
+        [rng.randrange(1, VOCAB_SIZE) for _ in range(rng.randint(min_prompt_tokens, max_prompt_tokens))]
+        for _ in range(num_prompts)
+    ]
+    end_token_ids = rng.sample(range(1, VOCAB_SIZE), max(1, int(end_token_fraction * VOCAB_SIZE)))
+    config = LlamaConfig(
+        vocab_size=VOCAB_SIZE,
+        hidden_size=hidden_size,
+        intermediate_size=4 * hidden_size,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=hidden_size // 32,
+        num_key_value_heads=hidden_size // 32,
+        max_position_embeddings=max_prompt_tokens + max_new_tokens,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    torch.manual_seed(0)
+    model = LlamaForCausalLM(config).eval()
+    prompt_lengths = [len(input_ids) for input_ids in all_prompt_input_ids]
+    batches = get_batches(prompt_lengths, batch_size)
+
+    static_meter = ThroughputMeter()
+    static_new_token_ids = {}
+    num_static_decode_steps = 0
+    start = time.perf_counter()
+    for batch in batches:
+        batch_input_ids = [all_prompt_input_ids[index] for index in batch]
+        max_length = max(len(input_ids) for input_ids in batch_input_ids)
+        input_ids = torch.tensor(
+            [[PAD_TOKEN_ID] * (max_length - len(input_ids)) + list(input_ids) for input_ids in batch_input_ids]
+        )
+        outputs = static_meter.generate(
+            model,
+            {"input_ids": input_ids, "attention_mask": (input_ids != PAD_TOKEN_ID).long()},
+            max_new_tokens=max_new_tokens,
+            do_sample=False,
+            pad_token_id=PAD_TOKEN_ID,
+            eos_token_id=end_token_ids,
+        )
+        num_static_decode_steps += outputs.shape[1] - max_length - 1
+        for index, new_token_ids in zip(batch, outputs[:, max_length:].tolist()):
+            # Sequences that ended before the rest of their batch are padded after their end token.
+            end = next((position for position, token_id in enumerate(new_token_ids) if token_id in end_token_ids), None)
+            static_new_token_ids[index] = new_token_ids if end is None else new_token_ids[: end + 1]
+    static_seconds = time.perf_counter() - start
+
+    batcher = ContinuousBatcher(
+        model, batch_size, max_new_tokens, eos_token_ids=end_token_ids, pad_token_id=PAD_TOKEN_ID
+    )
+    start = time.perf_counter()
+    continuous_new_token_ids = dict(
+        batcher.generate(all_prompt_input_ids, order=[index for batch in batches for index in batch])
+    )
+    continuous_seconds = time.perf_counter() - start
+
+    num_different = sum(static_new_token_ids[index] != continuous_new_token_ids[index] for index in range(num_prompts))
+    if num_different:
+        logger.warning(f"{num_different} of {num_prompts} responses differ between static and continuous batching")
+    num_new_tokens = sum(len(new_token_ids) for new_token_ids in continuous_new_token_ids.values())
+    response_lengths = sorted(len(new_token_ids) for new_token_ids in continuous_new_token_ids.values())
+    logger.info(
+        f"{num_prompts} prompts of {sum(prompt_lengths) / num_prompts:.0f} tokens on average, responses of "
+        f"{response_lengths[0]} to {response_lengths[-1]} tokens "
+        f"(median {response_lengths[len(response_lengths) // 2]})"
+    )
+    logger.info(
+        f"    static: {num_new_tokens / static_seconds:.1f} new tokens/s ({static_seconds:.2f} s), "
+        f"{num_static_decode_steps} decode steps of batches of up to {batch_size}; {static_meter.format_report()}"
+    )
+    logger.info(
+        f"continuous: {num_new_tokens / continuous_seconds:.1f} new tokens/s ({continuous_seconds:.2f} s, "
+        f"{static_seconds / continuous_seconds:.2f}x); {batcher.format_report()}; "
+        f"{batcher.throughput_meter.format_report()}"
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-prompts", help="# of prompts to benchmark", type=int, default=32)
+    parser.add_argument("--min-prompt-tokens", help="Min # of tokens of a prompt", type=int, default=64)
+    parser.add_argument("--max-prompt-tokens", help="Max # of tokens of a prompt", type=int, default=512)
+    parser.add_argument("--batch-size", help="Batch size (max # of sequences in flight)", type=int, default=8)
+    parser.add_argument("--max-new-tokens", help="Max # of new tokens of a response", type=int, default=64)
+    parser.add_argument(
+        "--end-token-fraction", help="Fraction of the vocabulary that ends a response", type=float, default=1 / 16
+    )
+    parser.add_argument("--hidden-size", help="Hidden size of the random Llama", type=int, default=256)
+    parser.add_argument("--num-hidden-layers", help="# of layers of the random Llama", type=int, default=4)
+    parser.add_argument("--num-threads", help="# of threads used within each op", type=int)
+    parser.add_argument("--num-interop-threads", help="# of threads used to run independent ops", type=int)
+    args = parser.parse_args()
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(
+        args.num_prompts,
+        args.min_prompt_tokens,
+        args.max_prompt_tokens,
+        args.batch_size,
+        args.max_new_tokens,
+        args.end_token_fraction,
+        args.hidden_size,
+        args.num_hidden_layers,
+        args.num_threads,
+        args.num_interop_threads,
+    )
+    logger.info("finished running %s", sys.argv[0])
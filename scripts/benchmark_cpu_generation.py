@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Benchmark prefill and decode throughput on CPU in float32, bfloat16 and with dynamic int8 quantization.
+
+Runs a randomly-initialized Llama, so it needs no downloads. Prompts are either read from a prompts file
+and tokenized with `--tokenizer`, or synthetic: random tokens of a random length between
+`--min-prompt-tokens` and `--max-prompt-tokens`. Each setting generates `--max-new-tokens` tokens for every
+prompt (no end-of-sequence token is sampled), in batches of prompts of similar length.
+
+Running:
+
+```
+python -u ./scripts/benchmark_cpu_generation.py --num-threads 8 --settings float32 bfloat16 int8
+python -u ./scripts/benchmark_cpu_generation.py \
+    --input-path qa_prompts/open_oracle/simplified_prompts.jsonl.gz \
+    --tokenizer meta-llama/Llama-2-7b-chat-hf
+```
+
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+from xopen import xopen
+
+from lost_in_the_middle.batching import get_batches
+from lost_in_the_middle.cpu_backend import configure_cpu_threads, prepare_cpu_model
+from lost_in_the_middle.throughput import ThroughputMeter
+
+logger = logging.getLogger(__name__)
+
+PAD_TOKEN_ID = 0
+# Name of each setting: (dtype, whether to quantize linear layers to int8)
+SETTINGS = {"float32": ("float32", False), "bfloat16": ("bfloat16", False), "int8": ("float32", True)}
+
+
+def main(
+    input_path,
+    tokenizer_name,
+    num_prompts,
+    min_prompt_tokens,
+    max_prompt_tokens,
+    batch_size,
+    max_new_tokens,
+    hidden_size,
+    num_hidden_layers,
+    num_threads,
+    num_interop_threads,
+    settings,
+):
+    configure_cpu_threads(num_threads, num_interop_threads)
+    if input_path:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        with xopen(input_path) as fin:
+            prompts = [json.loads(line)["prompt"] for line, _ in zip(fin, range(num_prompts))]
+        all_prompt_input_ids = tokenizer(prompts)["input_ids"]
+        vocab_size = len(tokenizer)
+    else:
+        rng = random.Random(0)
+        vocab_size = 32000
+        all_prompt_input_ids = [
+            [rng.randrange(1, vocab_size) for _ in range(rng.randint(min_prompt_tokens, max_prompt_tokens))]
+            for _ in range(num_prompts)
+        ]
+
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=4 * hidden_size,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=hidden_size // 32,
+        num_key_value_heads=hidden_size // 32,
+        max_position_embeddings=max(len(input_ids) for input_ids in all_prompt_input_ids) + max_new_tokens,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    prompt_lengths = [len(input_ids) for input_ids in all_prompt_input_ids]
+    batches = get_batches(prompt_lengths, batch_size)
+    logger.info(
+        f"{len(all_prompt_input_ids)} prompts of {sum(prompt_lengths) / len(prompt_lengths):.0f} tokens on average, "
+        f"in {len(batches)} batches"
+    )
+
+    for setting in settings:
+        dtype, quantize_int8 = SETTINGS[setting]
+        torch.manual_seed(0)
+        start = time.perf_counter()
+        model = prepare_cpu_model(LlamaForCausalLM(config), dtype=dtype, quantize_int8=quantize_int8)
+        load_seconds = time.perf_counter() - start
+
+        throughput_meter = ThroughputMeter()
+        for batch in batches:
+            batch_input_ids = [all_prompt_input_ids[index] for index in batch]
+            max_length = max(len(input_ids) for input_ids in batch_input_ids)
+            input_ids = torch.tensor(
+                [[PAD_TOKEN_ID] * (max_length - len(input_ids)) + list(input_ids) for input_ids in batch_input_ids]
+            )
+            throughput_meter.generate(
+                model,
+                {"input_ids": input_ids, "attention_mask": (input_ids != PAD_TOKEN_ID).long()},
+                max_new_tokens=max_new_tokens,
+                min_new_tokens=max_new_tokens,
+                do_sample=False,
+                pad_token_id=PAD_TOKEN_ID,
+                eos_token_id=None,
+            )
+        logger.info(f"{setting:>8} (prepared in {load_seconds:.2f} s): {throughput_meter.format_report()}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-path", help="Prompts file to take prompts from. Otherwise, prompts are synthetic.")
+    parser.add_argument("--tokenizer", help="Tokenizer for the prompts in --input-path")
+    parser.add_argument("--num-prompts", help="# of prompts to benchmark", type=int, default=32)
+    parser.add_argument("--min-prompt-tokens", help="Synthetic prompts: min # of tokens", type=int, default=64)
+    parser.add_argument("--max-prompt-tokens", help="Synthetic prompts: max # of tokens", type=int, default=512)
+    parser.add_argument("--batch-size", help="Batch size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", help="# of new tokens to generate for each prompt", type=int, default=32)
+    parser.add_argument("--hidden-size", help="Hidden size of the random Llama", type=int, default=256)
+    parser.add_argument("--num-hidden-layers", help="# of layers of the random Llama", type=int, default=4)
+    parser.add_argument("--num-threads", help="# of threads used within each op", type=int)
+    parser.add_argument("--num-interop-threads", help="# of threads used to run independent ops", type=int)
+    parser.add_argument(
+        "--settings",
+        help="Settings to benchmark",
+        nargs="+",
+        choices=list(SETTINGS),
+        default=list(SETTINGS),
+    )
+    args = parser.parse_args()
+    if args.input_path and not args.tokenizer:
+        parser.error("--tokenizer is required with --input-path")
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(
+        args.input_path,
+        args.tokenizer,
+        args.num_prompts,
+        args.min_prompt_tokens,
+        args.max_prompt_tokens,
+        args.batch_size,
+        args.max_new_tokens,
+        args.hidden_size,
+        args.num_hidden_layers,
+        args.num_threads,
+        args.num_interop_threads,
+        args.settings,
+    )
+    logger.info("finished running %s", sys.argv[0])
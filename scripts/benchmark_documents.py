@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""Microbenchmark the cost of building documents from parsed contexts, per 10k documents.
+
+Compares the previous path (`deepcopy` of the contexts, then `Document.from_dict`, which copies and
+validates again), `DocumentBatch.from_dicts(..., validate=True)`, and the unvalidated
+`DocumentBatch.from_dicts`.
+
+Running:
+
+```
+python -u ./scripts/benchmark_documents.py --num-documents 50 --num-repeats 5
+```
+
+"""
+import argparse
+import logging
+import random
+import sys
+import time
+from copy import deepcopy
+
+from lost_in_the_middle.prompting import Document, DocumentBatch
+
+logger = logging.getLogger(__name__)
+
+
+def make_contexts(num_examples, num_documents):
+    rng = random.Random(0)
+    return [
+        [
+            {
+                "id": str(rng.randrange(10**7)),
+                "title": f"Title {document_index}",
+                "text": " ".join(["lorem"] * 100),
+                "score": f"{rng.random():.8f}",
+                "hasanswer": document_index == 0,
+                "original_retrieval_index": document_index,
+                "isgold": document_index == 0,
+            }
+            for document_index in range(num_documents)
+        ]
+        for _ in range(num_examples)
+    ]
+
+
+def deepcopy_and_validate(ctxs):
+    return [Document.from_dict(ctx) for ctx in deepcopy(ctxs)]
+
+
+def validated_batch(ctxs):
+    return DocumentBatch.from_dicts(ctxs, validate=True)
+
+
+def unvalidated_batch(ctxs):
+    return DocumentBatch.from_dicts(ctxs)
+
+
+def main(num_documents, num_repeats):
+    num_examples = 10000 // num_documents
+    all_ctxs = make_contexts(num_examples, num_documents)
+    num_total_documents = num_examples * num_documents
+
+    timings = {}
+    for name, build in [
+        ("deepcopy + Document.from_dict", deepcopy_and_validate),
+        ("DocumentBatch (validate=True)", validated_batch),
+        ("DocumentBatch", unvalidated_batch),
+    ]:
+        best_seconds = float("inf")
+        for _ in range(num_repeats):
+            start = time.perf_counter()
+            for ctxs in all_ctxs:
+                build(ctxs)
+            best_seconds = min(best_seconds, time.perf_counter() - start)
+        timings[name] = best_seconds * 10000 / num_total_documents
+
+    baseline = timings["deepcopy + Document.from_dict"]
+    for name, seconds in timings.items():
+        logger.info(f"{name:>32}: {seconds * 1000:8.2f} ms per 10k documents ({baseline / seconds:.1f}x)")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-documents", help="# of documents per example", type=int, default=50)
+    parser.add_argument("--num-repeats", help="# of timed repeats (the best is reported)", type=int, default=5)
+    args = parser.parse_args()
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(args.num_documents, args.num_repeats)
+    logger.info("finished running %s", sys.argv[0])
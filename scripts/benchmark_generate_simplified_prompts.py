@@ -0,0 +1,142 @@
+#!/usr/bin/env python3
+"""Compare the peak memory of streaming prompt generation against the old buffered approach.
+
+A synthetic multi-document QA file is written to a temporary directory, and each approach is run
+in a fresh child process that reports its own peak RSS.
+
+Running:
+
+```
+python -u ./scripts/benchmark_generate_simplified_prompts.py \
+    --num-examples 100000 \
+    --num-documents 10
+```
+
+"""
+import argparse
+import json
+import logging
+import pathlib
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from copy import deepcopy
+
+from generate_simplified_prompts import format_chat_prompt
+from generate_simplified_prompts import main as streaming_main
+from xopen import xopen
+
+from lost_in_the_middle.prompting import Document, get_qa_prompt
+
+logger = logging.getLogger(__name__)
+
+MODEL_NAME = "meta-llama/Llama-2-7b-chat-hf"
+WORDS = ["lorem", "ipsum", "dolor", "sit", "amet", "consectetur", "adipiscing", "elit", "sed", "eiusmod"]
+
+
+def write_synthetic_input(path, num_examples, num_documents, num_words):
+    rng = random.Random(0)
+    with xopen(path, "w") as fout:
+        for example_index in range(num_examples):
+            gold_index = rng.randrange(num_documents)
+            ctxs = [
+                {
+                    "id": str(example_index * num_documents + document_index),
+                    "title": f"Title {document_index}",
+                    "text": " ".join(rng.choices(WORDS, k=num_words)),
+                    "score": "1.0",
+                    "hasanswer": document_index == gold_index,
+                    "isgold": document_index == gold_index,
+                    "original_retrieval_index": document_index,
+                }
+                for document_index in range(num_documents)
+            ]
+            example = {"question": f"synthetic question {example_index}", "answers": ["lorem"], "ctxs": ctxs}
+            fout.write(json.dumps(example) + "\n")
+
+
+def buffered_main(input_path, output_path):
+    """The previous implementation: every example, document list and prompt is kept until the end."""
+    examples = []
+    prompts = {}
+    all_model_documents = []
+    with xopen(input_path) as fin:
+        for line in fin:
+            input_example = json.loads(line)
+            question = input_example["question"]
+            documents = [Document.from_dict(ctx) for ctx in deepcopy(input_example["ctxs"])]
+            prompt = get_qa_prompt(
+                question, documents, mention_random_ordering=False, query_aware_contextualization=False
+            )
+            prompts[question] = {
+                "question": question,
+                "prompt": format_chat_prompt(prompt),
+                "answers": input_example["answers"],
+                "new_gold_index": None,
+            }
+            examples.append(deepcopy(input_example))
+            all_model_documents.append(documents)
+
+    with xopen(output_path, "w") as f:
+        for prompt in prompts.values():
+            f.write(json.dumps(prompt) + "\n")
+
+
+def run_child(mode, input_path, output_path):
+    start = time.perf_counter()
+    if mode == "buffered":
+        buffered_main(input_path, output_path)
+    else:
+        streaming_main(input_path, MODEL_NAME, False, False, False, False, False, output_path)
+    elapsed = time.perf_counter() - start
+    # On Linux, ru_maxrss is reported in KiB.
+    peak_rss_mib = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"mode": mode, "peak_rss_mib": peak_rss_mib, "seconds": elapsed}))
+
+
+def main(num_examples, num_documents, num_words):
+    with tempfile.TemporaryDirectory() as tmpdir:
+        input_path = pathlib.Path(tmpdir) / "synthetic.jsonl.gz"
+        logger.info(f"Writing {num_examples} synthetic examples with {num_documents} documents each")
+        write_synthetic_input(input_path, num_examples, num_documents, num_words)
+
+        results = []
+        for mode in ["buffered", "streaming"]:
+            output_path = pathlib.Path(tmpdir) / f"{mode}-prompts.jsonl.gz"
+            completed = subprocess.run(
+                [sys.executable, __file__, "--run-child", mode, str(input_path), str(output_path)],
+                check=True,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.DEVNULL,
+                text=True,
+            )
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+
+        with xopen(pathlib.Path(tmpdir) / "buffered-prompts.jsonl.gz") as buffered_fin, xopen(
+            pathlib.Path(tmpdir) / "streaming-prompts.jsonl.gz"
+        ) as streaming_fin:
+            if buffered_fin.read() != streaming_fin.read():
+                raise ValueError("Streaming and buffered outputs differ")
+
+    for result in results:
+        logger.info(f"{result['mode']:>9}: peak RSS {result['peak_rss_mib']:.1f} MiB, {result['seconds']:.1f}s")
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 5 and sys.argv[1] == "--run-child":
+        run_child(*sys.argv[2:])
+        sys.exit(0)
+
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--num-examples", help="# of synthetic examples to generate", type=int, default=100000)
+    parser.add_argument("--num-documents", help="# of documents per synthetic example", type=int, default=10)
+    parser.add_argument("--num-words", help="# of words per synthetic document", type=int, default=60)
+    args = parser.parse_args()
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(args.num_examples, args.num_documents, args.num_words)
+    logger.info("finished running %s", sys.argv[0])
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""Compare rendering KV retrieval prompts with `KVRecords` against the old per-prompt approach.
+
+For each example, prompts are rendered with the key's record at `--num-positions` evenly-spaced
+positions (as when sweeping the gold index). The old approach copies the records, finds the key's record
+with `list.index`, moves it with `pop`/`insert`, and validates and formats every record for every prompt.
+`KVRecords` validates and formats the records of an example once, and splices them for each position.
+Times are per prompt; the prompts of both approaches are checked to be identical.
+
+Running:
+
+```
+python -u ./scripts/benchmark_kv_prompts.py --num-keys 75 140 1000 5000
+```
+
+"""
+import argparse
+import logging
+import sys
+import time
+from copy import deepcopy
+
+from lost_in_the_middle.kv_data import generate_kv_chunk, get_kv_examples
+from lost_in_the_middle.prompting import (
+    KVRecords,
+    format_kv_records,
+    get_prompt_template,
+)
+
+logger = logging.getLogger(__name__)
+
+
+def render_prompt_old(input_example, gold_index):
+    ordered_kv_records = deepcopy(input_example["ordered_kv_records"])
+    key = input_example["key"]
+    original_kv = ordered_kv_records.pop(ordered_kv_records.index([key, input_example["value"]]))
+    ordered_kv_records.insert(gold_index, original_kv)
+    if key not in [x[0] for x in ordered_kv_records]:
+        raise ValueError(f"Did not find provided `key` {key}")
+    if len(ordered_kv_records) != len(set([x[0] for x in ordered_kv_records])):
+        raise ValueError("`data` has duplicate keys")
+    return get_prompt_template("kv_retrieval.prompt").render(
+        formatted_kv_records=format_kv_records(ordered_kv_records), key=key
+    )
+
+
+def render_prompts_new(input_example, gold_indices):
+    kv_records = KVRecords(input_example["ordered_kv_records"], input_example["key"])
+    return [kv_records.render_prompt(gold_index=gold_index) for gold_index in gold_indices]
+
+
+def main(num_keys, num_examples, num_positions):
+    logger.info(f"{'keys':>6} {'old (us/prompt)':>16} {'KVRecords (us/prompt)':>22} {'speedup':>8}")
+    for num_example_keys in num_keys:
+        examples = get_kv_examples(generate_kv_chunk(0, 0, num_examples, num_example_keys))
+        gold_indices = sorted(
+            {round(i * (num_example_keys - 1) / max(1, num_positions - 1)) for i in range(num_positions)}
+        )
+        num_prompts = num_examples * len(gold_indices)
+
+        start = time.perf_counter()
+        old_prompts = [render_prompt_old(example, gold_index) for example in examples for gold_index in gold_indices]
+        old_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        new_prompts = [prompt for example in examples for prompt in render_prompts_new(example, gold_indices)]
+        new_seconds = time.perf_counter() - start
+
+        if old_prompts != new_prompts:
+            raise ValueError("KVRecords and the old approach render different prompts")
+        logger.info(
+            f"{num_example_keys:>6} {old_seconds * 1e6 / num_prompts:>16.1f} {new_seconds * 1e6 / num_prompts:>22.1f} "
+            f"{old_seconds / new_seconds:>8.2f}"
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--num-keys", help="Numbers of keys per example", type=int, nargs="+", default=[75, 140, 1000, 5000]
+    )
+    parser.add_argument("--num-examples", help="# of examples per number of keys", type=int, default=20)
+    parser.add_argument("--num-positions", help="# of gold positions to render each example at", type=int, default=5)
+    args = parser.parse_args()
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(args.num_keys, args.num_examples, args.num_positions)
+    logger.info("finished running %s", sys.argv[0])
@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+"""Benchmark the prefill time saved by reusing the past key/values of the prefix shared by every prompt.
+
+Runs a small randomly-initialized Llama on CPU, so it needs no downloads. Prompts are either read from a
+prompts file and tokenized with `--tokenizer`, or synthetic: `--prefix-tokens` shared tokens followed by
+a random number of random tokens. Prefill is timed as `generate` with a single new token (including the
+copy of the cached prefix for each batch), and the greedy outputs of both approaches are checked to be
+identical.
+
+Running:
+
+```
+python -u ./scripts/benchmark_prefix_cache.py --prefix-tokens 64 --min-suffix-tokens 64 --max-suffix-tokens 512
+python -u ./scripts/benchmark_prefix_cache.py \
+    --input-path qa_prompts/open_oracle/simplified_prompts.jsonl.gz \
+    --tokenizer meta-llama/Llama-2-7b-chat-hf
+```
+
+"""
+import argparse
+import json
+import logging
+import random
+import sys
+import time
+
+import torch
+from transformers import LlamaConfig, LlamaForCausalLM
+from xopen import xopen
+
+from lost_in_the_middle.batching import get_batches
+from lost_in_the_middle.prefix_cache import SharedPrefixCache, get_shared_prefix
+
+logger = logging.getLogger(__name__)
+
+PAD_TOKEN_ID = 0
+
+
+def main(
+    input_path,
+    tokenizer_name,
+    num_prompts,
+    prefix_tokens,
+    min_suffix_tokens,
+    max_suffix_tokens,
+    batch_size,
+    max_new_tokens,
+    hidden_size,
+    num_hidden_layers,
+):
+    if input_path:
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        with xopen(input_path) as fin:
+            prompts = [json.loads(line)["prompt"] for line, _ in zip(fin, range(num_prompts))]
+        all_prompt_input_ids = tokenizer(prompts)["input_ids"]
+        vocab_size = len(tokenizer)
+    else:
+        rng = random.Random(0)
+        vocab_size = 32000
+        prefix = [rng.randrange(1, vocab_size) for _ in range(prefix_tokens)]
+        all_prompt_input_ids = [
+            prefix + [rng.randrange(1, vocab_size) for _ in range(rng.randint(min_suffix_tokens, max_suffix_tokens))]
+            for _ in range(num_prompts)
+        ]
+
+    torch.manual_seed(0)
+    config = LlamaConfig(
+        vocab_size=vocab_size,
+        hidden_size=hidden_size,
+        intermediate_size=4 * hidden_size,
+        num_hidden_layers=num_hidden_layers,
+        num_attention_heads=hidden_size // 32,
+        num_key_value_heads=hidden_size // 32,
+        max_position_embeddings=max(len(input_ids) for input_ids in all_prompt_input_ids) + max_new_tokens,
+        pad_token_id=PAD_TOKEN_ID,
+    )
+    model = LlamaForCausalLM(config).eval()
+
+    prompt_lengths = [len(input_ids) for input_ids in all_prompt_input_ids]
+    batches = get_batches(prompt_lengths, batch_size)
+    shared_prefix = get_shared_prefix(all_prompt_input_ids)
+    shared_fraction = len(shared_prefix) * len(prompt_lengths) / sum(prompt_lengths)
+    logger.info(
+        f"{len(all_prompt_input_ids)} prompts of {sum(prompt_lengths) / len(prompt_lengths):.0f} tokens on average "
+        f"share a {len(shared_prefix)}-token prefix ({shared_fraction:.1%} of prompt tokens)"
+    )
+    if not shared_prefix:
+        return
+
+    start = time.perf_counter()
+    prefix_cache = SharedPrefixCache(model, shared_prefix)
+    prefix_seconds = time.perf_counter() - start
+
+    timings = {"full prefill": 0.0, "cached prefix": prefix_seconds}
+    for batch in batches:
+        batch_input_ids = [all_prompt_input_ids[index] for index in batch]
+        full_inputs = left_pad(batch_input_ids)
+        _, full_seconds = timed_generate(model, full_inputs, 1)
+        timings["full prefill"] += full_seconds
+        # Include copying the cache for the batch in the time.
+        start = time.perf_counter()
+        cached_inputs = prefix_cache.prepare_inputs(batch_input_ids, pad_token_id=PAD_TOKEN_ID)
+        timed_generate(model, cached_inputs, 1)
+        timings["cached prefix"] += time.perf_counter() - start
+
+        # Check that greedy outputs are the same, over more new tokens.
+        full_outputs, _ = timed_generate(model, full_inputs, max_new_tokens)
+        cached_outputs, _ = timed_generate(
+            model, prefix_cache.prepare_inputs(batch_input_ids, pad_token_id=PAD_TOKEN_ID), max_new_tokens
+        )
+        if (
+            full_outputs[:, full_inputs["input_ids"].shape[1] :].tolist()
+            != cached_outputs[:, cached_inputs["input_ids"].shape[1] :].tolist()
+        ):
+            raise ValueError("Greedy outputs with the cached prefix differ from the outputs without it")
+
+    logger.info(f"Greedy outputs ({max_new_tokens} new tokens) are identical for all {len(batches)} batches")
+    logger.info(f"Prefilling the shared prefix once took {prefix_seconds * 1000:.1f} ms")
+    for name, seconds in timings.items():
+        logger.info(f"{name:>14}: {seconds:.3f} s of prefill")
+    logger.info(f"Saved {1 - timings['cached prefix'] / timings['full prefill']:.1%} of prefill time")
+
+
+def left_pad(batch_input_ids):
+    max_length = max(len(input_ids) for input_ids in batch_input_ids)
+    input_ids = torch.tensor(
+        [[PAD_TOKEN_ID] * (max_length - len(input_ids)) + list(input_ids) for input_ids in batch_input_ids]
+    )
+    attention_mask = torch.tensor(
+        [[0] * (max_length - len(input_ids)) + [1] * len(input_ids) for input_ids in batch_input_ids]
+    )
+    return {"input_ids": input_ids, "attention_mask": attention_mask}
+
+
+def timed_generate(model, inputs, max_new_tokens):
+    start = time.perf_counter()
+    with torch.no_grad():
+        outputs = model.generate(
+            **inputs, max_new_tokens=max_new_tokens, do_sample=False, pad_token_id=PAD_TOKEN_ID, eos_token_id=None
+        )
+    return outputs, time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-path", help="Prompts file to take prompts from. Otherwise, prompts are synthetic.")
+    parser.add_argument("--tokenizer", help="Tokenizer for the prompts in --input-path")
+    parser.add_argument("--num-prompts", help="# of prompts to benchmark", type=int, default=64)
+    parser.add_argument("--prefix-tokens", help="Synthetic prompts: # of shared prefix tokens", type=int, default=64)
+    parser.add_argument("--min-suffix-tokens", help="Synthetic prompts: min # of other tokens", type=int, default=64)
+    parser.add_argument("--max-suffix-tokens", help="Synthetic prompts: max # of other tokens", type=int, default=512)
+    parser.add_argument("--batch-size", help="Batch size", type=int, default=8)
+    parser.add_argument("--max-new-tokens", help="# of new tokens to compare greedy outputs on", type=int, default=16)
+    parser.add_argument("--hidden-size", help="Hidden size of the random Llama", type=int, default=256)
+    parser.add_argument("--num-hidden-layers", help="# of layers of the random Llama", type=int, default=4)
+    args = parser.parse_args()
+    if args.input_path and not args.tokenizer:
+        parser.error("--tokenizer is required with --input-path")
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(
+        args.input_path,
+        args.tokenizer,
+        args.num_prompts,
+        args.prefix_tokens,
+        args.min_suffix_tokens,
+        args.max_suffix_tokens,
+        args.batch_size,
+        args.max_new_tokens,
+        args.hidden_size,
+        args.num_hidden_layers,
+    )
+    logger.info("finished running %s", sys.argv[0])
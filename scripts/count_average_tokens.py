@@ -1,29 +1,266 @@
-import json
+#!/usr/bin/env python3
+"""Token length statistics of the prompts in a (possibly gzipped) JSONL file.
+
+Works on prompt files (records with a `prompt`, e.g., from `generate_simplified_prompts.py`) and on
+`qa_data` files (records with a `question` and `ctxs`), whose prompts are rendered with the QA prompt
+template. Prompts are tokenized in batches with a fast tokenizer, one chunk of the input at a time,
+optionally in several processes. Reports the mean, p50/p95/p99 and max length, a length histogram, and
+the number of prompts that don't fit in `--context-length` tokens.
+
+Running:
+
+```
+python -u ./scripts/count_average_tokens.py ./qa_prompts/open_oracle/simplified_prompts.jsonl.gz \
+    --tokenizer meta-llama/Llama-2-7b-chat-hf \
+    --context-length 4096
+```
+
+Without `--tokenizer`, tokens are whitespace-separated words (as in earlier versions of this script),
+which underestimates the number of model tokens.
+"""
 import argparse
+import itertools
+import json
+import logging
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from tqdm import tqdm
 from xopen import xopen
 
-def calculate_average_tokens(file_path):
-    total_tokens = 0
-    num_prompts = 0
-
-    with xopen(file_path) as fin:  # Open gzip file
-        for line in fin:  # Load the entire JSON file as a single JSON object
-            data = json.loads(line)
-            # Iterate over each question-prompt pair in the JSON object
-            prompt = data.get('prompt')
-            tokens = prompt.split()
-            total_tokens += len(tokens)
-            num_prompts += 1
-
-    return total_tokens / num_prompts if num_prompts > 0 else 0
-
-def main():
-    parser = argparse.ArgumentParser(description='Calculate the average number of tokens per prompt in a JSONL.GZ file.')
-    parser.add_argument('file_path', help='Path to the JSONL.GZ file')
-    
-    args = parser.parse_args()
-    average_tokens = calculate_average_tokens(args.file_path)
-    print(f"Average number of tokens per prompt: {average_tokens}")
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+src_dir = os.path.join(parent_dir, "src")
+sys.path.append(src_dir)
+
+from lost_in_the_middle.passage_store import PassageStore  # noqa: E402
+from lost_in_the_middle.prompting import (  # noqa: E402
+    DocumentBatch,
+    render_closedbook_qa_prompts,
+    render_qa_prompts,
+)
+
+logger = logging.getLogger(__name__)
+
+PERCENTILES = [50, 95, 99]
+
+# Set in each worker process (or in the main process, without workers) by `initialize_worker`.
+_worker_state = {}
+
+
+def main(
+    input_path,
+    tokenizer_name,
+    context_length,
+    chunk_size,
+    num_workers,
+    num_bins,
+    closedbook,
+    prompt_mention_random_ordering,
+    query_aware_contextualization,
+    passage_store_path,
+):
+    lengths = count_tokens(
+        input_path,
+        tokenizer_name,
+        chunk_size,
+        num_workers,
+        closedbook,
+        prompt_mention_random_ordering,
+        query_aware_contextualization,
+        passage_store_path,
+    )
+    if not len(lengths):
+        logger.info(f"Found no prompts in {input_path}")
+        return
+    unit = "tokens" if tokenizer_name else "whitespace-separated words"
+    logger.info(f"Counted {unit} in {len(lengths)} prompts")
+    logger.info(f"Average number of {unit} per prompt: {lengths.mean()}")
+    percentile_values = np.percentile(lengths, PERCENTILES)
+    logger.info(
+        f"{unit.capitalize()} per prompt: "
+        + ", ".join(f"p{percentile}={value:.0f}" for percentile, value in zip(PERCENTILES, percentile_values))
+        + f", min={lengths.min()}, max={lengths.max()}"
+    )
+    if context_length is not None:
+        num_over_context_length = int((lengths > context_length).sum())
+        logger.info(
+            f"{num_over_context_length} prompts ({num_over_context_length / len(lengths):.2%}) "
+            f"have more than {context_length} {unit}"
+        )
+    for line in format_histogram(lengths, num_bins):
+        logger.info(line)
+
+
+def count_tokens(
+    input_path,
+    tokenizer_name,
+    chunk_size,
+    num_workers,
+    closedbook=False,
+    prompt_mention_random_ordering=False,
+    query_aware_contextualization=False,
+    passage_store_path=None,
+):
+    """The number of tokens (or, without `tokenizer_name`, words) in the prompt of each record, in input order."""
+    worker_args = (
+        tokenizer_name,
+        closedbook,
+        prompt_mention_random_ordering,
+        query_aware_contextualization,
+        passage_store_path,
+    )
+    chunks = read_chunks(input_path, chunk_size)
+    lengths = []
+    if num_workers > 1:
+        with ProcessPoolExecutor(
+            max_workers=num_workers, initializer=initialize_worker, initargs=(*worker_args, True)
+        ) as executor:
+            # Only keep a few chunks per worker in flight, so memory stays bounded for large inputs.
+            pending = deque()
+            for chunk in chunks:
+                pending.append(executor.submit(count_chunk_tokens, chunk))
+                if len(pending) >= 2 * num_workers:
+                    lengths.append(pending.popleft().result())
+            while pending:
+                lengths.append(pending.popleft().result())
+    else:
+        # A fast tokenizer already uses every core to encode each batch.
+        initialize_worker(*worker_args, False)
+        lengths.extend(count_chunk_tokens(chunk) for chunk in chunks)
+    return np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+
+
+def read_chunks(input_path, chunk_size):
+    """Yield lists of (at most `chunk_size`) lines of the input file."""
+    with xopen(input_path) as fin:
+        lines = iter(tqdm(fin))
+        while True:
+            chunk = list(itertools.islice(lines, chunk_size))
+            if not chunk:
+                return
+            yield chunk
+
+
+def initialize_worker(
+    tokenizer_name,
+    closedbook,
+    prompt_mention_random_ordering,
+    query_aware_contextualization,
+    passage_store_path,
+    in_worker_process,
+):
+    tokenizer = None
+    if tokenizer_name:
+        if in_worker_process:
+            # Each process encodes its own batches, so don't also run the tokenizer's thread pool.
+            os.environ["TOKENIZERS_PARALLELISM"] = "false"
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(tokenizer_name)
+        if not tokenizer.is_fast:
+            logger.warning(f"Tokenizer {tokenizer_name} is not a fast tokenizer, counting will be slow")
+    _worker_state.update(
+        tokenizer=tokenizer,
+        closedbook=closedbook,
+        prompt_mention_random_ordering=prompt_mention_random_ordering,
+        query_aware_contextualization=query_aware_contextualization,
+        passage_store=PassageStore(passage_store_path, readonly=True) if passage_store_path else None,
+    )
+
+
+def count_chunk_tokens(lines):
+    """The number of tokens in the prompt of each line (a JSON record) of the chunk."""
+    prompts = get_prompts([json.loads(line) for line in lines])
+    tokenizer = _worker_state["tokenizer"]
+    if tokenizer is None:
+        return np.array([len(prompt.split()) for prompt in prompts], dtype=np.int64)
+    return np.array([len(input_ids) for input_ids in tokenizer(prompts)["input_ids"]], dtype=np.int64)
+
+
+def get_prompts(examples):
+    """The prompt of each example: its `prompt`, or a QA prompt rendered from its question and documents."""
+    if all("prompt" in example for example in examples):
+        return [example["prompt"] for example in examples]
+    if any("prompt" in example for example in examples):
+        raise ValueError("Expected either all examples or no examples to have a `prompt`")
+
+    questions = [example["question"] for example in examples]
+    if _worker_state["closedbook"]:
+        return render_closedbook_qa_prompts(questions)
+    return render_qa_prompts(
+        questions,
+        [
+            DocumentBatch.from_dicts(example["ctxs"], passage_store=_worker_state["passage_store"])
+            for example in examples
+        ],
+        mention_random_ordering=_worker_state["prompt_mention_random_ordering"],
+        query_aware_contextualization=_worker_state["query_aware_contextualization"],
+    )
+
+
+def format_histogram(lengths, num_bins, bar_width=50):
+    """Lines of a text histogram of the lengths, one per bin."""
+    counts, bin_edges = np.histogram(lengths, bins=num_bins)
+    max_count = counts.max()
+    edge_width = len(str(int(np.ceil(bin_edges[-1]))))
+    lines = []
+    for count, start, end in zip(counts.tolist(), bin_edges[:-1], bin_edges[1:]):
+        bar = "#" * int(round(bar_width * count / max_count))
+        lines.append(f"[{start:>{edge_width}.0f}, {end:>{edge_width}.0f}) {count:>8} {bar}")
+    return lines
+
 
 if __name__ == "__main__":
-    main()
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("file_path", help="Path to a (possibly gzipped) JSONL file of prompts or QA data")
+    parser.add_argument(
+        "--tokenizer",
+        help="Name or path of the (fast) Hugging Face tokenizer to count tokens with, e.g., the model's name.",
+    )
+    parser.add_argument("--context-length", help="Report the number of prompts over this many tokens", type=int)
+    parser.add_argument("--chunk-size", help="# of records to read and tokenize at a time", type=int, default=1024)
+    parser.add_argument(
+        "--num-workers",
+        help="Number of processes to tokenize with. With 1, the tokenizer's own thread pool is used.",
+        type=int,
+        default=1,
+    )
+    parser.add_argument("--num-bins", help="Number of bins in the length histogram", type=int, default=20)
+    parser.add_argument(
+        "--closedbook", action="store_true", help="For QA data, count closed-book prompts (i.e., without documents)."
+    )
+    parser.add_argument(
+        "--prompt-mention-random-ordering",
+        action="store_true",
+        help="For QA data, mention that search results are ordered randomly in the prompt",
+    )
+    parser.add_argument(
+        "--query-aware-contextualization",
+        action="store_true",
+        help="For QA data, place the question both before and after the documents.",
+    )
+    parser.add_argument(
+        "--passage-store",
+        help="Path to the passage store that the QA data was written with, to resolve `passage_id` references.",
+    )
+    args = parser.parse_args()
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(
+        args.file_path,
+        args.tokenizer,
+        args.context_length,
+        args.chunk_size,
+        args.num_workers,
+        args.num_bins,
+        args.closedbook,
+        args.prompt_mention_random_ordering,
+        args.query_aware_contextualization,
+        args.passage_store,
+    )
+    logger.info("finished running %s", sys.argv[0])
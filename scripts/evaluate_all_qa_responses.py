@@ -0,0 +1,220 @@
+#!/usr/bin/env python3
+"""Evaluate every QA predictions file under a directory, and aggregate position curves.
+
+Settings are inferred from each file's path, following the naming in EXPERIMENTS.md:
+- the number of documents from a `<N>_total_documents` directory (or `closed_book` / `open_oracle`),
+- the gold index from `gold_at_<i>`, or from each record's `new_gold_index` for randomized runs,
+- Unlimiformer runs from `-uf-`, and the Unlimiformer layer from a trailing `-<layer>` suffix.
+
+Files are scored concurrently in a process pool. Per-file results are cached by content hash (and the gold
+index in the file name), so unchanged files are never rescored.
+
+Running:
+
+```
+python -u ./scripts/evaluate_all_qa_responses.py \
+    --input-dir qa_predictions \
+    --output-path qa_predictions/position_curves.tsv
+```
+
+"""
+import argparse
+import hashlib
+import json
+import logging
+import os
+import pathlib
+import re
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from xopen import xopen
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+parent_dir = os.path.dirname(script_dir)
+src_dir = os.path.join(parent_dir, "src")
+sys.path.append(src_dir)
+
+from lost_in_the_middle.metrics import best_subspan_em_batch  # noqa: E402
+
+logger = logging.getLogger(__name__)
+
+METRICS = [
+    (best_subspan_em_batch, "best_subspan_em"),
+]
+# Bump when scoring changes, to invalidate cached per-file results.
+CACHE_VERSION = 1
+OUTPUT_COLUMNS = [
+    "setting",
+    "num_total_documents",
+    "model",
+    "unlimiformer",
+    "layer",
+    "gold_index",
+    "metric",
+    "value",
+    "num_examples",
+]
+
+
+def main(input_dir, output_path, cache_dir, num_workers):
+    input_dir = pathlib.Path(input_dir)
+    cache_dir = pathlib.Path(cache_dir) if cache_dir else input_dir / ".evaluation_cache"
+    cache_dir.mkdir(parents=True, exist_ok=True)
+
+    predictions_paths = discover_predictions_paths(input_dir)
+    logger.info(f"Found {len(predictions_paths)} predictions files under {input_dir}")
+
+    rows = []
+    num_cached = 0
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        futures = {executor.submit(evaluate_file_with_cache, path, cache_dir): path for path in predictions_paths}
+        for future in as_completed(futures):
+            path = futures[future]
+            file_results, was_cached = future.result()
+            num_cached += was_cached
+            logger.info(f"{'Loaded cached results for' if was_cached else 'Scored'} {path}")
+            file_settings = infer_settings(path.relative_to(input_dir))
+            for gold_index, metric_name, value, num_examples in file_results:
+                rows.append(
+                    dict(
+                        file_settings, gold_index=gold_index, metric=metric_name, value=value, num_examples=num_examples
+                    )
+                )
+    logger.info(f"Scored {len(predictions_paths) - num_cached} files, {num_cached} were cached")
+
+    rows.sort(key=lambda row: (row["setting"], row["metric"], row["gold_index"]))
+    write_table(rows, output_path)
+    for row in rows:
+        logger.info(
+            f"{row['setting']} gold_index={row['gold_index']} {row['metric']}={row['value']:.4f} "
+            f"(n={row['num_examples']})"
+        )
+
+
+def discover_predictions_paths(input_dir):
+    # Skip outputs of the evaluation scripts, which are written next to the predictions.
+    return sorted(
+        path
+        for path in input_dir.rglob("*.jsonl*")
+        if "-scored" not in path.name and ".evaluation_cache" not in path.parts
+    )
+
+
+def infer_settings(relative_path):
+    """Infer the experimental setting of a predictions file from its path (relative to the input directory)."""
+    name = relative_path.name.split(".jsonl")[0]
+    directory = relative_path.parent.as_posix()
+
+    num_total_documents_match = re.search(r"(\d+)_total_documents", directory)
+    if num_total_documents_match:
+        num_total_documents = int(num_total_documents_match.group(1))
+    elif "open_oracle" in directory:
+        num_total_documents = 1
+    elif "closed_book" in directory:
+        num_total_documents = 0
+    else:
+        num_total_documents = -1
+
+    unlimiformer = "-uf-" in f"-{name}-"
+    layer_match = re.search(r"-predictions-(\d+)$", name)
+    model_match = re.search(r"(?:^|-)(?:uf-)?([^-]+)-predictions", name)
+    # The gold index is part of the setting's name, so it's dropped from it here.
+    setting_name = re.sub(r"-?gold_at_\d+", "", name)
+    return {
+        "setting": f"{directory}/{setting_name}" if directory != "." else setting_name,
+        "num_total_documents": num_total_documents,
+        "model": model_match.group(1) if model_match else "unknown",
+        "unlimiformer": unlimiformer,
+        "layer": int(layer_match.group(1)) if layer_match else -1,
+    }
+
+
+def infer_file_gold_index(path):
+    gold_index_match = re.search(r"gold_at_(\d+)", pathlib.Path(path).name)
+    return int(gold_index_match.group(1)) if gold_index_match else None
+
+
+def hash_file(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def evaluate_file_with_cache(path, cache_dir):
+    """Returns the per-file results and whether they were loaded from the cache."""
+    # Results hold the gold index from the file name, so files with the same content and different
+    # `gold_at_<i>` names have different cache entries.
+    gold_index = infer_file_gold_index(path)
+    cache_key = f"{hash_file(path)}-gold_at_{'none' if gold_index is None else gold_index}-v{CACHE_VERSION}"
+    cache_path = pathlib.Path(cache_dir) / f"{cache_key}.json"
+    if cache_path.exists():
+        with open(cache_path) as f:
+            return [tuple(row) for row in json.load(f)], True
+
+    file_results = evaluate_file(path)
+    # Write to a temporary file first, so concurrent runs never read a partial cache entry.
+    temporary_cache_path = cache_path.with_suffix(f".{os.getpid()}.tmp")
+    with open(temporary_cache_path, "w") as f:
+        json.dump(file_results, f)
+    os.replace(temporary_cache_path, cache_path)
+    return file_results, False
+
+
+def evaluate_file(path):
+    """Score a predictions file, returning (gold_index, metric_name, mean value, num_examples) per gold index."""
+    file_gold_index = infer_file_gold_index(path)
+    gold_indices = []
+    model_answers = []
+    gold_answers = []
+    with xopen(path) as fin:
+        for line in fin:
+            example = json.loads(line)
+            gold_index = example.get("new_gold_index")
+            if gold_index is None:
+                gold_index = file_gold_index if file_gold_index is not None else -1
+            gold_indices.append(gold_index)
+            # NOTE: we take everything up to the first newline, same as `evaluate_qa_responses.py`.
+            model_answers.append(example["model_answer"].split("\n")[0].strip())
+            gold_answers.append(example["answers"])
+
+    file_results = []
+    for (metric, metric_name) in METRICS:
+        totals = {}
+        for gold_index, value in zip(gold_indices, metric(predictions=model_answers, ground_truths=gold_answers)):
+            total, count = totals.get(gold_index, (0.0, 0))
+            totals[gold_index] = (total + value, count + 1)
+        for gold_index, (total, count) in sorted(totals.items()):
+            file_results.append((gold_index, metric_name, total / count, count))
+    return file_results
+
+
+def write_table(rows, output_path):
+    pathlib.Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+    with xopen(output_path, "w") as f:
+        f.write("\t".join(OUTPUT_COLUMNS) + "\n")
+        for row in rows:
+            f.write("\t".join(str(row[column]) for column in OUTPUT_COLUMNS) + "\n")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input-dir", help="Directory to search for predictions files.", default="qa_predictions")
+    parser.add_argument(
+        "--output-path",
+        help="Path to write the aggregated table (setting x gold index x metric) as TSV.",
+        required=True,
+    )
+    parser.add_argument(
+        "--cache-dir",
+        help="Directory for per-file cached results. Defaults to `.evaluation_cache` in the input directory.",
+    )
+    parser.add_argument("--num-workers", help="Number of processes to score files with", type=int, default=None)
+    args = parser.parse_args()
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(args.input_dir, args.output_path, args.cache_dir, args.num_workers)
+    logger.info("finished running %s", sys.argv[0])
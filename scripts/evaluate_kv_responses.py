@@ -11,10 +11,12 @@ from copy import deepcopy
 from tqdm import tqdm
 from xopen import xopen
 
+from lost_in_the_middle.results import get_model_settings, write_results_table
+
 logger = logging.getLogger(__name__)
 
 
-def main(input_path, output_path):
+def main(input_path, output_path, columnar_output_path):
     all_examples = []
     with xopen(input_path) as fin:
         for line in tqdm(fin):
@@ -46,6 +48,30 @@ def main(input_path, output_path):
                     example_with_metrics[f"metric_{metric_name}"] = metric_value
                 f.write(json.dumps(example_with_metrics) + "\n")
 
+    if columnar_output_path:
+        write_columnar_output(all_example_metrics, columnar_output_path)
+
+
+def write_columnar_output(all_example_metrics, columnar_output_path):
+    columns = {
+        "key": [example["key"] for (_, example) in all_example_metrics],
+        "gold_index": [get_gold_index(example) for (_, example) in all_example_metrics],
+        "model": [example.get("model") for (_, example) in all_example_metrics],
+        "settings": [get_model_settings(example) for (_, example) in all_example_metrics],
+        "model_answer": [example["model_answer"] for (_, example) in all_example_metrics],
+    }
+    for metric_name in ["accuracy"]:
+        columns[f"metric_{metric_name}"] = [
+            example_metrics[metric_name] for (example_metrics, _) in all_example_metrics
+        ]
+    write_results_table(columnar_output_path, columns)
+
+
+def get_gold_index(example):
+    """Position of the KV pair to retrieve in the prompt."""
+    kv_records = example.get("model_ordered_kv_records", example["ordered_kv_records"])
+    return kv_records.index([example["key"], example["value"]])
+
 
 if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
@@ -55,7 +81,14 @@ if __name__ == "__main__":
         "--output-path",
         help="Path to write data with model predictions, answers, and scores.",
     )
+    parser.add_argument(
+        "--columnar-output-path",
+        help=(
+            "Path to write a columnar (.npz) table of key, gold index, model, settings, answer and "
+            "metric values, without the KV records. Load it with `lost_in_the_middle.results.ResultsTable`."
+        ),
+    )
     args = parser.parse_args()
     logger.info("running %s", " ".join(sys.argv))
-    main(args.input_path, args.output_path)
+    main(args.input_path, args.output_path, args.columnar_output_path)
     logger.info("finished running %s", sys.argv[0])
@@ -4,10 +4,9 @@
 import argparse
 import json
 import logging
+import os
 import statistics
 import sys
-import os
-from copy import deepcopy
 
 import matplotlib.pyplot as plt
 from tqdm import tqdm
@@ -15,19 +14,23 @@ from xopen import xopen
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(script_dir)
-src_dir = os.path.join(parent_dir, 'src')
+src_dir = os.path.join(parent_dir, "src")
 sys.path.append(src_dir)
 
-from lost_in_the_middle.metrics import best_subspan_em
+from lost_in_the_middle.metrics import best_subspan_em_batch  # noqa: E402
+from lost_in_the_middle.results import (  # noqa: E402
+    get_model_settings,
+    write_results_table,
+)
 
 logger = logging.getLogger(__name__)
 
 METRICS = [
-    (best_subspan_em, "best_subspan_em"),
+    (best_subspan_em_batch, "best_subspan_em"),
 ]
 
 
-def main(input_path, output_path, score_by_new_gold_index):
+def main(input_path, output_path, columnar_output_path, score_by_new_gold_index, num_workers):
     all_examples = []
     examples_by_new_gold_index = {}  # To store examples by their new_gold_index
     metric_values_by_new_gold_index = {}  # To store metric values by their new_gold_index
@@ -36,13 +39,17 @@ def main(input_path, output_path, score_by_new_gold_index):
         for line in tqdm(fin):
             input_example = json.loads(line)
             all_examples.append(input_example)
-            if score_by_new_gold_index:
-                new_gold_index = input_example.get("new_gold_index")
-                if new_gold_index is not None:
-                    examples_by_new_gold_index.setdefault(new_gold_index, []).append(input_example)
+
+    # Score every example once; the groupings below only average the precomputed scores.
+    all_example_metrics = get_metrics_for_examples(all_examples, num_workers)
+    if score_by_new_gold_index:
+        for example_metrics in all_example_metrics:
+            new_gold_index = example_metrics[1].get("new_gold_index")
+            if new_gold_index is not None:
+                examples_by_new_gold_index.setdefault(new_gold_index, []).append(example_metrics)
 
     # Compute and log overall metrics
-    log_metrics(all_examples, "Overall")
+    log_metrics(all_example_metrics, "Overall")
 
     if score_by_new_gold_index:
         # Sort and log metrics per new_gold_index
@@ -53,30 +60,32 @@ def main(input_path, output_path, score_by_new_gold_index):
 
         plot_metrics(metric_values_by_new_gold_index)
 
-
     if output_path:
         # Write examples with metrics to output file
-        write_output(all_examples, output_path)
+        write_output(all_example_metrics, output_path)
+
+    if columnar_output_path:
+        write_columnar_output(all_example_metrics, columnar_output_path)
 
 
-def get_metrics_for_example(example):
-    gold_answers = example["answers"]
-    model_answer = example["model_answer"]
+def get_metrics_for_examples(examples, num_workers=1):
+    gold_answers = [example["answers"] for example in examples]
 
     # NOTE: we take everything up to the first newline, since otherwise models could hack
     # the metric by simply copying te input context (as the gold answer is guaranteed
     # to occur in the input context).
-    model_answer = model_answer.split("\n")[0].strip()
+    model_answers = [example["model_answer"].split("\n")[0].strip() for example in examples]
 
-    example_metrics = {}
+    all_example_metrics = [({}, example) for example in examples]
     for (metric, metric_name) in METRICS:
-        example_metrics[metric_name] = metric(prediction=model_answer, ground_truths=gold_answers)
-    return (example_metrics, example)
+        metric_values = metric(predictions=model_answers, ground_truths=gold_answers, num_workers=num_workers)
+        for (example_metrics, _), metric_value in zip(all_example_metrics, metric_values):
+            example_metrics[metric_name] = metric_value
+    return all_example_metrics
 
 
-def log_metrics(examples, label):
+def log_metrics(all_example_metrics, label):
     logger.info(f"Computing metrics for {label}")
-    all_example_metrics = [get_metrics_for_example(example) for example in examples]
 
     metric_averages = {}
 
@@ -98,18 +107,44 @@ def plot_metrics(metric_values_by_new_gold_index):
         values = [metric_values_by_new_gold_index[idx][metric_label] for idx in sorted(metric_values_by_new_gold_index)]
 
         plt.figure()
-        plt.plot(sorted(metric_values_by_new_gold_index.keys()), values, marker='o')
-        plt.title(f'Metric: {metric_label}')
-        plt.xlabel('new_gold_index')
+        plt.plot(sorted(metric_values_by_new_gold_index.keys()), values, marker="o")
+        plt.title(f"Metric: {metric_label}")
+        plt.xlabel("new_gold_index")
         plt.ylabel(metric_label)
         plt.grid(True)
         plt.show()
 
 
-def write_output(examples, output_path):
+def write_output(all_example_metrics, output_path):
     with xopen(output_path, "w") as f:
-        for example in examples:
-            f.write(json.dumps(example) + "\n")
+        for (example_metrics, example) in all_example_metrics:
+            example_with_metrics = dict(example)
+            for metric_name, metric_value in example_metrics.items():
+                example_with_metrics[f"metric_{metric_name}"] = metric_value
+            f.write(json.dumps(example_with_metrics) + "\n")
+
+
+def write_columnar_output(all_example_metrics, columnar_output_path):
+    columns = {
+        "question": [example["question"] for (_, example) in all_example_metrics],
+        "gold_index": [get_gold_index(example) for (_, example) in all_example_metrics],
+        "model": [example.get("model") for (_, example) in all_example_metrics],
+        "settings": [get_model_settings(example) for (_, example) in all_example_metrics],
+        "model_answer": [example["model_answer"] for (_, example) in all_example_metrics],
+    }
+    for (_, metric_name) in METRICS:
+        columns[f"metric_{metric_name}"] = [
+            example_metrics[metric_name] for (example_metrics, _) in all_example_metrics
+        ]
+    write_results_table(columnar_output_path, columns)
+
+
+def get_gold_index(example):
+    """Position of the gold document in the prompt, or -1 if it can't be determined."""
+    if example.get("new_gold_index") is not None:
+        return example["new_gold_index"]
+    documents = example.get("model_documents") or example.get("ctxs") or []
+    return next((idx for idx, document in enumerate(documents) if document.get("isgold")), -1)
 
 
 if __name__ == "__main__":
@@ -121,9 +156,18 @@ if __name__ == "__main__":
         help="Path to write data with model predictions, answers, and scores.",
     )
     parser.add_argument(
-        "--score-by-new-gold-index",
-        action="store_true",
-        help="Calculate scores per new_gold_index."
+        "--columnar-output-path",
+        help=(
+            "Path to write a columnar (.npz) table of question, gold index, model, settings, answer and "
+            "metric values, without the documents. Load it with `lost_in_the_middle.results.ResultsTable`."
+        ),
+    )
+    parser.add_argument("--score-by-new-gold-index", action="store_true", help="Calculate scores per new_gold_index.")
+    parser.add_argument(
+        "--num-workers",
+        help="Number of processes to use for scoring. Only worthwhile for very large prediction files.",
+        type=int,
+        default=1,
     )
     args = parser.parse_args()
 
@@ -131,6 +175,8 @@ if __name__ == "__main__":
     main(
         args.input_path,
         args.output_path,
+        args.columnar_output_path,
         args.score_by_new_gold_index,
+        args.num_workers,
     )
     logger.info("finished running %s", sys.argv[0])
@@ -8,7 +8,8 @@
 #         --max-memory-per-gpu 32 \
 #         --num-gpus 1 \
 #         --model TheBloke/Llama-2-7B-chat-GPTQ  \
-#         --output-path qa_predictions/10_total_documents/nq-open-10_total_documents_gold_at_${gold_index}-unlimiformer-llama-2-7b-chat-gptq-predictions.jsonl.gz
+#         --output-path qa_predictions/10_total_documents/\
+# nq-open-10_total_documents_gold_at_${gold_index}-unlimiformer-llama-2-7b-chat-gptq-predictions.jsonl.gz
 # done
 """Given a data file with questions and retrieval results to use, run GPT2 to get responses.
 
@@ -19,41 +20,31 @@ The retrieval results are used in the exact order that they're given.
 import argparse
 import json
 import logging
+import os
 import pathlib
 import random
 import sys
-import os
-from copy import deepcopy
 
 from tqdm import tqdm
 from xopen import xopen
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 parent_dir = os.path.dirname(script_dir)
-src_dir = os.path.join(parent_dir, 'src')
+src_dir = os.path.join(parent_dir, "src")
 sys.path.append(src_dir)
 
-from lost_in_the_middle.prompting import (
-    Document,
+from lost_in_the_middle.passage_store import PassageStore  # noqa: E402
+from lost_in_the_middle.prompting import (  # noqa: E402
+    DocumentBatch,
+    TokenCounter,
     get_closedbook_qa_prompt,
     get_qa_prompt,
+    pack_qa_prompt,
 )
 
 logger = logging.getLogger(__name__)
 random.seed(0)
 
-# python src/run_generation.py 
-# --model_type llama 
-# --model_name_or_path TheBloke/Llama-2-7B-chat-GPTQ 
-# --prefix "<s>[INST] <<SYS>>\n You are a helpful assistant. Answer with detailed responses according 
-# to the entire instruction or question. \n<</SYS>>\n\n Summarize the following book: "  
-# --prompt example_inputs/harry_potter.txt 
-# --suffix " [/INST]" 
-# --test_unlimiformer 
-# --length 200 
-# --layer_begin 16 
-# --use_datastore False
-
 
 def main(
     input_path,
@@ -64,79 +55,170 @@ def main(
     use_all_random_ordering,
     query_aware_contextualization,
     output_path,
+    validate_documents=False,
+    passage_store_path=None,
+    max_prompt_tokens=None,
+    trim_documents=False,
+    tokenizer_name=None,
 ):
     # Create directory for output path if it doesn't exist.
     pathlib.Path(output_path).parent.mkdir(parents=True, exist_ok=True)
 
-    examples = []
-    prompts = {}
-    all_model_documents = []
-    did_format_warn = False
+    token_counter = None
+    if max_prompt_tokens is not None:
+        from transformers import AutoTokenizer
+
+        token_counter = TokenCounter(AutoTokenizer.from_pretrained(tokenizer_name or model_name))
+
+    num_output_prompts = 0
+    passage_store = PassageStore(passage_store_path, readonly=True) if passage_store_path else None
+    # Stream examples through the pipeline, so that only the current example is ever held in memory.
+    with xopen(output_path, "w") as fout:
+        for prompt_record in generate_prompt_records(
+            read_examples(input_path),
+            model_name=model_name,
+            closedbook=closedbook,
+            prompt_mention_random_ordering=prompt_mention_random_ordering,
+            use_random_ordering=use_random_ordering,
+            use_all_random_ordering=use_all_random_ordering,
+            query_aware_contextualization=query_aware_contextualization,
+            validate_documents=validate_documents,
+            passage_store=passage_store,
+            token_counter=token_counter,
+            max_prompt_tokens=max_prompt_tokens,
+            trim_documents=trim_documents,
+        ):
+            fout.write(json.dumps(prompt_record) + "\n")
+            num_output_prompts += 1
+    if passage_store is not None:
+        passage_store.close()
+    logger.info(f"Wrote {num_output_prompts} prompts")
+    if token_counter is not None:
+        logger.info(
+            f"Tokenized {token_counter.num_misses} distinct texts for packing, "
+            f"{token_counter.num_hits} token counts were cached"
+        )
 
-    # Fetch all of the prompts
+
+def read_examples(input_path):
+    """Yield the input examples of a (possibly gzipped) JSONL file one at a time."""
     with xopen(input_path) as fin:
         for line in tqdm(fin):
-            input_example = json.loads(line)
-            # Get the prediction for the input example
-            question = input_example["question"]
-            answers = input_example["answers"]
-            if closedbook:
-                documents = []
-            else:
-                documents = []
-                for ctx in deepcopy(input_example["ctxs"]):
-                    documents.append(Document.from_dict(ctx))
-                if not documents:
-                    raise ValueError(f"Did not find any documents for example: {input_example}")
+            yield json.loads(line)
+
+
+def generate_prompt_records(
+    input_examples,
+    model_name,
+    closedbook,
+    prompt_mention_random_ordering,
+    use_random_ordering,
+    use_all_random_ordering,
+    query_aware_contextualization,
+    validate_documents=False,
+    passage_store=None,
+    token_counter=None,
+    max_prompt_tokens=None,
+    trim_documents=False,
+):
+    """Yield one prompt record per input example, as soon as it is built.
+
+    With a `token_counter` and `max_prompt_tokens`, documents are dropped (or trimmed) to fit each prompt in
+    `max_prompt_tokens` tokens, and the record reports where each document is in the tokenized prompt.
+    """
+    seen_questions = set()
+    if "instruct" in model_name:
+        logger.warning(f"Model {model_name} appears to be an instruct model, applying instruct formatting")
+        format_prompt = format_instruct_prompt
+    elif "chat" in model_name:
+        logger.warning(f"Model {model_name} appears to be a chat model, applying chat formatting")
+        format_prompt = format_chat_prompt
+    else:
+        format_prompt = None
 
+    for input_example in input_examples:
+        # Get the prediction for the input example
+        question = input_example["question"]
+        answers = input_example["answers"]
+        if question in seen_questions:
+            # Prompts are identified by their question, so only the first occurrence is kept. The skipped
+            # example still shuffles as many documents as it has, so that the documents of the examples after
+            # it are ordered the same as if it wasn't skipped.
+            logger.warning(f"Skipping example with duplicate question: {question}")
+            ctxs = [] if closedbook else input_example["ctxs"]
             if use_random_ordering:
-                # Randomly order only the distractors (isgold is False), keeping isgold documents
-                # at their existing index.
-                (original_gold_index,) = [idx for idx, doc in enumerate(documents) if doc.isgold is True]
-                original_gold_document = documents[original_gold_index]
-                distractors = [doc for doc in documents if doc.isgold is False]
-                random.shuffle(distractors)
-                distractors.insert(original_gold_index, original_gold_document)
-                documents = distractors
-            
+                random.shuffle(list(range(sum(ctx.get("isgold") is False for ctx in ctxs))))
             if use_all_random_ordering:
-                # Randomly order all documents
-                original_gold_index = next((idx for idx, doc in enumerate(documents) if doc.isgold), None)
-                random.shuffle(documents)
-                new_gold_index = next((idx for idx, doc in enumerate(documents) if doc.isgold), None)
-
-            if closedbook:
-                prompt = get_closedbook_qa_prompt(question)
-            else:
-                prompt = get_qa_prompt(
-                    question,
-                    documents,
-                    mention_random_ordering=prompt_mention_random_ordering,
-                    query_aware_contextualization=query_aware_contextualization,
-                )
-
-            if "instruct" in model_name:
-                if did_format_warn is False:
-                    logger.warning(f"Model {model_name} appears to be an instruct model, applying instruct formatting")
-                    did_format_warn = True
-                prompt = format_instruct_prompt(prompt)
-            elif "chat" in model_name:
-                if did_format_warn is False:
-                    logger.warning(f"Model {model_name} appears to be a chat model, applying chat formatting")
-                    did_format_warn = True
-                prompt = format_chat_prompt(prompt)
-            prompts[question] = {
-                "question": question,
-                "prompt": prompt,
-                "answers": answers,
-                "new_gold_index": new_gold_index if use_all_random_ordering else None
-            }
-            examples.append(deepcopy(input_example))
-            all_model_documents.append(documents)
-
-    with xopen(output_path, "w") as f:
-        for prompt in prompts.values():
-            f.write(json.dumps(prompt) + "\n")
+                random.shuffle(list(range(len(ctxs))))
+            continue
+        seen_questions.add(question)
+
+        if closedbook:
+            documents = DocumentBatch.from_dicts([])
+        else:
+            documents = DocumentBatch.from_dicts(
+                input_example["ctxs"], validate=validate_documents, passage_store=passage_store
+            )
+            if not documents:
+                raise ValueError(f"Did not find any documents for example: {input_example}")
+
+        if use_random_ordering:
+            # Randomly order only the distractors (isgold is False), keeping isgold documents
+            # at their existing index.
+            (original_gold_index,) = [idx for idx, isgold in enumerate(documents.isgolds) if isgold is True]
+            distractor_indices = [idx for idx, isgold in enumerate(documents.isgolds) if isgold is False]
+            random.shuffle(distractor_indices)
+            distractor_indices.insert(original_gold_index, original_gold_index)
+            documents = documents.take(distractor_indices)
+
+        if use_all_random_ordering:
+            # Randomly order all documents
+            document_indices = list(range(len(documents)))
+            random.shuffle(document_indices)
+            documents = documents.take(document_indices)
+            new_gold_index = next((idx for idx, isgold in enumerate(documents.isgolds) if isgold), None)
+
+        packed_prompt = None
+        if closedbook:
+            prompt = get_closedbook_qa_prompt(question)
+        elif max_prompt_tokens is not None:
+            packed_prompt = pack_qa_prompt(
+                question,
+                documents,
+                token_counter,
+                max_prompt_tokens,
+                trim_documents=trim_documents,
+                mention_random_ordering=prompt_mention_random_ordering,
+                query_aware_contextualization=query_aware_contextualization,
+                format_prompt=format_prompt,
+            )
+            prompt = packed_prompt.prompt
+        else:
+            prompt = get_qa_prompt(
+                question,
+                documents,
+                mention_random_ordering=prompt_mention_random_ordering,
+                query_aware_contextualization=query_aware_contextualization,
+            )
+
+        # Packed prompts are formatted before they're measured.
+        if format_prompt is not None and packed_prompt is None:
+            prompt = format_prompt(prompt)
+        prompt_record = {
+            "question": question,
+            "prompt": prompt,
+            "answers": answers,
+            "new_gold_index": new_gold_index if use_all_random_ordering else None,
+        }
+        if packed_prompt is not None:
+            prompt_record.update(
+                num_prompt_tokens=packed_prompt.num_prompt_tokens,
+                num_dropped_documents=packed_prompt.num_dropped_documents,
+                num_trimmed_tokens=packed_prompt.num_trimmed_tokens,
+                packed_gold_index=packed_prompt.gold_index,
+                document_token_spans=packed_prompt.document_token_spans,
+            )
+        yield prompt_record
 
 
 def chunks(lst, n):
@@ -159,12 +241,16 @@ def format_instruct_prompt(instruction):
     )
     return PROMPT_FOR_GENERATION
 
+
 def format_chat_prompt(instruction):
     # Format the prompt according to LLaMa 2 chat model requirements
-    prompt = f"<s>[INST] <<SYS>>\n Below is an instruction that describes a task." \
+    prompt = (
+        f"<s>[INST] <<SYS>>\n Below is an instruction that describes a task."
         f"Write a response that appropriately completes the request. \n<</SYS>>\n\n{instruction}"
+    )
     return prompt
 
+
 if __name__ == "__main__":
     logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
     parser = argparse.ArgumentParser()
@@ -198,6 +284,31 @@ if __name__ == "__main__":
         action="store_true",
         help="Place the question both before and after the documents.",
     )
+    parser.add_argument(
+        "--validate-documents",
+        action="store_true",
+        help="Validate every document with pydantic. Slower, only needed for untrusted input data.",
+    )
+    parser.add_argument(
+        "--passage-store",
+        help="Path to the passage store that the input data was written with, to resolve `passage_id` references.",
+    )
+    parser.add_argument(
+        "--max-prompt-tokens",
+        help=(
+            "Drop the lowest-ranked distractors so that each prompt fits in this many tokens, keeping the gold "
+            "document at the same relative position, instead of letting the model truncate the input."
+        ),
+        type=int,
+    )
+    parser.add_argument(
+        "--trim-documents",
+        action="store_true",
+        help="With --max-prompt-tokens, trim the first dropped document to fill the rest of the budget.",
+    )
+    parser.add_argument(
+        "--tokenizer", help="Tokenizer to measure prompts with for --max-prompt-tokens. Defaults to --model."
+    )
     parser.add_argument("--output-path", help="Path to write output file of generated responses", required=True)
     args = parser.parse_args()
 
@@ -211,5 +322,10 @@ if __name__ == "__main__":
         args.use_all_random_ordering,
         args.query_aware_contextualization,
         args.output_path,
+        args.validate_documents,
+        args.passage_store,
+        args.max_prompt_tokens,
+        args.trim_documents,
+        args.tokenizer,
     )
     logger.info("finished running %s", sys.argv[0])
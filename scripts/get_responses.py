@@ -0,0 +1,374 @@
+#!/usr/bin/env python3
+"""Given a data file with questions and documents (`--task qa`), key-value records (`--task kv`) or prompts
+(`--task prompt`), run a model to get responses.
+
+`--backend` picks how the model is loaded and prompted: `mpt` (`mosaicml/mpt-30b-instruct` and
+`mosaicml/mpt-30b`), `longchat` (`lmsys/longchat-13b-16k`), or `hf` for any other causal LM (including a
+local directory).
+
+The retrieval results are used in the exact order that they're given.
+
+To sweep the position of the gold document or key, pass several `--gold-index` values and a `{gold_index}`
+placeholder in `--output-path` (and, for `--task qa`, in `--input-path`, to read the data file of each
+position). The model is loaded once, and the prompts of every position are batched together.
+
+Running:
+
+```
+python -u ./scripts/get_responses.py \
+    --task qa \
+    --backend mpt \
+    --input-path qa_data/20_total_documents/nq-open-20_total_documents_gold_at_0.jsonl.gz \
+    --model mosaicml/mpt-30b-instruct \
+    --output-path qa_predictions/20_total_documents/gold_at_0-mpt-30b-instruct-predictions.jsonl.gz
+python -u ./scripts/get_responses.py \
+    --task kv \
+    --backend longchat \
+    --input-path kv_retrieval_data/kv-retrieval-75_keys.jsonl.gz \
+    --gold-index 0 \
+    --model lmsys/longchat-13b-16k \
+    --output-path kv_predictions/kv-retrieval-75_keys_gold_at_0-longchat-13b-16k-predictions.jsonl.gz
+python -u ./scripts/get_responses.py \
+    --task qa \
+    --backend mpt \
+    --input-path "qa_data/20_total_documents/nq-open-20_total_documents_gold_at_{gold_index}.jsonl.gz" \
+    --gold-index 0 4 9 14 19 \
+    --model mosaicml/mpt-30b-instruct \
+    --output-path "qa_predictions/20_total_documents/gold_at_{gold_index}-mpt-30b-instruct-predictions.jsonl.gz"
+```
+
+"""
+import argparse
+import logging
+import sys
+
+from lost_in_the_middle.engine import (
+    BACKENDS,
+    TASKS,
+    LongChatBackend,
+    generate_all_responses,
+    get_generation_jobs,
+    get_task_kwargs,
+)
+from lost_in_the_middle.generation_cache import GenerationCache
+
+logger = logging.getLogger(__name__)
+
+
+def main(
+    task_name,
+    backend_name,
+    input_path,
+    model_name,
+    temperature,
+    top_p,
+    batch_size,
+    closedbook,
+    prompt_mention_random_ordering,
+    use_random_ordering,
+    query_aware_contextualization,
+    gold_indices,
+    num_gpus,
+    max_memory_per_gpu,
+    longchat_flash_attn,
+    longchat_ratio,
+    max_new_tokens,
+    output_path,
+    validate_documents=False,
+    passage_store_path=None,
+    max_batch_tokens=None,
+    sort_by_length=True,
+    reuse_prefix_cache=False,
+    resume=False,
+    device="cuda",
+    num_threads=None,
+    num_interop_threads=None,
+    cpu_dtype="float32",
+    quantize_int8=False,
+    num_decode_workers=2,
+    generation_cache_path=None,
+    generation_cache_max_entries=None,
+    shard_index=0,
+    num_shards=1,
+    stop_patterns=None,
+    continuous_batching=False,
+):
+    task_kwargs = get_task_kwargs(
+        task_name,
+        closedbook=closedbook,
+        prompt_mention_random_ordering=prompt_mention_random_ordering,
+        use_random_ordering=use_random_ordering,
+        query_aware_contextualization=query_aware_contextualization,
+        validate_documents=validate_documents,
+        passage_store_path=passage_store_path,
+    )
+    jobs = get_generation_jobs(task_name, input_path, output_path, gold_indices, **task_kwargs)
+
+    backend_kwargs = {}
+    if BACKENDS[backend_name] is LongChatBackend:
+        backend_kwargs = {"longchat_flash_attn": longchat_flash_attn, "longchat_ratio": longchat_ratio}
+    backend = BACKENDS[backend_name](
+        model_name,
+        device=device,
+        num_gpus=num_gpus,
+        max_memory_per_gpu=max_memory_per_gpu,
+        num_threads=num_threads,
+        num_interop_threads=num_interop_threads,
+        cpu_dtype=cpu_dtype,
+        quantize_int8=quantize_int8,
+        **backend_kwargs,
+    )
+
+    generation_cache = None
+    if generation_cache_path is not None:
+        generation_cache = GenerationCache(generation_cache_path, max_entries=generation_cache_max_entries)
+    try:
+        generate_all_responses(
+            jobs,
+            backend,
+            temperature=temperature,
+            top_p=top_p,
+            batch_size=batch_size,
+            max_new_tokens=max_new_tokens,
+            max_batch_tokens=max_batch_tokens,
+            sort_by_length=sort_by_length,
+            reuse_prefix_cache=reuse_prefix_cache,
+            resume=resume,
+            num_decode_workers=num_decode_workers,
+            generation_cache=generation_cache,
+            shard_index=shard_index,
+            num_shards=num_shards,
+            stop_patterns=stop_patterns,
+            continuous_batching=continuous_batching,
+        )
+    finally:
+        if generation_cache is not None:
+            generation_cache.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--task",
+        help="Task of the input data (`prompt`: JSON lines with the prompt of each example in its `prompt` field)",
+        choices=list(TASKS),
+        required=True,
+    )
+    parser.add_argument("--backend", help="How to load and prompt the model", choices=list(BACKENDS), default="hf")
+    parser.add_argument("--input-path", help="Path to data with questions and documents to use.", required=True)
+    parser.add_argument("--model", help="Model to use in generating responses", required=True)
+    parser.add_argument("--temperature", help="Temperature to use in generation", type=float, default=0.0)
+    parser.add_argument("--top-p", help="Top-p to use in generation", type=float, default=1.0)
+    parser.add_argument("--batch-size", help="Batch size use in generation", type=int, default=8)
+    parser.add_argument(
+        "--max-batch-tokens",
+        help="Maximum number of (padded) prompt tokens per batch, in addition to the --batch-size limit.",
+        type=int,
+    )
+    parser.add_argument(
+        "--batch-order",
+        help=(
+            "Batch prompts of similar length together (`length`, the outputs are still written in input order), "
+            "or batch prompts in input order (`input`)."
+        ),
+        choices=["length", "input"],
+        default="length",
+    )
+    parser.add_argument(
+        "--continuous-batching",
+        action="store_true",
+        help=(
+            "Replace each finished sequence with the next prompt at every decode step, rather than running static "
+            "batches until their longest response is done (greedy decoding only)."
+        ),
+    )
+    parser.add_argument(
+        "--reuse-prefix-cache",
+        action="store_true",
+        help="Prefill the prompt prefix that every prompt shares once, and reuse its past key/values for every batch.",
+    )
+    parser.add_argument("--output-path", help="Path to write output file of generated responses", required=True)
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted run from its partial output (`<output-path>.partial`), skipping answered examples.",
+    )
+    parser.add_argument(
+        "--generation-cache",
+        help=(
+            "Path to a (SQLite) cache of generated responses, shared across runs. Greedy responses to prompts that "
+            "the same model answered before are read from it instead of being generated again."
+        ),
+    )
+    parser.add_argument(
+        "--generation-cache-max-entries",
+        help="Evict the least recently used responses once the generation cache holds more than this many",
+        type=int,
+        default=1_000_000,
+    )
+    parser.add_argument(
+        "--num-shards",
+        help="Split the input examples into this many shards, and only answer those of --shard-index",
+        type=int,
+        default=1,
+    )
+    parser.add_argument(
+        "--shard-index",
+        help="With --num-shards, the shard to answer (examples on lines shard-index, shard-index + num-shards, ...)",
+        type=int,
+        default=0,
+    )
+    parser.add_argument(
+        "--closedbook",
+        action="store_true",
+        help="--task qa: run the model in closed-book mode (i.e., don't use documents).",
+    )
+    parser.add_argument(
+        "--prompt-mention-random-ordering",
+        action="store_true",
+        help="--task qa: mention that search results are ordered randomly in the prompt",
+    )
+    parser.add_argument(
+        "--use-random-ordering",
+        action="store_true",
+        help="--task qa: randomize the ordering of the distractors, rather than sorting by relevance.",
+    )
+    parser.add_argument(
+        "--validate-documents",
+        action="store_true",
+        help="--task qa: validate every document with pydantic. Slower, only needed for untrusted input data.",
+    )
+    parser.add_argument(
+        "--passage-store",
+        help="--task qa: path to the passage store that the input data was written with, to resolve `passage_id`s.",
+    )
+    parser.add_argument(
+        "--gold-index",
+        dest="gold_indices",
+        help=(
+            "--task kv: move the key to retrieve to this index. --task qa: fill in the `{gold_index}` placeholder "
+            "of --input-path. Several indices are answered in one run, writing one output per index."
+        ),
+        type=int,
+        nargs="+",
+    )
+    parser.add_argument(
+        "--query-aware-contextualization",
+        action="store_true",
+        help="Place the question both before and after the documents.",
+    )
+    parser.add_argument("--num-gpus", help="Number of GPUs to use", type=int, default=1)
+    parser.add_argument("--device", help="Device to run the model on", choices=["cuda", "cpu"], default="cuda")
+    parser.add_argument("--num-threads", help="With --device cpu, # of threads used within each op", type=int)
+    parser.add_argument(
+        "--num-interop-threads", help="With --device cpu, # of threads used to run independent ops", type=int
+    )
+    parser.add_argument(
+        "--cpu-dtype",
+        help="With --device cpu, dtype of the model weights",
+        choices=["float32", "bfloat16"],
+        default="float32",
+    )
+    parser.add_argument(
+        "--quantize-int8",
+        action="store_true",
+        help="With --device cpu, quantize the weights of linear layers to int8 (activations are quantized on the fly).",
+    )
+    parser.add_argument(
+        "--longchat-flash-attn",
+        action="store_true",
+        help="Only apply to longchat models. Whether to enable flash attention to save memory, but slower.",
+    )
+    parser.add_argument(
+        "--longchat-ratio",
+        type=int,
+        default=8,
+        help="Only apply to longchat models. Use ratio=8 for 16K context length model. Only ratio=8 is supported now.",
+    )
+    parser.add_argument(
+        "--max-memory-per-gpu",
+        help="Maximum memory to use per GPU (in GiB) for multi-device parallelism, e.g., 80",
+        type=int,
+    )
+    parser.add_argument(
+        "--decode-workers",
+        help="# of threads decoding outputs while the next batches generate",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--stop-pattern",
+        action="append",
+        dest="stop_patterns",
+        help=(
+            "Stop each response once it matches this regular expression, and cut it right after the match "
+            "(can be given several times). Defaults to the first line for --task qa, and the first quoted string "
+            "other than the key (the value) for --task kv, which is what the evaluation scripts read."
+        ),
+    )
+    parser.add_argument(
+        "--no-stop-patterns",
+        action="store_true",
+        help="Generate up to --max-new-tokens (or the end-of-sequence token), without stop patterns.",
+    )
+    parser.add_argument(
+        "--max-new-tokens",
+        help="Maximum number of new tokens to generate",
+        type=int,
+        default=100,
+    )
+    args = parser.parse_args()
+    if args.task == "kv" and not args.gold_indices:
+        parser.error("--gold-index is required with --task kv")
+    if args.stop_patterns and args.no_stop_patterns:
+        parser.error("--stop-pattern and --no-stop-patterns are mutually exclusive")
+    if not 0 <= args.shard_index < args.num_shards:
+        parser.error("--shard-index must be in [0, --num-shards)")
+    if args.continuous_batching and (args.temperature > 0.0 or args.reuse_prefix_cache or args.max_batch_tokens):
+        parser.error(
+            "--continuous-batching only supports greedy decoding, without --reuse-prefix-cache or --max-batch-tokens"
+        )
+    if args.reuse_prefix_cache and args.longchat_flash_attn:
+        parser.error("--reuse-prefix-cache needs the KV cache, which is disabled with --longchat-flash-attn")
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(
+        args.task,
+        args.backend,
+        args.input_path,
+        args.model,
+        args.temperature,
+        args.top_p,
+        args.batch_size,
+        args.closedbook,
+        args.prompt_mention_random_ordering,
+        args.use_random_ordering,
+        args.query_aware_contextualization,
+        args.gold_indices,
+        args.num_gpus,
+        args.max_memory_per_gpu,
+        args.longchat_flash_attn,
+        args.longchat_ratio,
+        args.max_new_tokens,
+        args.output_path,
+        args.validate_documents,
+        args.passage_store,
+        args.max_batch_tokens,
+        args.batch_order == "length",
+        args.reuse_prefix_cache,
+        args.resume,
+        args.device,
+        args.num_threads,
+        args.num_interop_threads,
+        args.cpu_dtype,
+        args.quantize_int8,
+        args.decode_workers,
+        args.generation_cache,
+        args.generation_cache_max_entries,
+        args.shard_index,
+        args.num_shards,
+        [] if args.no_stop_patterns else args.stop_patterns,
+        args.continuous_batching,
+    )
+    logger.info("finished running %s", sys.argv[0])
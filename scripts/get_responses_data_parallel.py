@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""Run `get_responses.py` on several workers at once, each with its own copy of the model, and merge their
+outputs back into input order.
+
+With `--device cuda`, there's one worker per entry of `--devices` (its `CUDA_VISIBLE_DEVICES`, e.g., `0` or
+`0,1` for a worker that spreads the model over two GPUs with `--num-gpus 2`). With `--device cpu`, there
+are `--num-workers` worker processes with `--num-threads` threads each. Each worker answers one shard of the
+input examples (see `lost_in_the_middle.data_parallel`). Any argument that isn't listed below (e.g.,
+`--task`, `--model`, `--batch-size`) is passed on to every worker.
+
+Shard outputs, worker logs and the manifest are written to `<output-path>.shards/`. If some workers fail,
+rerun with `--resume`: finished shards are kept, and the other workers resume from their partial outputs.
+
+Running:
+
+```
+python -u ./scripts/get_responses_data_parallel.py \
+    --devices 0 1 2 3 \
+    --input-path qa_data/20_total_documents/nq-open-20_total_documents_gold_at_0.jsonl.gz \
+    --output-path qa_predictions/20_total_documents/gold_at_0-llama-2-7b-predictions.jsonl.gz \
+    --task qa \
+    --model meta-llama/Llama-2-7b-hf
+python -u ./scripts/get_responses_data_parallel.py \
+    --device cpu \
+    --num-workers 4 \
+    --num-threads 8 \
+    --input-path kv_retrieval_data/kv-retrieval-75_keys.jsonl.gz \
+    --output-path kv_predictions/kv-retrieval-75_keys_gold_at_0-llama-2-7b-predictions.jsonl.gz \
+    --task kv \
+    --gold-index 0 \
+    --model meta-llama/Llama-2-7b-hf
+```
+
+"""
+import argparse
+import logging
+import os
+import pathlib
+import subprocess
+import sys
+import time
+
+from lost_in_the_middle.data_parallel import (
+    check_resumable,
+    create_manifest,
+    get_manifest_path,
+    load_manifest,
+    merge_shard_outputs,
+    write_manifest,
+)
+
+logger = logging.getLogger(__name__)
+
+GET_RESPONSES_PATH = pathlib.Path(__file__).resolve().with_name("get_responses.py")
+POLL_SECONDS = 0.5
+
+
+def main(input_path, output_path, worker_args, device, devices, num_workers, num_threads, resume):
+    if device == "cuda":
+        devices = devices or [str(index) for index in range(num_workers or 1)]
+        worker_args = [*worker_args, "--device", "cuda"]
+    else:
+        devices = ["cpu"] * (num_workers or 1)
+        worker_args = [*worker_args, "--device", "cpu"]
+        if num_threads is not None:
+            worker_args += ["--num-threads", str(num_threads)]
+
+    manifest = create_manifest(input_path, output_path, len(devices), worker_args, devices)
+    previous_manifest = load_manifest(output_path)
+    if previous_manifest is not None:
+        if not resume:
+            raise ValueError(
+                f"Found the manifest {get_manifest_path(output_path)} of an earlier launch, "
+                "resume it or delete it first"
+            )
+        check_resumable(previous_manifest, manifest)
+        # Finished shards are kept, the others are run again (possibly on other devices).
+        for shard, previous_shard in zip(manifest["shards"], previous_manifest["shards"]):
+            if previous_shard["status"] == "done":
+                shard.update(previous_shard)
+    write_manifest(manifest)
+
+    pending_shards = [shard for shard in manifest["shards"] if shard["status"] != "done"]
+    logger.info(
+        f"Running {len(pending_shards)} of {manifest['num_shards']} shards of {manifest['num_examples']} examples"
+    )
+    start = time.perf_counter()
+    run_workers(manifest, pending_shards)
+    seconds = time.perf_counter() - start
+
+    failed_shards = [shard for shard in pending_shards if shard["status"] != "done"]
+    if failed_shards:
+        raise ValueError(
+            f"{len(failed_shards)} workers failed, see their logs: "
+            + ", ".join(shard["log_path"] for shard in failed_shards)
+            + ". Rerun with --resume to run them again."
+        )
+    num_examples = sum(shard["num_examples"] for shard in pending_shards)
+    if pending_shards:
+        logger.info(
+            f"Answered {num_examples} examples with {len(pending_shards)} workers in {seconds:.1f} s "
+            f"({num_examples / seconds:.2f} examples/s); seconds per shard: "
+            + ", ".join(f"{shard['seconds']:.1f}" for shard in pending_shards)
+        )
+    merge_shard_outputs(manifest)
+    logger.info(f"Merged the outputs of {manifest['num_shards']} shards into {output_path}")
+
+
+def run_workers(manifest, shards):
+    """Run a worker for each shard, all at once, recording their status in the manifest as they finish."""
+    running = {}
+    try:
+        for shard in shards:
+            command = [
+                sys.executable,
+                "-u",
+                str(GET_RESPONSES_PATH),
+                *manifest["worker_args"],
+                "--input-path",
+                manifest["input_path"],
+                "--output-path",
+                shard["output_path"],
+                "--num-shards",
+                str(manifest["num_shards"]),
+                "--shard-index",
+                str(shard["shard_index"]),
+                # Pick up the partial output of an earlier, interrupted worker, if any.
+                "--resume",
+            ]
+            env = dict(os.environ)
+            if shard["device"] != "cpu":
+                env["CUDA_VISIBLE_DEVICES"] = shard["device"]
+            log_file = open(shard["log_path"], "a")
+            process = subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+            running[shard["shard_index"]] = (shard, process, log_file, time.perf_counter())
+            shard.update(status="running", returncode=None, seconds=None)
+        write_manifest(manifest)
+
+        while running:
+            time.sleep(POLL_SECONDS)
+            for shard_index, (shard, process, log_file, start) in list(running.items()):
+                returncode = process.poll()
+                if returncode is None:
+                    continue
+                log_file.close()
+                del running[shard_index]
+                shard.update(
+                    status="done" if returncode == 0 else "failed",
+                    returncode=returncode,
+                    seconds=round(time.perf_counter() - start, 3),
+                )
+                write_manifest(manifest)
+                logger.info(f"Shard {shard_index} {shard['status']} in {shard['seconds']:.1f} s")
+    finally:
+        # Don't leave workers running if the launcher is interrupted.
+        for shard, process, log_file, _ in running.values():
+            process.terminate()
+            process.wait()
+            log_file.close()
+            shard["status"] = "failed"
+        if running:
+            write_manifest(manifest)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser(allow_abbrev=False)
+    parser.add_argument("--input-path", help="Path to data with questions and documents to use.", required=True)
+    parser.add_argument("--output-path", help="Path to write output file of generated responses", required=True)
+    parser.add_argument("--device", help="Device to run the workers on", choices=["cuda", "cpu"], default="cuda")
+    parser.add_argument(
+        "--devices",
+        nargs="+",
+        help="With --device cuda, the CUDA_VISIBLE_DEVICES of each worker (default: one worker per GPU 0..N-1)",
+    )
+    parser.add_argument(
+        "--num-workers", help="# of workers (with --device cuda, defaults to one per --devices)", type=int
+    )
+    parser.add_argument(
+        "--num-threads", help="With --device cpu, # of threads used within each op of a worker", type=int
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted launch: keep finished shards, and resume the other workers.",
+    )
+    args, worker_args = parser.parse_known_args()
+    for worker_arg in ("--shard-index", "--num-shards"):
+        if worker_arg in worker_args:
+            parser.error(f"{worker_arg} is set by the launcher")
+    if "{gold_index}" in args.input_path or "{gold_index}" in args.output_path:
+        parser.error("Launch once per gold index, the launcher doesn't fill in `{gold_index}` placeholders")
+    if args.devices and args.device != "cuda":
+        parser.error("--devices is only used with --device cuda")
+    if args.devices and args.num_workers is not None and args.num_workers != len(args.devices):
+        parser.error("--num-workers must match the number of --devices")
+    if args.num_workers is not None and args.num_workers < 1:
+        parser.error("--num-workers must be at least 1")
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(
+        args.input_path,
+        args.output_path,
+        worker_args,
+        args.device,
+        args.devices,
+        args.num_workers,
+        args.num_threads,
+        args.resume,
+    )
+    logger.info("finished running %s", sys.argv[0])
@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+"""Send a generation job to a model server (`./scripts/serve_model.py`), and wait for it to finish.
+
+Takes the task and decoding arguments of `./scripts/get_responses.py` (the model is the server's), so a
+run of `get_responses.py` becomes a job by swapping `--model` and the other model arguments for `--socket`.
+With `--prompt` (or `--prompts-path`, a text file with one prompt per line), the prompts are answered
+instead of a data file, and their responses are printed as JSON lines. `--status` prints the state of the
+server, and `--shutdown` stops it once its queued jobs are done.
+
+Running:
+
+```
+python -u ./scripts/get_responses_from_server.py \
+    --socket /tmp/mpt-30b-instruct.sock \
+    --task qa \
+    --input-path "qa_data/20_total_documents/nq-open-20_total_documents_gold_at_{gold_index}.jsonl.gz" \
+    --gold-index 0 4 9 14 19 \
+    --output-path "qa_predictions/20_total_documents/gold_at_{gold_index}-mpt-30b-instruct-predictions.jsonl.gz"
+python -u ./scripts/get_responses_from_server.py \
+    --socket /tmp/mpt-30b-instruct.sock \
+    --prompt "Who wrote the Iliad?" \
+    --max-new-tokens 20
+python -u ./scripts/get_responses_from_server.py --socket /tmp/mpt-30b-instruct.sock --shutdown
+```
+
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+
+from lost_in_the_middle.model_client import send_request
+
+logger = logging.getLogger(__name__)
+
+
+def main(
+    socket_path,
+    task_name,
+    input_path,
+    output_path,
+    gold_indices,
+    prompts,
+    temperature,
+    top_p,
+    batch_size,
+    closedbook,
+    prompt_mention_random_ordering,
+    use_random_ordering,
+    query_aware_contextualization,
+    max_new_tokens,
+    validate_documents=False,
+    passage_store_path=None,
+    max_batch_tokens=None,
+    sort_by_length=True,
+    reuse_prefix_cache=False,
+    resume=False,
+    num_decode_workers=2,
+    stop_patterns=None,
+    continuous_batching=False,
+):
+    generation_kwargs = {
+        "temperature": temperature,
+        "top_p": top_p,
+        "batch_size": batch_size,
+        "max_new_tokens": max_new_tokens,
+        "max_batch_tokens": max_batch_tokens,
+        "sort_by_length": sort_by_length,
+        "reuse_prefix_cache": reuse_prefix_cache,
+        "resume": resume,
+        "num_decode_workers": num_decode_workers,
+        "stop_patterns": stop_patterns,
+        "continuous_batching": continuous_batching,
+    }
+    if prompts is not None:
+        request = {"type": "prompts", "prompts": prompts, "generation_kwargs": generation_kwargs}
+    else:
+        task_options = {
+            "closedbook": closedbook,
+            "prompt_mention_random_ordering": prompt_mention_random_ordering,
+            "use_random_ordering": use_random_ordering,
+            "query_aware_contextualization": query_aware_contextualization,
+            "validate_documents": validate_documents,
+            "passage_store_path": os.path.abspath(passage_store_path) if passage_store_path else None,
+        }
+        request = {
+            "type": "responses",
+            "task": task_name,
+            # The server resolves relative paths from its own working directory.
+            "input_path": os.path.abspath(input_path),
+            "output_path": os.path.abspath(output_path),
+            "gold_indices": gold_indices,
+            "task_options": task_options,
+            "generation_kwargs": generation_kwargs,
+        }
+    reply = send_request(socket_path, request)
+    if reply["status"] != "ok":
+        raise ValueError(f"The job failed: {reply['error']}")
+    logger.info(f"The job waited {reply['queue_seconds']:.1f} s in the queue, and ran in {reply['run_seconds']:.1f} s")
+    if prompts is not None:
+        for prompt, response in zip(prompts, reply["responses"]):
+            print(json.dumps({"prompt": prompt, "response": response}))
+    else:
+        logger.info(f"Wrote {', '.join(reply['output_paths'])}")
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", help="Path of the Unix domain socket that the server listens on", required=True)
+    parser.add_argument("--status", action="store_true", help="Print the state of the server and exit.")
+    parser.add_argument(
+        "--shutdown", action="store_true", help="Stop the server once its queued jobs are done, and exit."
+    )
+    parser.add_argument("--task", help="Task of the input data", choices=["qa", "kv", "prompt"])
+    parser.add_argument("--input-path", help="Path to data with questions and documents to use.")
+    parser.add_argument("--output-path", help="Path to write output file of generated responses")
+    parser.add_argument(
+        "--prompt", action="append", dest="prompts", help="Answer this prompt (can be given several times)"
+    )
+    parser.add_argument("--prompts-path", help="Answer the prompts of this text file (one per line)")
+    parser.add_argument("--temperature", help="Temperature to use in generation", type=float, default=0.0)
+    parser.add_argument("--top-p", help="Top-p to use in generation", type=float, default=1.0)
+    parser.add_argument("--batch-size", help="Batch size use in generation", type=int, default=8)
+    parser.add_argument(
+        "--max-batch-tokens",
+        help="Maximum number of (padded) prompt tokens per batch, in addition to the --batch-size limit.",
+        type=int,
+    )
+    parser.add_argument(
+        "--batch-order",
+        help=(
+            "Batch prompts of similar length together (`length`, the outputs are still written in input order), "
+            "or batch prompts in input order (`input`)."
+        ),
+        choices=["length", "input"],
+        default="length",
+    )
+    parser.add_argument(
+        "--continuous-batching",
+        action="store_true",
+        help=(
+            "Replace each finished sequence with the next prompt at every decode step, rather than running static "
+            "batches until their longest response is done (greedy decoding only)."
+        ),
+    )
+    parser.add_argument(
+        "--reuse-prefix-cache",
+        action="store_true",
+        help="Prefill the prompt prefix that every prompt shares once, and reuse its past key/values for every batch.",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help="Resume an interrupted run from its partial output (`<output-path>.partial`), skipping answered examples.",
+    )
+    parser.add_argument(
+        "--closedbook",
+        action="store_true",
+        help="--task qa: run the model in closed-book mode (i.e., don't use documents).",
+    )
+    parser.add_argument(
+        "--prompt-mention-random-ordering",
+        action="store_true",
+        help="--task qa: mention that search results are ordered randomly in the prompt",
+    )
+    parser.add_argument(
+        "--use-random-ordering",
+        action="store_true",
+        help="--task qa: randomize the ordering of the distractors, rather than sorting by relevance.",
+    )
+    parser.add_argument(
+        "--validate-documents",
+        action="store_true",
+        help="--task qa: validate every document with pydantic. Slower, only needed for untrusted input data.",
+    )
+    parser.add_argument(
+        "--passage-store",
+        help="--task qa: path to the passage store that the input data was written with, to resolve `passage_id`s.",
+    )
+    parser.add_argument(
+        "--gold-index",
+        dest="gold_indices",
+        help=(
+            "--task kv: move the key to retrieve to this index. --task qa: fill in the `{gold_index}` placeholder "
+            "of --input-path. Several indices are answered in one job, writing one output per index."
+        ),
+        type=int,
+        nargs="+",
+    )
+    parser.add_argument(
+        "--query-aware-contextualization",
+        action="store_true",
+        help="Place the question both before and after the documents.",
+    )
+    parser.add_argument(
+        "--decode-workers",
+        help="# of threads decoding outputs while the next batches generate",
+        type=int,
+        default=2,
+    )
+    parser.add_argument(
+        "--stop-pattern",
+        action="append",
+        dest="stop_patterns",
+        help=(
+            "Stop each response once it matches this regular expression, and cut it right after the match "
+            "(can be given several times). Defaults to the first line for --task qa, and the first quoted string "
+            "other than the key (the value) for --task kv, which is what the evaluation scripts read."
+        ),
+    )
+    parser.add_argument(
+        "--no-stop-patterns",
+        action="store_true",
+        help="Generate up to --max-new-tokens (or the end-of-sequence token), without stop patterns.",
+    )
+    parser.add_argument(
+        "--max-new-tokens",
+        help="Maximum number of new tokens to generate",
+        type=int,
+        default=100,
+    )
+    args = parser.parse_args()
+
+    if args.status or args.shutdown:
+        if args.status and args.shutdown:
+            parser.error("--status and --shutdown are mutually exclusive")
+        print(json.dumps(send_request(args.socket, {"type": "status" if args.status else "shutdown"})))
+        sys.exit(0)
+    if args.prompts_path:
+        with open(args.prompts_path) as fin:
+            args.prompts = (args.prompts or []) + [line.rstrip("\n") for line in fin if line.strip()]
+    if args.prompts is None:
+        if not (args.task and args.input_path and args.output_path):
+            parser.error("--task, --input-path and --output-path are required, unless answering --prompt")
+        if args.task == "kv" and not args.gold_indices:
+            parser.error("--gold-index is required with --task kv")
+    elif args.task or args.input_path or args.output_path:
+        parser.error("--prompt answers the given prompts, without --task, --input-path or --output-path")
+    if args.stop_patterns and args.no_stop_patterns:
+        parser.error("--stop-pattern and --no-stop-patterns are mutually exclusive")
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(
+        args.socket,
+        args.task,
+        args.input_path,
+        args.output_path,
+        args.gold_indices,
+        args.prompts,
+        args.temperature,
+        args.top_p,
+        args.batch_size,
+        args.closedbook,
+        args.prompt_mention_random_ordering,
+        args.use_random_ordering,
+        args.query_aware_contextualization,
+        args.max_new_tokens,
+        args.validate_documents,
+        args.passage_store,
+        args.max_batch_tokens,
+        args.batch_order == "length",
+        args.reuse_prefix_cache,
+        args.resume,
+        args.decode_workers,
+        [] if args.no_stop_patterns else args.stop_patterns,
+        args.continuous_batching,
+    )
+    logger.info("finished running %s", sys.argv[0])
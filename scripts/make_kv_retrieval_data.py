@@ -1,6 +1,14 @@
 #!/usr/bin/env python3
 """Create a data file for key-value retrieval.
 
+Keys and values are random UUIDs from a generator seeded with `--seed`, so the same arguments always
+create the same data (whatever `--num-workers`). Chunks of examples are generated in parallel by
+`--num-workers` processes.
+
+With an output path ending in `.npy`, examples are stored as fixed-width binary records (16 bytes per
+key or value, see `lost_in_the_middle.kv_data`) rather than JSON lines. The response scripts read them
+directly (memory-mapped), and write the same output examples as for JSON lines data.
+
 Running:
 
 ```
@@ -8,43 +16,77 @@ python -u ./scripts/make_kv_retrieval_data.py \
     --num-keys 300 \
     --num-examples 500 \
     --output-path data/kv-retrieval/kv-retrieval-300_keys.jsonl
+python -u ./scripts/make_kv_retrieval_data.py \
+    --num-keys 1000 \
+    --num-examples 500 \
+    --num-workers 8 \
+    --output-path data/kv-retrieval/kv-retrieval-1000_keys.npy
 ```
 
 """
 import argparse
-import json
+import functools
 import logging
-import random
+import os
+import shutil
 import sys
-import uuid
+from concurrent.futures import ProcessPoolExecutor
 
 from tqdm import tqdm
-from xopen import xopen
+
+from lost_in_the_middle.kv_data import (
+    EXAMPLES_PER_CHUNK,
+    create_kv_record_file,
+    generate_kv_chunk,
+    is_kv_record_file,
+    write_kv_jsonl,
+    write_kv_record_chunk,
+)
 
 logger = logging.getLogger(__name__)
 
 
-def main(num_keys, num_examples, output_path):
+def main(num_keys, num_examples, output_path, seed=0, num_workers=1):
 
     if num_keys < 2:
         raise ValueError(f"`num_keys` must be at least 2, got {num_keys}")
     if num_examples < 1:
         raise ValueError(f"`num_examples` must be at least 1, got {num_examples}")
 
-    num_output_examples = 0
-    with xopen(output_path, "w") as fout:
-        for _ in tqdm(range(num_examples)):
-            kv_records = {}
-            while len(kv_records) != num_keys:
-                kv_records[str(uuid.uuid4())] = str(uuid.uuid4())
-            ordered_kv_records = list(kv_records.items())
-            gold_record = random.choice(ordered_kv_records)
-            key = gold_record[0]
-            value = gold_record[1]
-            example = {"ordered_kv_records": ordered_kv_records, "key": key, "value": value}
-            fout.write(json.dumps(example) + "\n")
-            num_output_examples += 1
-    logger.info(f"Wrote {num_output_examples} output examples")
+    chunk_starts = list(range(0, num_examples, EXAMPLES_PER_CHUNK))
+    if is_kv_record_file(output_path):
+        create_kv_record_file(output_path, num_examples, num_keys)
+        chunk_paths = [output_path] * len(chunk_starts)
+    else:
+        # Chunks are written to (compressed) part files, which are concatenated in order: concatenated gzip
+        # (or bz2, xz, zstd) streams decompress to the concatenation of their contents.
+        directory, name = os.path.split(output_path)
+        parts_dir = os.path.join(directory, f".parts.{name}")
+        os.makedirs(parts_dir, exist_ok=True)
+        chunk_paths = [os.path.join(parts_dir, f"{chunk_index:06d}.{name}") for chunk_index in range(len(chunk_starts))]
+
+    write = functools.partial(write_chunk, seed=seed, num_examples=num_examples, num_keys=num_keys)
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for _ in tqdm(
+            executor.map(write, chunk_paths, chunk_starts, range(len(chunk_starts))), total=len(chunk_starts)
+        ):
+            pass
+
+    if not is_kv_record_file(output_path):
+        with open(output_path, "wb") as fout:
+            for part_path in chunk_paths:
+                with open(part_path, "rb") as fin:
+                    shutil.copyfileobj(fin, fout)
+        shutil.rmtree(parts_dir)
+    logger.info(f"Wrote {num_examples} output examples")
+
+
+def write_chunk(path, start, chunk_index, seed, num_examples, num_keys):
+    chunk = generate_kv_chunk(seed, chunk_index, min(EXAMPLES_PER_CHUNK, num_examples - start), num_keys)
+    if is_kv_record_file(path):
+        write_kv_record_chunk(path, start, chunk)
+    else:
+        write_kv_jsonl(path, chunk)
 
 
 if __name__ == "__main__":
@@ -62,9 +104,15 @@ if __name__ == "__main__":
         type=int,
         required=True,
     )
-    parser.add_argument("--output-path", help="Path to write output data files", required=True)
+    parser.add_argument(
+        "--output-path",
+        help="Path to write output data files (JSON lines, or binary records if it ends in .npy)",
+        required=True,
+    )
+    parser.add_argument("--seed", help="Seed of the random keys and values", type=int, default=0)
+    parser.add_argument("--num-workers", help="# of processes generating chunks of examples", type=int, default=1)
     args = parser.parse_args()
 
     logger.info("running %s", " ".join(sys.argv))
-    main(args.num_keys, args.num_examples, args.output_path)
+    main(args.num_keys, args.num_examples, args.output_path, args.seed, args.num_workers)
     logger.info("finished running %s", sys.argv[0])
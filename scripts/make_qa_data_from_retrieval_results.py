@@ -16,71 +16,147 @@ python -u ./scripts/make_qa_data_from_retrieval_results.py \
     --output-path qa_data/nq-open-30_total_documents_gold_at_0.jsonl.gz
 ```
 
+To write several gold indices (or `all` of them) from a single pass over the input:
+
+```
+python -u ./scripts/make_qa_data_from_retrieval_results.py \
+    --input-path nq-open-contriever-msmarco-retrieved-documents.jsonl.gz \
+    --num-total-documents 20 \
+    --gold-index 0 4 9 14 19 \
+    --output-path "qa_data/20_total_documents/nq-open-20_total_documents_gold_at_{gold_index}.jsonl.gz"
+```
+
+With `--passage-store`, each passage's title and text are written once to a content-addressed
+passage store, and the output contexts reference them by `passage_id` (pass the same store to
+`generate_simplified_prompts.py` or the QA response scripts to resolve them):
+
+```
+python -u ./scripts/make_qa_data_from_retrieval_results.py \
+    --input-path nq-open-contriever-msmarco-retrieved-documents.jsonl.gz \
+    --num-total-documents 20 \
+    --gold-index all \
+    --passage-store qa_data/passages.sqlite \
+    --output-path "qa_data/20_total_documents/nq-open-20_total_documents_gold_at_{gold_index}.jsonl.gz"
+```
+
 """
 import argparse
+import contextlib
 import json
 import logging
+import pathlib
 import sys
-from copy import deepcopy
 
 from tqdm import tqdm
 from xopen import xopen
 
+from lost_in_the_middle.io_utils import BackgroundWriter
+from lost_in_the_middle.passage_store import PassageStore, store_passages
+
 logger = logging.getLogger(__name__)
 
 
-def main(input_path, num_total_documents, gold_index, output_path):
+def main(input_path, num_total_documents, gold_indices, output_path, passage_store_path=None):
 
     if num_total_documents < 2:
         raise ValueError(f"`num_total_documents` must be at least 2, got {num_total_documents}")
-    if gold_index < 0:
-        raise ValueError("`gold_index` must be at least 0")
-    if gold_index >= num_total_documents:
-        raise ValueError(f"`gold_index` must be less than `num_total_documents` ({num_total_documents})")
-
-    # Validate that we have at least num_total_documents for every example
-    with xopen(input_path) as fin:
-        for line in tqdm(fin):
-            qa_retrieval_result = json.loads(line)
-            example_num_documents = len([doc for doc in qa_retrieval_result["ctxs"] if doc["hasanswer"] is False])
-            if num_total_documents > example_num_documents:
-                raise ValueError(
-                    f"Requested `num_total_documents` {num_total_documents}, but found an input"
-                    f"example with only {example_num_documents} documents that don't contain the answer."
-                )
-
+    if not gold_indices:
+        raise ValueError("Must provide at least one `gold_index`")
+    for gold_index in gold_indices:
+        if gold_index < 0:
+            raise ValueError("`gold_index` must be at least 0")
+        if gold_index >= num_total_documents:
+            raise ValueError(f"`gold_index` must be less than `num_total_documents` ({num_total_documents})")
+    if len(set(gold_indices)) != len(gold_indices):
+        raise ValueError(f"Got duplicate gold indices: {gold_indices}")
+
+    output_paths = get_output_paths(output_path, gold_indices)
+    for path in output_paths.values():
+        pathlib.Path(path).parent.mkdir(parents=True, exist_ok=True)
+
+    # Every gold index is written from the same pass over the input, each by its own background
+    # writer so that compression doesn't block parsing.
+    writers = {gold_index: BackgroundWriter(path) for gold_index, path in output_paths.items()}
+    passage_store = PassageStore(passage_store_path) if passage_store_path else None
     num_output_examples = 0
-    with xopen(input_path) as fin, xopen(output_path, "w") as fout:
-        for line in tqdm(fin):
-            qa_retrieval_result = json.loads(line)
-            # Get documents that don't contain the answer
-            valid_distractors_with_retrieval_indices = [
-                (idx, doc) for idx, doc in enumerate(qa_retrieval_result["ctxs"]) if doc["hasanswer"] is False
-            ]
-            # Take the top `num_total_documents - 1` distractors
-            distractor_docs_with_retrieval_indices = deepcopy(
-                valid_distractors_with_retrieval_indices[: num_total_documents - 1]
+    try:
+        with xopen(input_path) as fin:
+            for line in tqdm(fin):
+                qa_retrieval_result = json.loads(line)
+                # Get documents that don't contain the answer
+                valid_distractors_with_retrieval_indices = [
+                    (idx, doc) for idx, doc in enumerate(qa_retrieval_result["ctxs"]) if doc["hasanswer"] is False
+                ]
+                # Validate that we have at least num_total_documents for every example
+                example_num_documents = len(valid_distractors_with_retrieval_indices)
+                if num_total_documents > example_num_documents:
+                    raise ValueError(
+                        f"Requested `num_total_documents` {num_total_documents}, but found an input"
+                        f"example with only {example_num_documents} documents that don't contain the answer."
+                    )
+                # Take the top `num_total_documents - 1` distractors. These are shared (but never
+                # mutated) across the outputs for different gold indices.
+                distractor_docs = [
+                    dict(distractor_doc, original_retrieval_index=original_retrieval_index, isgold=False)
+                    for original_retrieval_index, distractor_doc in valid_distractors_with_retrieval_indices[
+                        : num_total_documents - 1
+                    ]
+                ]
+                gold_chunk = {
+                    "title": qa_retrieval_result["nq_annotated_gold"]["title"],
+                    "text": qa_retrieval_result["nq_annotated_gold"]["chunked_long_answer"],
+                    "hasanswer": True,
+                    "isgold": True,
+                }
+                if passage_store is not None:
+                    # Store each passage once, rather than once per gold index.
+                    gold_chunk, *distractor_docs = store_passages([gold_chunk] + distractor_docs, passage_store)
+                for gold_index, writer in writers.items():
+                    ctxs = list(distractor_docs)
+                    # Insert the gold chunk at thet specific index
+                    ctxs.insert(gold_index, gold_chunk)
+                    content_selection_example = dict(qa_retrieval_result, ctxs=ctxs)
+                    writer.write(json.dumps(content_selection_example) + "\n")
+                num_output_examples += 1
+        # Raises the error of a writer that failed, in which case the outputs are discarded too.
+        for writer in writers.values():
+            writer.close()
+    except BaseException:
+        # Don't leave partially-written outputs around (e.g., if an example fails validation). Errors of the
+        # writers are dropped, so that the original error is the one raised.
+        for writer in writers.values():
+            with contextlib.suppress(Exception):
+                writer.close()
+        for path in output_paths.values():
+            pathlib.Path(path).unlink(missing_ok=True)
+        if passage_store is not None:
+            passage_store.close()
+        raise
+    if passage_store is not None:
+        logger.info(f"Passage store {passage_store_path} has {len(passage_store)} passages")
+        passage_store.close()
+    logger.info(f"Wrote {num_output_examples} output examples to each of {len(writers)} output files")
+
+
+def get_output_paths(output_path, gold_indices):
+    """Map each gold index to its output path, filling in the `{gold_index}` placeholder."""
+    if "{gold_index}" not in output_path:
+        if len(gold_indices) > 1:
+            raise ValueError(
+                f"`output_path` must contain a `{{gold_index}}` placeholder when writing multiple gold indices, "
+                f"got {output_path}"
             )
-            for original_retrieval_index, distractor_doc in distractor_docs_with_retrieval_indices:
-                distractor_doc["original_retrieval_index"] = original_retrieval_index
-                distractor_doc["isgold"] = False
-            distractor_docs = [x[1] for x in distractor_docs_with_retrieval_indices]
-
-            content_selection_example = deepcopy(qa_retrieval_result)
-            gold_chunk = {
-                "title": qa_retrieval_result["nq_annotated_gold"]["title"],
-                "text": qa_retrieval_result["nq_annotated_gold"]["chunked_long_answer"],
-                "hasanswer": True,
-                "isgold": True,
-            }
-            ctxs = distractor_docs
-            # Insert the gold chunk at thet specific index
-            ctxs.insert(gold_index, gold_chunk)
-
-            content_selection_example["ctxs"] = ctxs
-            fout.write(json.dumps(content_selection_example) + "\n")
-            num_output_examples += 1
-    logger.info(f"Wrote {num_output_examples} output examples")
+        return {gold_indices[0]: output_path}
+    return {gold_index: output_path.replace("{gold_index}", str(gold_index)) for gold_index in gold_indices}
+
+
+def parse_gold_indices(gold_index_args, num_total_documents):
+    if gold_index_args == ["all"]:
+        return list(range(num_total_documents))
+    try:
+        return [int(gold_index) for gold_index in gold_index_args]
+    except ValueError:
+        raise ValueError(f"`gold_index` must be a list of integers or `all`, got {gold_index_args}")
 
 
 if __name__ == "__main__":
@@ -102,13 +178,36 @@ if __name__ == "__main__":
     )
     parser.add_argument(
         "--gold-index",
-        help=("Index to place gold documents at. Must be 0 or greater and " "`num-total-documents - 1` or smaller"),
-        type=int,
+        help=(
+            "Indices to place gold documents at, or `all` for every index. Each must be 0 or greater and "
+            "`num-total-documents - 1` or smaller. All indices are written from a single pass over the input."
+        ),
+        nargs="+",
+        required=True,
+    )
+    parser.add_argument(
+        "--output-path",
+        help=(
+            "Path to write output data files. Must contain a `{gold_index}` placeholder when "
+            "multiple gold indices are given."
+        ),
         required=True,
     )
-    parser.add_argument("--output-path", help="Path to write output data files", required=True)
+    parser.add_argument(
+        "--passage-store",
+        help=(
+            "Path to a passage store (created if it doesn't exist). If given, passages are written to the store "
+            "and output contexts reference them by `passage_id` instead of repeating their title and text."
+        ),
+    )
     args = parser.parse_args()
 
     logger.info("running %s", " ".join(sys.argv))
-    main(args.input_path, args.num_total_documents, args.gold_index, args.output_path)
+    main(
+        args.input_path,
+        args.num_total_documents,
+        parse_gold_indices(args.gold_index, args.num_total_documents),
+        args.output_path,
+        passage_store_path=args.passage_store,
+    )
     logger.info("finished running %s", sys.argv[0])
@@ -0,0 +1,144 @@
+#!/usr/bin/env python3
+"""Load a model once, and answer the generation jobs sent to it on a Unix domain socket until it's stopped.
+
+Jobs are sent with `./scripts/get_responses_from_server.py`, which takes the task and decoding arguments of
+`./scripts/get_responses.py`; the model arguments are given here. Jobs run one at a time, in the order they
+were sent. On SIGINT or SIGTERM (or `get_responses_from_server.py --shutdown`), the server stops accepting
+jobs, finishes the queued ones, and exits.
+
+Running:
+
+```
+python -u ./scripts/serve_model.py \
+    --backend mpt \
+    --model mosaicml/mpt-30b-instruct \
+    --socket /tmp/mpt-30b-instruct.sock
+```
+
+"""
+import argparse
+import logging
+import signal
+import sys
+
+from lost_in_the_middle.engine import BACKENDS, LongChatBackend
+from lost_in_the_middle.generation_cache import GenerationCache
+from lost_in_the_middle.model_server import ModelServer
+
+logger = logging.getLogger(__name__)
+
+
+def main(
+    backend_name,
+    model_name,
+    socket_path,
+    num_gpus=1,
+    max_memory_per_gpu=None,
+    longchat_flash_attn=False,
+    longchat_ratio=8,
+    device="cuda",
+    num_threads=None,
+    num_interop_threads=None,
+    cpu_dtype="float32",
+    quantize_int8=False,
+    generation_cache_path=None,
+    generation_cache_max_entries=None,
+):
+    backend_kwargs = {}
+    if BACKENDS[backend_name] is LongChatBackend:
+        backend_kwargs = {"longchat_flash_attn": longchat_flash_attn, "longchat_ratio": longchat_ratio}
+    backend = BACKENDS[backend_name](
+        model_name,
+        device=device,
+        num_gpus=num_gpus,
+        max_memory_per_gpu=max_memory_per_gpu,
+        num_threads=num_threads,
+        num_interop_threads=num_interop_threads,
+        cpu_dtype=cpu_dtype,
+        quantize_int8=quantize_int8,
+        **backend_kwargs,
+    )
+
+    generation_cache = None
+    if generation_cache_path is not None:
+        generation_cache = GenerationCache(generation_cache_path, max_entries=generation_cache_max_entries)
+    server = ModelServer(backend, socket_path, generation_cache=generation_cache)
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: server.request_shutdown())
+    try:
+        server.load()
+        server.serve_forever()
+    finally:
+        if generation_cache is not None:
+            generation_cache.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(format="%(asctime)s - %(module)s - %(levelname)s - %(message)s", level=logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", help="Path of the Unix domain socket to listen on", required=True)
+    parser.add_argument("--backend", help="How to load and prompt the model", choices=list(BACKENDS), default="hf")
+    parser.add_argument("--model", help="Model to use in generating responses", required=True)
+    parser.add_argument("--num-gpus", help="Number of GPUs to use", type=int, default=1)
+    parser.add_argument(
+        "--max-memory-per-gpu",
+        help="Maximum memory to use per GPU (in GiB) for multi-device parallelism, e.g., 80",
+        type=int,
+    )
+    parser.add_argument(
+        "--longchat-flash-attn",
+        action="store_true",
+        help="Only apply to longchat models. Whether to enable flash attention to save memory, but slower.",
+    )
+    parser.add_argument(
+        "--longchat-ratio",
+        type=int,
+        default=8,
+        help="Only apply to longchat models. Use ratio=8 for 16K context length model. Only ratio=8 is supported now.",
+    )
+    parser.add_argument("--device", help="Device to run the model on", choices=["cuda", "cpu"], default="cuda")
+    parser.add_argument("--num-threads", help="With --device cpu, # of threads used within each op", type=int)
+    parser.add_argument(
+        "--num-interop-threads", help="With --device cpu, # of threads used to run independent ops", type=int
+    )
+    parser.add_argument(
+        "--cpu-dtype",
+        help="With --device cpu, dtype of the model weights",
+        choices=["float32", "bfloat16"],
+        default="float32",
+    )
+    parser.add_argument(
+        "--quantize-int8",
+        action="store_true",
+        help="With --device cpu, quantize the weights of linear layers to int8 (activations are quantized on the fly).",
+    )
+    parser.add_argument(
+        "--generation-cache",
+        help="Path to a (SQLite) cache of generated responses, shared by every job and across runs.",
+    )
+    parser.add_argument(
+        "--generation-cache-max-entries",
+        help="Evict the least recently used responses once the generation cache holds more than this many",
+        type=int,
+        default=1_000_000,
+    )
+    args = parser.parse_args()
+
+    logger.info("running %s", " ".join(sys.argv))
+    main(
+        args.backend,
+        args.model,
+        args.socket,
+        args.num_gpus,
+        args.max_memory_per_gpu,
+        args.longchat_flash_attn,
+        args.longchat_ratio,
+        args.device,
+        args.num_threads,
+        args.num_interop_threads,
+        args.cpu_dtype,
+        args.quantize_int8,
+        args.generation_cache,
+        args.generation_cache_max_entries,
+    )
+    logger.info("finished running %s", sys.argv[0])
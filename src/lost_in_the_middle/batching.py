@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+"""Length-bucketed batching of prompts for generation.
+
+Prompts in a batch are (left-)padded to the longest prompt in the batch, so batching prompts in file
+order pads short prompts to the length of long ones. `get_batches` instead groups prompts of similar
+tokenized length, and `restore_order` puts the outputs of the batches back in the original order.
+"""
+from typing import List, NamedTuple, Optional, Sequence, TypeVar
+
+T = TypeVar("T")
+
+
+class PaddingStats(NamedTuple):
+    # Tokens of the prompts themselves.
+    num_tokens: int
+    # Tokens of the padded batches, i.e., including padding.
+    num_padded_tokens: int
+
+    @property
+    def num_padding_tokens(self) -> int:
+        return self.num_padded_tokens - self.num_tokens
+
+    @property
+    def padding_fraction(self) -> float:
+        return self.num_padding_tokens / self.num_padded_tokens if self.num_padded_tokens else 0.0
+
+
+def get_batches(
+    lengths: Sequence[int],
+    batch_size: int,
+    max_batch_tokens: Optional[int] = None,
+    sort_by_length: bool = True,
+) -> List[List[int]]:
+    """Group the indices of prompts with the given token lengths into batches.
+
+    With `sort_by_length`, prompts are batched from the longest to the shortest, so that similar lengths
+    share a batch (and an out-of-memory error happens at the start of a run rather than hours in). Each
+    batch has at most `batch_size` prompts and, with `max_batch_tokens`, at most `max_batch_tokens` tokens
+    once padded; a prompt longer than `max_batch_tokens` gets a batch of its own. Without `sort_by_length`,
+    prompts are batched in their original order.
+    """
+    if batch_size < 1:
+        raise ValueError(f"`batch_size` must be at least 1, got {batch_size}")
+    if max_batch_tokens is not None and max_batch_tokens < 1:
+        raise ValueError(f"`max_batch_tokens` must be at least 1, got {max_batch_tokens}")
+    indices = list(range(len(lengths)))
+    if sort_by_length:
+        # Sorting is stable, so prompts of the same length stay in their original order.
+        indices.sort(key=lambda index: -lengths[index])
+
+    batches = []
+    batch = []
+    batch_max_length = 0
+    for index in indices:
+        next_batch_max_length = max(batch_max_length, lengths[index])
+        if batch and (
+            len(batch) == batch_size
+            or (max_batch_tokens is not None and next_batch_max_length * (len(batch) + 1) > max_batch_tokens)
+        ):
+            batches.append(batch)
+            batch = []
+            next_batch_max_length = lengths[index]
+        batch.append(index)
+        batch_max_length = next_batch_max_length
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def restore_order(batches: Sequence[Sequence[int]], outputs: Sequence[T]) -> List[T]:
+    """Put outputs generated batch by batch (one per prompt, in batch order) back in the original order."""
+    num_outputs = sum(len(batch) for batch in batches)
+    if num_outputs != len(outputs):
+        raise ValueError(f"Got {len(outputs)} outputs for batches of {num_outputs} prompts")
+    ordered_outputs = [None] * num_outputs
+    output_index = 0
+    for batch in batches:
+        for index in batch:
+            ordered_outputs[index] = outputs[output_index]
+            output_index += 1
+    return ordered_outputs
+
+
+def get_padding_stats(lengths: Sequence[int], batches: Sequence[Sequence[int]]) -> PaddingStats:
+    num_tokens = 0
+    num_padded_tokens = 0
+    for batch in batches:
+        batch_lengths = [lengths[index] for index in batch]
+        num_tokens += sum(batch_lengths)
+        num_padded_tokens += max(batch_lengths) * len(batch_lengths)
+    return PaddingStats(num_tokens=num_tokens, num_padded_tokens=num_padded_tokens)
+
+
+def format_padding_report(lengths: Sequence[int], batches: Sequence[Sequence[int]], batch_size: int) -> str:
+    """Compare the padding of `batches` against batching the same prompts in file order."""
+    file_order_stats = get_padding_stats(lengths, get_batches(lengths, batch_size, sort_by_length=False))
+    stats = get_padding_stats(lengths, batches)
+    return (
+        f"Padding: {file_order_stats.num_padding_tokens} of {file_order_stats.num_padded_tokens} batch tokens "
+        f"({file_order_stats.padding_fraction:.1%}) in file order with batch size {batch_size}, "
+        f"{stats.num_padding_tokens} of {stats.num_padded_tokens} ({stats.padding_fraction:.1%}) "
+        f"in {len(batches)} scheduled batches"
+    )
@@ -0,0 +1,224 @@
+#!/usr/bin/env python3
+"""Greedy generation with continuous (in-flight) batching.
+
+A static batch (`get_batches` and `model.generate`) runs until its last sequence is done, so sequences that
+end early (at the end-of-sequence token, or a stop pattern) leave their slot idle for the rest of the batch.
+`ContinuousBatcher` instead evicts each sequence as soon as it's done, and admits the next prompts into the
+free slots, so that up to `max_batch_size` sequences decode at every step.
+
+The past key/values of the running sequences are rows of one cache. Admitted prompts are prefilled together,
+and their rows join the cache aligned on its last column, with the columns before their first token masked
+out. Rather than deriving positions from padding, each sequence keeps its own length, which gives the
+position id of its next token. Rows of finished sequences are dropped, and so are the columns that are
+masked out in every remaining row. Masked-out columns don't take part in attention, so responses are the
+same as with static batches (up to the order of floating-point reductions).
+"""
+import collections
+import re
+import time
+from typing import Iterator, List, Optional, Sequence, Tuple
+
+import torch
+from transformers import DynamicCache
+
+from lost_in_the_middle.stopping import find_stop
+from lost_in_the_middle.throughput import ThroughputMeter
+
+
+class _Sequence:
+    def __init__(self, index: int, prompt_length: int, stop_patterns: Sequence[re.Pattern]):
+        self.index = index
+        self.prompt_length = prompt_length
+        self.stop_patterns = stop_patterns
+        self.new_token_ids: List[int] = []
+        self.done = False
+
+
+def _get_cache_layers(past_key_values) -> List[Tuple[torch.Tensor, torch.Tensor]]:
+    """The (keys, values) of each layer, of shape (rows, heads, columns, head dim)."""
+    return [(layer.keys, layer.values) for layer in past_key_values.layers]
+
+
+def _pad_columns(tensor: torch.Tensor, num_columns: int) -> torch.Tensor:
+    """Left-pad the columns (dim 2 of keys and values, dim 1 of attention masks) of `tensor` to `num_columns`."""
+    column_dim = 2 if tensor.dim() == 4 else 1
+    num_padding_columns = num_columns - tensor.shape[column_dim]
+    if num_padding_columns == 0:
+        return tensor
+    padding_shape = list(tensor.shape)
+    padding_shape[column_dim] = num_padding_columns
+    return torch.cat([tensor.new_zeros(padding_shape), tensor], dim=column_dim)
+
+
+class ContinuousBatcher:
+    """Generate greedy responses to tokenized prompts, with up to `max_batch_size` sequences in flight.
+
+    Sequences end at one of `eos_token_ids`, once their response (decoded with `tokenizer`) matches one of
+    `stop_patterns`, or after `max_new_tokens`. With a `throughput_meter`, prefill and decode tokens and
+    times are added to it.
+    """
+
+    def __init__(
+        self,
+        model,
+        max_batch_size: int,
+        max_new_tokens: int,
+        eos_token_ids: Optional[Sequence[int]] = None,
+        pad_token_id: int = 0,
+        stop_patterns: Sequence[re.Pattern] = (),
+        tokenizer=None,
+        throughput_meter: Optional[ThroughputMeter] = None,
+    ):
+        if max_batch_size < 1:
+            raise ValueError(f"`max_batch_size` must be at least 1, got {max_batch_size}")
+        if max_new_tokens < 1:
+            raise ValueError(f"`max_new_tokens` must be at least 1, got {max_new_tokens}")
+        if stop_patterns and tokenizer is None:
+            raise ValueError("Stop patterns are matched against decoded responses, which needs the tokenizer")
+        self.model = model
+        self.max_batch_size = max_batch_size
+        self.max_new_tokens = max_new_tokens
+        self.eos_token_ids = set(eos_token_ids or [])
+        self.pad_token_id = pad_token_id
+        self.stop_patterns = stop_patterns
+        self.tokenizer = tokenizer
+        self.throughput_meter = throughput_meter if throughput_meter is not None else ThroughputMeter()
+        self.num_prefills = 0
+        self.num_decode_steps = 0
+        # Sum over decode steps of the number of sequences in flight.
+        self.num_decode_rows = 0
+
+    def generate(
+        self,
+        all_prompt_input_ids: Sequence[Sequence[int]],
+        order: Optional[Sequence[int]] = None,
+        all_stop_patterns: Optional[Sequence[Sequence[re.Pattern]]] = None,
+    ) -> Iterator[Tuple[int, List[int]]]:
+        """Yield `(index, new_token_ids)` for each prompt as soon as its sequence is done.
+
+        Prompts are admitted in `order` (by default, in the given order). New token ids end with the token
+        that ended the sequence (e.g., the end-of-sequence token), like the output of `model.generate`. With
+        `all_stop_patterns`, the sequence of prompt `i` stops at `all_stop_patterns[i]` rather than at the
+        stop patterns of the batcher.
+        """
+        if all_stop_patterns is not None and any(all_stop_patterns) and self.tokenizer is None:
+            raise ValueError("Stop patterns are matched against decoded responses, which needs the tokenizer")
+        pending = collections.deque(range(len(all_prompt_input_ids)) if order is None else order)
+        rows: List[_Sequence] = []
+        cache_layers = None
+        attention_mask = None
+        with torch.no_grad():
+            while pending or rows:
+                if pending and len(rows) < self.max_batch_size:
+                    admitted = []
+                    while pending and len(rows) + len(admitted) < self.max_batch_size:
+                        index = pending.popleft()
+                        stop_patterns = self.stop_patterns if all_stop_patterns is None else all_stop_patterns[index]
+                        admitted.append(_Sequence(index, len(all_prompt_input_ids[index]), stop_patterns))
+                    new_cache_layers, new_attention_mask = self._prefill(admitted, all_prompt_input_ids)
+                    if rows:
+                        num_columns = max(attention_mask.shape[1], new_attention_mask.shape[1])
+                        cache_layers = [
+                            (
+                                torch.cat([_pad_columns(keys, num_columns), _pad_columns(new_keys, num_columns)]),
+                                torch.cat([_pad_columns(values, num_columns), _pad_columns(new_values, num_columns)]),
+                            )
+                            for (keys, values), (new_keys, new_values) in zip(cache_layers, new_cache_layers)
+                        ]
+                        attention_mask = torch.cat(
+                            [_pad_columns(attention_mask, num_columns), _pad_columns(new_attention_mask, num_columns)]
+                        )
+                    else:
+                        cache_layers, attention_mask = new_cache_layers, new_attention_mask
+                    rows.extend(admitted)
+                else:
+                    cache_layers, attention_mask = self._decode_step(rows, cache_layers, attention_mask)
+
+                if any(row.done for row in rows):
+                    for row in rows:
+                        if row.done:
+                            yield row.index, row.new_token_ids
+                    kept = [position for position, row in enumerate(rows) if not row.done]
+                    rows = [rows[position] for position in kept]
+                    if not rows:
+                        cache_layers, attention_mask = None, None
+                        continue
+                    kept = torch.tensor(kept, device=attention_mask.device)
+                    attention_mask = attention_mask[kept]
+                    # Columns before the first token of every remaining row are masked out everywhere.
+                    first_column = int(attention_mask.any(dim=0).int().argmax())
+                    attention_mask = attention_mask[:, first_column:]
+                    cache_layers = [
+                        (keys[kept, :, first_column:], values[kept, :, first_column:]) for keys, values in cache_layers
+                    ]
+
+    def _prefill(self, admitted: List[_Sequence], all_prompt_input_ids: Sequence[Sequence[int]]):
+        """Prefill the prompts of the admitted sequences (left-padded together), and pick their first tokens."""
+        start = time.perf_counter()
+        prompt_input_ids = [list(all_prompt_input_ids[row.index]) for row in admitted]
+        max_length = max(len(input_ids) for input_ids in prompt_input_ids)
+        input_ids = torch.tensor(
+            [[self.pad_token_id] * (max_length - len(ids)) + ids for ids in prompt_input_ids], device=self.model.device
+        )
+        attention_mask = torch.tensor(
+            [[0] * (max_length - len(ids)) + [1] * len(ids) for ids in prompt_input_ids], device=self.model.device
+        )
+        position_ids = (attention_mask.cumsum(dim=1) - 1).clamp(min=0)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=DynamicCache(),
+            use_cache=True,
+            # Only the logits of the last position pick a token, as in `generate`.
+            logits_to_keep=1,
+        )
+        self._add_tokens(admitted, outputs.logits[:, -1])
+        self.num_prefills += 1
+        self.throughput_meter.num_prefill_tokens += sum(len(ids) for ids in prompt_input_ids)
+        self.throughput_meter.prefill_seconds += time.perf_counter() - start
+        return _get_cache_layers(outputs.past_key_values), attention_mask
+
+    def _decode_step(self, rows: List[_Sequence], cache_layers, attention_mask):
+        """Feed the last token of every sequence, and pick their next tokens."""
+        start = time.perf_counter()
+        device = attention_mask.device
+        input_ids = torch.tensor([[row.new_token_ids[-1]] for row in rows], device=device)
+        # The last token isn't in the cache yet: it goes after the prompt and the tokens generated before it.
+        position_ids = torch.tensor([[row.prompt_length + len(row.new_token_ids) - 1] for row in rows], device=device)
+        attention_mask = torch.cat([attention_mask, attention_mask.new_ones((len(rows), 1))], dim=1)
+        outputs = self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            position_ids=position_ids,
+            past_key_values=DynamicCache(ddp_cache_data=cache_layers),
+            use_cache=True,
+        )
+        self._add_tokens(rows, outputs.logits[:, -1])
+        self.num_decode_steps += 1
+        self.num_decode_rows += len(rows)
+        self.throughput_meter.num_decode_tokens += len(rows)
+        self.throughput_meter.decode_seconds += time.perf_counter() - start
+        return _get_cache_layers(outputs.past_key_values), attention_mask
+
+    def _add_tokens(self, rows: List[_Sequence], logits: torch.Tensor):
+        for row, token_id in zip(rows, logits.argmax(dim=-1).tolist()):
+            row.new_token_ids.append(token_id)
+            row.done = (
+                token_id in self.eos_token_ids
+                or len(row.new_token_ids) >= self.max_new_tokens
+                or self._matches_stop_pattern(row)
+            )
+
+    def _matches_stop_pattern(self, row: _Sequence) -> bool:
+        if not row.stop_patterns:
+            return False
+        response = self.tokenizer.decode(row.new_token_ids, skip_special_tokens=True)
+        return find_stop(response, row.stop_patterns) is not None
+
+    def format_report(self) -> str:
+        mean_rows = self.num_decode_rows / self.num_decode_steps if self.num_decode_steps else 0.0
+        return (
+            f"Continuous batching: {self.num_decode_steps} decode steps with {mean_rows:.1f} of {self.max_batch_size} "
+            f"slots busy on average, {self.num_prefills} prefills"
+        )
@@ -0,0 +1,49 @@
+#!/usr/bin/env python3
+"""Run generation on CPU: thread settings, bfloat16 weights and dynamic int8 quantization.
+
+Dynamic int8 quantization stores the weights of linear layers as int8, and quantizes their activations
+on the fly. It cuts their memory (and memory bandwidth, which bounds decoding) by 4x relative to
+float32, and needs float32 activations, so it can't be combined with bfloat16.
+"""
+import logging
+from typing import Optional
+
+import torch
+
+logger = logging.getLogger(__name__)
+
+CPU_DTYPES = {"float32": torch.float32, "bfloat16": torch.bfloat16}
+
+
+def configure_cpu_threads(num_threads: Optional[int] = None, num_interop_threads: Optional[int] = None):
+    """Set the number of threads used within an op (e.g., a matmul) and across independent ops.
+
+    The number of inter-op threads can only be set before any inter-op parallel work has started, so
+    call this before loading a model.
+    """
+    if num_threads is not None:
+        if num_threads < 1:
+            raise ValueError(f"`num_threads` must be at least 1, got {num_threads}")
+        torch.set_num_threads(num_threads)
+    if num_interop_threads is not None:
+        if num_interop_threads < 1:
+            raise ValueError(f"`num_interop_threads` must be at least 1, got {num_interop_threads}")
+        torch.set_num_interop_threads(num_interop_threads)
+    logger.info(f"Using {torch.get_num_threads()} intra-op and {torch.get_num_interop_threads()} inter-op CPU threads")
+
+
+def prepare_cpu_model(model, dtype: str = "float32", quantize_int8: bool = False):
+    """Move `model` to CPU in `dtype` (float32 or bfloat16), optionally quantizing its linear layers to int8.
+
+    Returns the prepared model, in eval mode.
+    """
+    if dtype not in CPU_DTYPES:
+        raise ValueError(f"Unsupported CPU dtype {dtype}, expected one of {sorted(CPU_DTYPES)}")
+    if quantize_int8 and dtype != "float32":
+        raise ValueError("Dynamic int8 quantization needs float32 activations, so it can't be combined with bfloat16")
+    model = model.to(device="cpu", dtype=CPU_DTYPES[dtype]).eval()
+    if quantize_int8:
+        from torch.ao.quantization import quantize_dynamic
+
+        model = quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return model
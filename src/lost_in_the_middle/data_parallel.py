@@ -0,0 +1,151 @@
+#!/usr/bin/env python3
+"""Data-parallel generation: split an input file into shards, one per worker, and merge their outputs.
+
+Shard `i` of `n` holds the examples on lines `i, i + n, i + 2n, ...` of the input file, so shards get
+similar numbers (and lengths) of examples. Workers read the whole input file and keep the examples of
+their shard (see `in_shard`), so no shard inputs are written, and every example gets the same prompt
+(including its random document ordering) as in a single-process run.
+
+A manifest (`manifest.json` in the shard directory) records the input, the worker arguments, and the
+output and status of every shard, so that an interrupted launch can be resumed and merged.
+"""
+import json
+import os
+import pathlib
+from typing import Dict, Iterator, List, Optional
+
+from xopen import xopen
+
+from lost_in_the_middle.kv_data import KVRecordFile, is_kv_record_file, iter_kv_examples
+
+COMPRESSION_SUFFIXES = (".gz", ".bz2", ".xz", ".zst")
+
+
+def check_shard(shard_index: int, num_shards: int):
+    if num_shards < 1:
+        raise ValueError(f"`num_shards` must be at least 1, got {num_shards}")
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"`shard_index` must be in [0, {num_shards}), got {shard_index}")
+
+
+def in_shard(line_index: int, shard_index: int, num_shards: int) -> bool:
+    return line_index % num_shards == shard_index
+
+
+def get_shard_dir(output_path) -> pathlib.Path:
+    return pathlib.Path(f"{output_path}.shards")
+
+
+def get_manifest_path(output_path) -> pathlib.Path:
+    return get_shard_dir(output_path) / "manifest.json"
+
+
+def create_manifest(input_path, output_path, num_shards: int, worker_args: List[str], devices: List[str]) -> Dict:
+    """A manifest for running `num_shards` workers on `input_path` (none of the shards are done yet)."""
+    check_shard(0, num_shards)
+    if len(devices) != num_shards:
+        raise ValueError(f"Got {len(devices)} devices for {num_shards} shards")
+    if is_kv_record_file(input_path):
+        num_examples = len(KVRecordFile(input_path))
+    else:
+        with xopen(input_path) as fin:
+            num_examples = sum(1 for _ in fin)
+    # Shard outputs are compressed like the merged output.
+    compression_suffix = next((suffix for suffix in COMPRESSION_SUFFIXES if str(output_path).endswith(suffix)), "")
+    shard_dir = get_shard_dir(output_path)
+    return {
+        "input_path": str(input_path),
+        "output_path": str(output_path),
+        "num_examples": num_examples,
+        "num_shards": num_shards,
+        "worker_args": worker_args,
+        "shards": [
+            {
+                "shard_index": shard_index,
+                "output_path": str(
+                    shard_dir / f"shard-{shard_index:05d}-of-{num_shards:05d}.jsonl{compression_suffix}"
+                ),
+                "log_path": str(shard_dir / f"shard-{shard_index:05d}-of-{num_shards:05d}.log"),
+                "device": devices[shard_index],
+                "num_examples": len(range(shard_index, num_examples, num_shards)),
+                "status": "pending",
+                "returncode": None,
+                "seconds": None,
+            }
+            for shard_index in range(num_shards)
+        ],
+    }
+
+
+def load_manifest(output_path) -> Optional[Dict]:
+    manifest_path = get_manifest_path(output_path)
+    if not manifest_path.exists():
+        return None
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def write_manifest(manifest: Dict):
+    """Write the manifest atomically, so that a crash leaves either the old or the new one."""
+    manifest_path = get_manifest_path(manifest["output_path"])
+    manifest_path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = manifest_path.with_name(f".tmp.{manifest_path.name}")
+    with open(temporary_path, "w") as f:
+        json.dump(manifest, f, indent=2)
+        f.write("\n")
+    os.replace(temporary_path, manifest_path)
+
+
+def check_resumable(manifest: Dict, new_manifest: Dict):
+    """Raise a ValueError if an existing manifest is for a different input, shard count, or worker arguments."""
+    for field in ("input_path", "num_examples", "num_shards", "worker_args"):
+        if manifest[field] != new_manifest[field]:
+            raise ValueError(
+                f"Cannot resume from {get_manifest_path(manifest['output_path'])}: it has {field} "
+                f"{manifest[field]!r}, but this launch has {new_manifest[field]!r}"
+            )
+
+
+def merge_shard_outputs(manifest: Dict):
+    """Interleave the shard outputs back into input order, writing them to the manifest's output path.
+
+    Every output example is checked against the input example at its position.
+    """
+    not_done = [shard["shard_index"] for shard in manifest["shards"] if shard["status"] != "done"]
+    if not_done:
+        raise ValueError(f"Cannot merge shard outputs: shards {not_done} aren't done")
+    output_path = manifest["output_path"]
+    directory, name = os.path.split(output_path)
+    # Keep the extension, which xopen picks the compression from.
+    temporary_path = os.path.join(directory, f".tmp.{name}")
+    shard_files = [xopen(shard["output_path"]) for shard in manifest["shards"]]
+    try:
+        with xopen(temporary_path, "w") as fout:
+            num_shards = manifest["num_shards"]
+            for line_index, input_example in enumerate(_iter_input_examples(manifest["input_path"])):
+                output_line = shard_files[line_index % num_shards].readline()
+                if not output_line:
+                    raise ValueError(f"Shard {line_index % num_shards} has no output for input line {line_index}")
+                output_example = json.loads(output_line)
+                if any(output_example.get(field) != value for field, value in input_example.items()):
+                    raise ValueError(
+                        f"The output of shard {line_index % num_shards} for input line {line_index} is for another "
+                        "example"
+                    )
+                fout.write(output_line)
+        for shard, shard_file in zip(manifest["shards"], shard_files):
+            if shard_file.readline():
+                raise ValueError(f"Shard {shard['shard_index']} has more outputs than input examples")
+    finally:
+        for shard_file in shard_files:
+            shard_file.close()
+    os.replace(temporary_path, output_path)
+
+
+def _iter_input_examples(input_path) -> Iterator[Dict]:
+    if is_kv_record_file(input_path):
+        yield from iter_kv_examples(input_path)
+        return
+    with xopen(input_path) as fin:
+        for line in fin:
+            yield json.loads(line)
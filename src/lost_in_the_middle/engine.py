@@ -0,0 +1,860 @@
+#!/usr/bin/env python3
+"""Generate responses to every example of a data file, for any task and model.
+
+A task (`QATask`, `KVTask`, or `PromptTask` for prompts given as is) turns input examples into prompts
+and output examples. A backend (`HFBackend`, `MPTBackend`, `LongChatBackend`) loads a model and its
+tokenizer, and formats prompts and generation arguments for it. `generate_responses` does the rest for
+every task and backend: it batches prompts by length, optionally reuses the past key/values of their
+shared prefix, overlaps preparing, generating and decoding batches, reports throughput, writes responses
+batch by batch so that interrupted runs can be resumed, and can take responses from a
+persistent generation cache.
+"""
+import contextlib
+import json
+import logging
+import pathlib
+import random
+import re
+import time
+from copy import deepcopy
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+import torch
+from tqdm import tqdm
+from transformers import StoppingCriteriaList
+from xopen import xopen
+
+from lost_in_the_middle.batching import format_padding_report, get_batches
+from lost_in_the_middle.continuous_batching import ContinuousBatcher
+from lost_in_the_middle.cpu_backend import (
+    CPU_DTYPES,
+    configure_cpu_threads,
+    prepare_cpu_model,
+)
+from lost_in_the_middle.data_parallel import check_shard, in_shard
+from lost_in_the_middle.generation_cache import GenerationCache, get_generation_key
+from lost_in_the_middle.io_utils import CheckpointedOutput, get_example_keys
+from lost_in_the_middle.kv_data import iter_kv_examples
+from lost_in_the_middle.passage_store import PassageStore
+from lost_in_the_middle.pipeline import OrderedWorkers, StageTimes, prefetch
+from lost_in_the_middle.prefix_cache import SharedPrefixCache, get_shared_prefix
+from lost_in_the_middle.prompting import (
+    DocumentBatch,
+    KVRecords,
+    get_closedbook_qa_prompt,
+    get_qa_prompt,
+)
+from lost_in_the_middle.stopping import (
+    StopPatternCriteria,
+    StopReport,
+    compile_stop_patterns,
+    truncate_at_stop,
+)
+from lost_in_the_middle.throughput import ThroughputMeter
+
+logger = logging.getLogger(__name__)
+
+
+class TaskExample(NamedTuple):
+    input_example: dict
+    # The prompt for the example, before any model-specific formatting.
+    prompt: str
+    # What the prompt was built from: the (possibly reordered) documents of a QA example, or the
+    # (reordered) key-value records of a KV retrieval example.
+    context: object
+
+
+class QATask:
+    """Multi-document (or, with `closedbook`, closed-book) question answering."""
+
+    # Only the first line of a response is evaluated.
+    stop_patterns = [r"\n"]
+
+    def get_stop_patterns(self, example: TaskExample) -> List[str]:
+        return self.stop_patterns
+
+    def __init__(
+        self,
+        closedbook: bool = False,
+        prompt_mention_random_ordering: bool = False,
+        use_random_ordering: bool = False,
+        query_aware_contextualization: bool = False,
+        validate_documents: bool = False,
+        passage_store_path: Optional[str] = None,
+        seed: int = 0,
+    ):
+        self.closedbook = closedbook
+        self.prompt_mention_random_ordering = prompt_mention_random_ordering
+        self.use_random_ordering = use_random_ordering
+        self.query_aware_contextualization = query_aware_contextualization
+        self.validate_documents = validate_documents
+        self.passage_store_path = passage_store_path
+        self.seed = seed
+
+    def get_settings(self) -> Dict:
+        """Settings that change the prompts (and so the responses)."""
+        return {
+            "closedbook": self.closedbook,
+            "prompt_mention_random_ordering": self.prompt_mention_random_ordering,
+            "use_random_ordering": self.use_random_ordering,
+            "query_aware_contextualization": self.query_aware_contextualization,
+        }
+
+    def load_examples(self, input_path, shard_index: int = 0, num_shards: int = 1) -> List[TaskExample]:
+        check_shard(shard_index, num_shards)
+        rng = random.Random(self.seed)
+        passage_store = PassageStore(self.passage_store_path, readonly=True) if self.passage_store_path else None
+        examples = []
+        with xopen(input_path) as fin:
+            for line_index, line in enumerate(tqdm(fin)):
+                if not in_shard(line_index, shard_index, num_shards):
+                    if self.use_random_ordering:
+                        # Shuffle as many distractors as the skipped example has, so that the documents of the
+                        # examples in this shard are ordered the same as in a single-process run.
+                        ctxs = json.loads(line).get("ctxs", [])
+                        rng.shuffle(list(range(sum(ctx.get("isgold") is False for ctx in ctxs))))
+                    continue
+                input_example = json.loads(line)
+                question = input_example["question"]
+                if self.closedbook:
+                    documents = DocumentBatch.from_dicts([])
+                else:
+                    documents = DocumentBatch.from_dicts(
+                        input_example["ctxs"], validate=self.validate_documents, passage_store=passage_store
+                    )
+                    if not documents:
+                        raise ValueError(f"Did not find any documents for example: {input_example}")
+
+                if self.use_random_ordering:
+                    # Randomly order only the distractors (isgold is False), keeping isgold documents
+                    # at their existing index.
+                    (original_gold_index,) = [idx for idx, isgold in enumerate(documents.isgolds) if isgold is True]
+                    distractor_indices = [idx for idx, isgold in enumerate(documents.isgolds) if isgold is False]
+                    rng.shuffle(distractor_indices)
+                    distractor_indices.insert(original_gold_index, original_gold_index)
+                    documents = documents.take(distractor_indices)
+
+                if self.closedbook:
+                    prompt = get_closedbook_qa_prompt(question)
+                else:
+                    prompt = get_qa_prompt(
+                        question,
+                        documents,
+                        mention_random_ordering=self.prompt_mention_random_ordering,
+                        query_aware_contextualization=self.query_aware_contextualization,
+                    )
+                examples.append(TaskExample(input_example=input_example, prompt=prompt, context=documents))
+        if passage_store is not None:
+            passage_store.close()
+        return examples
+
+    def get_output_example(self, example: TaskExample, prompt: str, response: str, model_settings: Dict) -> Dict:
+        output_example = deepcopy(example.input_example)
+        # Add some extra metadata to the output example
+        output_example["model_prompt"] = prompt
+        output_example["model_documents"] = example.context.to_dicts()
+        output_example["model_answer"] = response
+        output_example.update(model_settings)
+        output_example["model_prompt_mention_random_ordering"] = self.prompt_mention_random_ordering
+        output_example["model_use_random_ordering"] = self.use_random_ordering
+        return output_example
+
+
+class KVTask:
+    """Key-value retrieval, with the key to retrieve moved to `gold_index`."""
+
+    # Responses are evaluated on the (quoted) value. Models often quote the key before it, so responses stop at
+    # the first quoted string that isn't the key (`{key}` is filled in by `get_stop_patterns`). Quotes are
+    # paired from the start of the response, so that the closing quote of the key doesn't open a string.
+    stop_patterns = [r'^[^"]*(?:"{key}"[^"]*)*"(?!{key}")[^"]*"']
+
+    def __init__(self, gold_index: int, query_aware_contextualization: bool = False):
+        self.gold_index = gold_index
+        self.query_aware_contextualization = query_aware_contextualization
+
+    def get_stop_patterns(self, example: TaskExample) -> List[str]:
+        key = re.escape(example.input_example["key"])
+        return [stop_pattern.replace("{key}", key) for stop_pattern in self.stop_patterns]
+
+    def get_settings(self) -> Dict:
+        """Settings that change the prompts (and so the responses)."""
+        return {"gold_index": self.gold_index, "query_aware_contextualization": self.query_aware_contextualization}
+
+    def load_examples(self, input_path, shard_index: int = 0, num_shards: int = 1) -> List[TaskExample]:
+        check_shard(shard_index, num_shards)
+        examples = []
+        # Data files are either JSON lines or (memory-mapped) `.npy` records, see `kv_data`.
+        for input_example in tqdm(iter_kv_examples(input_path, shard_index=shard_index, num_shards=num_shards)):
+            kv_records = KVRecords(input_example["ordered_kv_records"], input_example["key"])
+            if kv_records.data[kv_records.key_index][1] != input_example["value"]:
+                raise ValueError(f"The key of example {input_example} doesn't have its value in the records")
+            # Move the kv to retrieve from its original index to the specified gold index
+            ordered_kv_records = kv_records.move_key(kv_records.data, self.gold_index)
+            prompt = kv_records.render_prompt(
+                gold_index=self.gold_index, query_aware_contextualization=self.query_aware_contextualization
+            )
+            examples.append(TaskExample(input_example=input_example, prompt=prompt, context=ordered_kv_records))
+        return examples
+
+    def get_output_example(self, example: TaskExample, prompt: str, response: str, model_settings: Dict) -> Dict:
+        output_example = deepcopy(example.input_example)
+        # Add some extra metadata to the output example
+        output_example["model_prompt"] = prompt
+        output_example["model_answer"] = response
+        output_example.update(model_settings)
+        output_example["model_ordered_kv_records"] = example.context
+        return output_example
+
+
+class PromptTask:
+    """Prompts given as is, in the `prompt` field of each input example."""
+
+    stop_patterns = []
+
+    def get_stop_patterns(self, example: TaskExample) -> List[str]:
+        return self.stop_patterns
+
+    def get_settings(self) -> Dict:
+        """Settings that change the prompts (and so the responses)."""
+        return {}
+
+    def load_examples(self, input_path, shard_index: int = 0, num_shards: int = 1) -> List[TaskExample]:
+        check_shard(shard_index, num_shards)
+        examples = []
+        with xopen(input_path) as fin:
+            for line_index, line in enumerate(fin):
+                if in_shard(line_index, shard_index, num_shards):
+                    input_example = json.loads(line)
+                    examples.append(
+                        TaskExample(input_example=input_example, prompt=input_example["prompt"], context=None)
+                    )
+        return examples
+
+    def get_output_example(self, example: TaskExample, prompt: str, response: str, model_settings: Dict) -> Dict:
+        output_example = deepcopy(example.input_example)
+        output_example["model_prompt"] = prompt
+        output_example["model_answer"] = response
+        output_example.update(model_settings)
+        return output_example
+
+
+TASKS = {"qa": QATask, "kv": KVTask, "prompt": PromptTask}
+
+
+class HFBackend:
+    """A causal LM loaded with `AutoModelForCausalLM`, on one or more GPUs or on CPU.
+
+    Subclasses adapt loading, prompt formatting and generation arguments to particular models.
+    """
+
+    trust_remote_code = False
+
+    def __init__(
+        self,
+        model_name: str,
+        device: str = "cuda",
+        num_gpus: int = 1,
+        max_memory_per_gpu: Optional[int] = None,
+        num_threads: Optional[int] = None,
+        num_interop_threads: Optional[int] = None,
+        cpu_dtype: str = "float32",
+        quantize_int8: bool = False,
+    ):
+        if device not in ("cuda", "cpu"):
+            raise ValueError(f"Unsupported device {device}, expected cuda or cpu")
+        if quantize_int8 and device != "cpu":
+            raise ValueError("--quantize-int8 is only supported with --device cpu")
+        self.model_name = model_name
+        self.device = device
+        self.num_gpus = num_gpus
+        self.max_memory_per_gpu = max_memory_per_gpu
+        self.num_threads = num_threads
+        self.num_interop_threads = num_interop_threads
+        self.cpu_dtype = cpu_dtype
+        self.quantize_int8 = quantize_int8
+
+    @property
+    def supports_prefix_cache(self) -> bool:
+        return True
+
+    @property
+    def supports_continuous_batching(self) -> bool:
+        # Like the prefix cache, continuous batching splices the rows of `DynamicCache`s.
+        return self.supports_prefix_cache
+
+    def format_prompt(self, prompt: str) -> str:
+        return prompt
+
+    def get_generate_kwargs(self, tokenizer) -> Dict:
+        return {"pad_token_id": tokenizer.pad_token_id}
+
+    def autocast(self):
+        return contextlib.nullcontext()
+
+    def get_model_identity(self) -> Dict:
+        """What determines the responses of the model, besides the prompt and decoding parameters."""
+        from transformers import AutoConfig
+
+        config = AutoConfig.from_pretrained(self.model_name, trust_remote_code=self.trust_remote_code)
+        if self.device == "cuda":
+            precision = "bfloat16"
+        else:
+            precision = "int8" if self.quantize_int8 else self.cpu_dtype
+        return {
+            "backend": type(self).__name__,
+            "model": self.model_name,
+            # The commit of the model on the Hub, or None for a local directory.
+            "revision": getattr(config, "_commit_hash", None),
+            "precision": precision,
+        }
+
+    def load(self):
+        """Load the model (in eval mode, on its device) and its tokenizer (padding on the left)."""
+        if self.device == "cpu":
+            configure_cpu_threads(self.num_threads, self.num_interop_threads)
+        elif not torch.cuda.is_available():
+            raise ValueError("Unable to find CUDA device with torch. Please use a CUDA device (or `--device cpu`).")
+        model, tokenizer = self.load_model_and_tokenizer()
+        tokenizer.padding_side = "left"
+        if self.device == "cpu":
+            model = prepare_cpu_model(model, dtype=self.cpu_dtype, quantize_int8=self.quantize_int8)
+        return model.eval(), tokenizer
+
+    def load_model_and_tokenizer(self):
+        logger.info("Loading tokenizer")
+        tokenizer = self.load_tokenizer()
+        logger.info("Loading model")
+        return self.load_model(), tokenizer
+
+    def load_tokenizer(self):
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        if tokenizer.pad_token is None:
+            tokenizer.pad_token = tokenizer.eos_token
+        return tokenizer
+
+    def load_model(self, **kwargs):
+        from transformers import AutoModelForCausalLM
+
+        if self.device == "cuda" and self.num_gpus > 1:
+            kwargs["device_map"] = "auto"
+            if self.max_memory_per_gpu is not None:
+                kwargs["max_memory"] = {i: f"{self.max_memory_per_gpu}GiB" for i in range(self.num_gpus)}
+        model = AutoModelForCausalLM.from_pretrained(
+            self.model_name,
+            low_cpu_mem_usage=True,
+            torch_dtype=torch.bfloat16 if self.device == "cuda" else CPU_DTYPES[self.cpu_dtype],
+            **kwargs,
+        )
+        if self.device == "cuda" and self.num_gpus == 1:
+            model = model.to(self.device)
+        return model
+
+
+class MPTBackend(HFBackend):
+    """MPT (e.g., `mosaicml/mpt-30b-instruct`), with its context extended to 16384 tokens."""
+
+    trust_remote_code = True
+
+    def __init__(self, model_name: str, **kwargs):
+        super().__init__(model_name, **kwargs)
+        self.instruct = "instruct" in model_name
+        if self.instruct:
+            logger.warning(f"Model {model_name} appears to be an instruct model, applying instruct formatting")
+
+    @property
+    def supports_prefix_cache(self) -> bool:
+        # The remote code of MPT keeps its past key/values as tuples, rather than a `DynamicCache`.
+        return False
+
+    def format_prompt(self, prompt: str) -> str:
+        if not self.instruct:
+            return prompt
+        return (
+            "Below is an instruction that describes a task. Write a response that appropriately completes the request."
+            f"\n### Instruction:\n{prompt}\n### Response:\n"
+        )
+
+    def get_generate_kwargs(self, tokenizer) -> Dict:
+        return {"eos_token_id": 0, "pad_token_id": 0}
+
+    def autocast(self):
+        return torch.autocast(self.device, dtype=torch.bfloat16, enabled=self.device == "cuda")
+
+    def load_tokenizer(self):
+        from transformers import AutoTokenizer
+
+        tokenizer = AutoTokenizer.from_pretrained(self.model_name)
+        tokenizer.pad_token = tokenizer.eos_token  # to avoid an error
+        return tokenizer
+
+    def load_model(self, **kwargs):
+        from transformers import AutoConfig
+
+        config = AutoConfig.from_pretrained(self.model_name, trust_remote_code=self.trust_remote_code)
+        # Triton attention only runs on GPUs.
+        config.attn_config["attn_impl"] = "triton" if self.device == "cuda" else "torch"
+        config.max_seq_len = 16384  # (input + output) tokens can now be up to 16384
+        return super().load_model(config=config, trust_remote_code=self.trust_remote_code, **kwargs)
+
+
+class LongChatBackend(HFBackend):
+    """LongChat (`lmsys/longchat-13b-16k`), loaded with FastChat and its condensed rotary embeddings patch."""
+
+    def __init__(self, model_name: str, longchat_flash_attn: bool = False, longchat_ratio: int = 8, **kwargs):
+        super().__init__(model_name, **kwargs)
+        if longchat_ratio != 8:
+            raise ValueError("--longchat-ratio=8 is the only value currently supported.")
+        if longchat_flash_attn and self.device != "cuda":
+            raise ValueError("--longchat-flash-attn needs a CUDA device")
+        self.longchat_flash_attn = longchat_flash_attn
+        self.longchat_ratio = longchat_ratio
+        self.chat = "chat" in model_name
+        if self.chat:
+            logger.warning(f"Model {model_name} appears to be an chat model, applying chat formatting")
+
+    @property
+    def supports_prefix_cache(self) -> bool:
+        # Flash attention disables the KV cache.
+        return not self._uses_flash_attn
+
+    @property
+    def _uses_flash_attn(self) -> bool:
+        return "longchat" in self.model_name and self.longchat_flash_attn
+
+    def format_prompt(self, prompt: str) -> str:
+        if not self.chat:
+            return prompt
+        from fastchat.model import get_conversation_template
+
+        conv = get_conversation_template("vicuna")
+        conv.append_message(conv.roles[0], prompt)
+        conv.append_message(conv.roles[1], None)
+        return conv.get_prompt()
+
+    def get_generate_kwargs(self, tokenizer) -> Dict:
+        return {"use_cache": not self._uses_flash_attn}
+
+    def load_model_and_tokenizer(self):
+        # Copied from
+        # https://github.com/DachengLi1/LongChat/blob/43d71f03d7711a2ab3b78ee8d1e38b65bb7fd22f/longeval/utils.py
+        if "longchat" in self.model_name:
+            from longchat.train.monkey_patch.llama_condense_monkey_patch import (
+                replace_llama_with_condense,
+            )
+
+            replace_llama_with_condense(self.longchat_ratio)
+            if self.longchat_flash_attn:
+                from longchat.train.monkey_patch.llama_flash_attn_monkey_patch import (
+                    replace_llama_attn_with_flash_attn,
+                )
+
+                replace_llama_attn_with_flash_attn()
+        from fastchat.model import load_model
+
+        logger.info("Loading model and tokenizer")
+        return load_model(
+            self.model_name,
+            device=self.device,
+            num_gpus=self.num_gpus,
+            max_gpu_memory=f"{self.max_memory_per_gpu}GiB" if self.max_memory_per_gpu is not None else None,
+            load_8bit=False,
+            cpu_offloading=False,
+            debug=False,
+        )
+
+
+BACKENDS = {"hf": HFBackend, "mpt": MPTBackend, "longchat": LongChatBackend}
+
+
+class GenerationJob(NamedTuple):
+    task: object
+    input_path: object
+    output_path: object
+
+
+def get_task_kwargs(
+    task_name: str,
+    closedbook: bool = False,
+    prompt_mention_random_ordering: bool = False,
+    use_random_ordering: bool = False,
+    query_aware_contextualization: bool = False,
+    validate_documents: bool = False,
+    passage_store_path: Optional[str] = None,
+) -> Dict:
+    """The keyword arguments of task `task_name`, among the task options of the response scripts."""
+    if task_name == "qa":
+        return {
+            "closedbook": closedbook,
+            "prompt_mention_random_ordering": prompt_mention_random_ordering,
+            "use_random_ordering": use_random_ordering,
+            "query_aware_contextualization": query_aware_contextualization,
+            "validate_documents": validate_documents,
+            "passage_store_path": passage_store_path,
+        }
+    if task_name == "kv":
+        return {"query_aware_contextualization": query_aware_contextualization}
+    return {}
+
+
+def get_generation_jobs(
+    task_name: str, input_path: str, output_path: str, gold_indices: Optional[Sequence[int]] = None, **task_kwargs
+) -> List[GenerationJob]:
+    """One job per gold index, filling in the `{gold_index}` placeholder of `input_path` and `output_path`.
+
+    `KVTask` moves the key to retrieve to each gold index; the other tasks read the data file of each gold
+    index. Without gold indices, there's a single job (and the paths mustn't have placeholders). `task_kwargs`
+    are passed to the task.
+    """
+    if task_name not in TASKS:
+        raise ValueError(f"Unknown task {task_name}, expected one of {', '.join(TASKS)}")
+    if not gold_indices:
+        if task_name == "kv":
+            raise ValueError("KV retrieval needs the gold index to move the key to")
+        if "{gold_index}" in input_path or "{gold_index}" in output_path:
+            raise ValueError("Paths with a `{gold_index}` placeholder need gold indices to fill it in")
+        return [GenerationJob(TASKS[task_name](**task_kwargs), input_path, output_path)]
+    if len(gold_indices) > 1 and "{gold_index}" not in output_path:
+        raise ValueError(
+            f"`output_path` must contain a `{{gold_index}}` placeholder when answering at multiple gold indices, "
+            f"got {output_path}"
+        )
+    if task_name != "kv" and len(gold_indices) > 1 and "{gold_index}" not in input_path:
+        raise ValueError(
+            f"`input_path` must contain a `{{gold_index}}` placeholder to answer {task_name} data at multiple gold "
+            f"indices, got {input_path}"
+        )
+    jobs = []
+    for gold_index in gold_indices:
+        gold_index_kwargs = {"gold_index": gold_index} if task_name == "kv" else {}
+        jobs.append(
+            GenerationJob(
+                TASKS[task_name](**gold_index_kwargs, **task_kwargs),
+                input_path.replace("{gold_index}", str(gold_index)),
+                output_path.replace("{gold_index}", str(gold_index)),
+            )
+        )
+    return jobs
+
+
+def generate_responses(task, backend, input_path, output_path, **kwargs):
+    """Generate a response to every example of `input_path` with `backend`, writing output examples to `output_path`.
+
+    See `generate_all_responses` for the keyword arguments.
+    """
+    generate_all_responses([GenerationJob(task, input_path, output_path)], backend, **kwargs)
+
+
+def generate_all_responses(
+    jobs: Sequence[GenerationJob],
+    backend,
+    temperature: float = 0.0,
+    top_p: float = 1.0,
+    batch_size: int = 8,
+    max_new_tokens: int = 100,
+    max_batch_tokens: Optional[int] = None,
+    sort_by_length: bool = True,
+    reuse_prefix_cache: bool = False,
+    resume: bool = False,
+    num_decode_workers: int = 2,
+    generation_cache: Optional[GenerationCache] = None,
+    shard_index: int = 0,
+    num_shards: int = 1,
+    stop_patterns: Optional[Sequence[str]] = None,
+    continuous_batching: bool = False,
+):
+    """Generate a response to every example of the input of each job, writing output examples to its output.
+
+    The model is loaded once for every job (e.g., the same data with the gold document or key at each
+    position), and the prompts of every job are batched together. The time spent loading the model is
+    logged separately from the rest of the run.
+
+    Output examples are in input order, whatever order the prompts are batched in. They're written to
+    `{output_path}.partial` batch by batch, and moved to `output_path` once every example has a response;
+    with `resume`, examples that already have a response in the partial output are skipped.
+
+    Batches are pipelined: the inputs of the next batch are prepared while the current one generates,
+    and the new tokens of finished batches are decoded (on `num_decode_workers` threads) and written
+    meanwhile. The time spent in each stage is logged at the end.
+
+    With a `generation_cache`, greedy responses to prompts that were answered before (by the same model,
+    with the same decoding parameters) are taken from the cache rather than generated, and generated
+    responses are added to it. Prompts that repeat within the data files are only generated once.
+
+    With `num_shards` > 1, only the examples of shard `shard_index` are answered (see `data_parallel`).
+
+    Each sequence stops as soon as its response matches one of `stop_patterns` (regular expressions, see
+    `stopping`), and responses are cut right after the match. By default, the stop patterns of the task of
+    each example are used; pass an empty list to generate up to `max_new_tokens` (or the end-of-sequence token).
+
+    With `continuous_batching`, sequences aren't batched statically: up to `batch_size` of them are generated
+    at once, and each one that's done is replaced by the next prompt (see `continuous_batching`). Only greedy
+    decoding is supported, without `max_batch_tokens` or `reuse_prefix_cache`.
+    """
+    if not jobs:
+        raise ValueError("Got no jobs to generate responses for")
+    if reuse_prefix_cache and not backend.supports_prefix_cache:
+        raise ValueError(
+            f"--reuse-prefix-cache isn't supported by {type(backend).__name__} with these settings, which don't use "
+            "a `DynamicCache`"
+        )
+    if continuous_batching:
+        if not backend.supports_continuous_batching:
+            raise ValueError(f"Continuous batching isn't supported by {type(backend).__name__} with these settings")
+        if temperature > 0.0:
+            raise ValueError("Continuous batching only supports greedy decoding (temperature 0)")
+        if reuse_prefix_cache or max_batch_tokens is not None:
+            raise ValueError("Continuous batching doesn't support --reuse-prefix-cache or --max-batch-tokens")
+    if stop_patterns is not None:
+        stop_patterns = list(stop_patterns)
+    stage_times = StageTimes()
+
+    # Examples of every job are numbered together; `example_jobs[index]` is the job of example `index`.
+    examples, prompts, example_keys, example_jobs = [], [], [], []
+    checkpoints = []
+    pending_indices = []
+    for job_index, job in enumerate(jobs):
+        # Create directory for output path if it doesn't exist.
+        pathlib.Path(job.output_path).parent.mkdir(parents=True, exist_ok=True)
+        job_examples = job.task.load_examples(job.input_path, shard_index=shard_index, num_shards=num_shards)
+        # Responses are written batch by batch, so that an interrupted run can be resumed.
+        job_example_keys = get_example_keys(example.input_example for example in job_examples)
+        checkpoint = CheckpointedOutput(
+            job.output_path,
+            resume=resume,
+            metadata={
+                "model": backend.model_name,
+                "temperature": temperature,
+                "top_p": top_p,
+                "max_new_tokens": max_new_tokens,
+                "stop_patterns": job.task.stop_patterns if stop_patterns is None else stop_patterns,
+                **job.task.get_settings(),
+                **({"shard_index": shard_index, "num_shards": num_shards} if num_shards > 1 else {}),
+            },
+        )
+        checkpoints.append(checkpoint)
+        pending_indices.extend(
+            len(examples) + position for position, key in enumerate(job_example_keys) if key not in checkpoint
+        )
+        examples.extend(job_examples)
+        prompts.extend(backend.format_prompt(example.prompt) for example in job_examples)
+        example_keys.extend(job_example_keys)
+        example_jobs.extend([job_index] * len(job_examples))
+    # The stop patterns of each example (e.g., KV retrieval responses don't stop at their own key).
+    example_stop_patterns = [
+        jobs[job_index].task.get_stop_patterns(example) if stop_patterns is None else stop_patterns
+        for example, job_index in zip(examples, example_jobs)
+    ]
+    logger.info(
+        f"Getting responses for {len(pending_indices)} of {len(examples)} examples"
+        + (f" of {len(jobs)} inputs" if len(jobs) > 1 else "")
+    )
+    model_settings = {"model": backend.model_name, "model_temperature": temperature, "model_top_p": top_p}
+
+    def get_output_examples(indices, responses) -> Dict[int, Tuple[List[str], List[Dict]]]:
+        """The keys and output examples of the examples at `indices`, by job."""
+        outputs_by_job = {}
+        for index, response in zip(indices, responses):
+            keys, output_examples = outputs_by_job.setdefault(example_jobs[index], ([], []))
+            keys.append(example_keys[index])
+            output_examples.append(
+                jobs[example_jobs[index]].task.get_output_example(
+                    examples[index], prompts[index], response, model_settings
+                )
+            )
+        return outputs_by_job
+
+    def write_output_examples(outputs_by_job):
+        for job_index, (keys, output_examples) in outputs_by_job.items():
+            checkpoints[job_index].write_batch(keys, output_examples)
+
+    def finalize():
+        for job_index, checkpoint in enumerate(checkpoints):
+            checkpoint.finalize([key for key, job in zip(example_keys, example_jobs) if job == job_index])
+
+    # Pending examples with the same generation key as an earlier one get a copy of its response.
+    generation_keys = None
+    duplicate_indices: Dict[int, List[int]] = {}
+    if generation_cache is not None and temperature > 0.0:
+        logger.warning("Sampled responses aren't cached, so the generation cache is ignored")
+        generation_cache = None
+    if generation_cache is not None and pending_indices:
+        model_identity = backend.get_model_identity()
+        decoding_settings = {"temperature": temperature, "top_p": top_p, "max_new_tokens": max_new_tokens}
+        generation_keys = {
+            index: get_generation_key(
+                model_identity,
+                prompts[index],
+                {**decoding_settings, "stop_patterns": example_stop_patterns[index]},
+            )
+            for index in pending_indices
+        }
+        cached_responses = generation_cache.get_many(generation_keys.values())
+        cached_indices = [index for index in pending_indices if generation_keys[index] in cached_responses]
+        write_output_examples(
+            get_output_examples(cached_indices, [cached_responses[generation_keys[index]] for index in cached_indices])
+        )
+        first_indices = {}
+        for index in pending_indices:
+            if generation_keys[index] in cached_responses:
+                continue
+            first_index = first_indices.setdefault(generation_keys[index], index)
+            if first_index != index:
+                duplicate_indices.setdefault(first_index, []).append(index)
+        pending_indices = list(first_indices.values())
+        logger.info(
+            f"Took {len(cached_indices)} responses from the generation cache, "
+            f"generating {len(pending_indices)} unique prompts"
+        )
+
+    if not pending_indices:
+        if generation_cache is not None:
+            logger.info(generation_cache.format_stats())
+        finalize()
+        return
+
+    load_start = time.perf_counter()
+    with stage_times.time("load model"):
+        model, tokenizer = backend.load()
+    logger.info(f"Loaded the model in {time.perf_counter() - load_start:.1f} s")
+
+    # Batch prompts of similar length together, so that short prompts aren't padded to long ones.
+    all_prompt_input_ids = tokenizer([prompts[index] for index in pending_indices])["input_ids"]
+    prompt_lengths = [len(input_ids) for input_ids in all_prompt_input_ids]
+    batches = get_batches(prompt_lengths, batch_size, max_batch_tokens=max_batch_tokens, sort_by_length=sort_by_length)
+    if not continuous_batching:
+        logger.info(format_padding_report(prompt_lengths, batches, batch_size))
+
+    # Prefill the instructions (and chat template) that every prompt starts with once, rather than per batch.
+    prefix_cache = None
+    if reuse_prefix_cache and all_prompt_input_ids:
+        shared_prefix = get_shared_prefix(all_prompt_input_ids)
+        if shared_prefix:
+            prefix_cache = SharedPrefixCache(model, shared_prefix)
+            logger.info(
+                f"Reusing the past key/values of a {len(shared_prefix)}-token prefix shared by every prompt "
+                f"({len(shared_prefix) * len(prompt_lengths) / sum(prompt_lengths):.1%} of prompt tokens)"
+            )
+        else:
+            logger.warning("Prompts don't share a prefix, so there's nothing to reuse")
+
+    do_sample = temperature > 0.0
+    generate_kwargs = {
+        "max_new_tokens": max_new_tokens,
+        "do_sample": do_sample,
+        "temperature": temperature if do_sample else None,
+        "top_p": top_p if do_sample else None,
+        **backend.get_generate_kwargs(tokenizer),
+    }
+    throughput_meter = ThroughputMeter()
+    stop_report = StopReport(max_new_tokens)
+    compiled_stop_patterns = [compile_stop_patterns(example_stop_patterns[index]) for index in pending_indices]
+    has_stop_patterns = any(compiled_stop_patterns)
+
+    # The inputs of the next batch are prepared on a background thread while the current batch generates,
+    # and outputs are decoded and written on worker threads while the next batches generate.
+    def prepare_inputs(batch):
+        with stage_times.time("prepare"):
+            batch_input_ids = [all_prompt_input_ids[position] for position in batch]
+            if prefix_cache is not None:
+                inputs = prefix_cache.prepare_inputs(batch_input_ids, pad_token_id=tokenizer.pad_token_id)
+            else:
+                inputs = tokenizer.pad({"input_ids": batch_input_ids}, padding=True, return_tensors="pt").to(
+                    model.device
+                )
+        return batch, inputs
+
+    def decode_outputs(batch_and_new_token_ids):
+        batch, new_token_ids = batch_and_new_token_ids
+        with stage_times.time("decode"):
+            responses = tokenizer.batch_decode(
+                new_token_ids, skip_special_tokens=True, clean_up_tokenization_spaces=True
+            )
+            responses = [
+                truncate_at_stop(response, compiled_stop_patterns[position])
+                for position, response in zip(batch, responses)
+            ]
+            output_indices, output_responses, new_cache_entries = [], [], {}
+            for position, response in zip(batch, responses):
+                index = pending_indices[position]
+                for output_index in [index, *duplicate_indices.get(index, [])]:
+                    output_indices.append(output_index)
+                    output_responses.append(response)
+                if generation_keys is not None:
+                    new_cache_entries[generation_keys[index]] = response
+            outputs_by_job = get_output_examples(output_indices, output_responses)
+        return outputs_by_job, new_cache_entries
+
+    def write_outputs(outputs_by_job_and_cache_entries):
+        outputs_by_job, new_cache_entries = outputs_by_job_and_cache_entries
+        with stage_times.time("write"):
+            write_output_examples(outputs_by_job)
+            if generation_cache is not None:
+                generation_cache.put_many(new_cache_entries)
+
+    batcher = None
+    if continuous_batching:
+        eos_token_id = generate_kwargs.get("eos_token_id", model.generation_config.eos_token_id)
+        pad_token_id = generate_kwargs.get("pad_token_id", tokenizer.pad_token_id)
+        batcher = ContinuousBatcher(
+            model,
+            max_batch_size=batch_size,
+            max_new_tokens=max_new_tokens,
+            eos_token_ids=[eos_token_id] if isinstance(eos_token_id, int) else eos_token_id,
+            pad_token_id=0 if pad_token_id is None else pad_token_id,
+            tokenizer=tokenizer,
+            throughput_meter=throughput_meter,
+        )
+
+    with backend.autocast(), OrderedWorkers(
+        decode_outputs, write_outputs, num_workers=num_decode_workers, max_pending=2 * num_decode_workers
+    ) as workers:
+        if batcher is not None:
+            # Prompts are admitted in the order they'd be batched in (longest first, with `sort_by_length`), and
+            # finished sequences are decoded and written `batch_size` at a time.
+            results = batcher.generate(
+                all_prompt_input_ids,
+                order=[position for batch in batches for position in batch],
+                all_stop_patterns=compiled_stop_patterns,
+            )
+            finished = []
+            with tqdm(total=len(all_prompt_input_ids)) as progress:
+                while True:
+                    with stage_times.time("generate"):
+                        result = next(results, None)
+                    if result is not None:
+                        finished.append(result)
+                        progress.update()
+                    if finished and (result is None or len(finished) == batch_size):
+                        workers.submit(([position for position, _ in finished], [ids for _, ids in finished]))
+                        finished = []
+                    if result is None:
+                        break
+        else:
+            for batch, inputs in tqdm(prefetch(prepare_inputs, batches), total=len(batches)):
+                with stage_times.time("generate"):
+                    prompt_length = inputs["input_ids"].shape[1]
+                    if has_stop_patterns:
+                        stop_criteria = StopPatternCriteria(
+                            [compiled_stop_patterns[position] for position in batch], tokenizer, prompt_length
+                        )
+                        outputs = throughput_meter.generate(
+                            model, inputs, stopping_criteria=StoppingCriteriaList([stop_criteria]), **generate_kwargs
+                        )
+                        stop_report.add(stop_criteria, outputs.shape[1] - prompt_length)
+                    else:
+                        outputs = throughput_meter.generate(model, inputs, **generate_kwargs)
+                    # Only the generated tokens are decoded, rather than decoding the prompt to find where they start.
+                    new_token_ids = outputs[:, prompt_length:].cpu()
+                workers.submit((batch, new_token_ids))
+
+    logger.info(throughput_meter.format_report())
+    if batcher is not None:
+        logger.info(batcher.format_report())
+    elif has_stop_patterns:
+        logger.info(stop_report.format_report())
+    logger.info(stage_times.format_report())
+    if generation_cache is not None:
+        logger.info(generation_cache.format_stats())
+    finalize()
@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+"""Persistent cache of generated responses, so reruns of the same prompts don't generate them again.
+
+Responses are keyed by a hash of everything that determines them: the model (and its revision and
+precision), the exact prompt text, and the decoding parameters. Closed-book and oracle baselines,
+reruns of a setting, and repeated questions within a data file then only generate each response once.
+The cache is bounded in size: once it holds more than `max_entries` responses, the least recently used
+ones are evicted.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, Optional
+
+# SQLite limits the number of parameters per statement (999 in older versions).
+_MAX_QUERY_PARAMETERS = 900
+
+
+def get_generation_key(model_settings: Dict, prompt: str, decoding_settings: Dict) -> str:
+    """Hash of what determines a (greedy) response: the model, the prompt, and the decoding parameters."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(json.dumps(model_settings, sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(json.dumps(decoding_settings, sort_keys=True).encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(prompt.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class GenerationCache:
+    """SQLite-backed mapping from generation key to response, with least-recently-used eviction.
+
+    Safe to use from several threads (e.g., a lookup on the main thread and writes from a writer thread).
+    """
+
+    def __init__(self, path, max_entries: Optional[int] = None):
+        if max_entries is not None and max_entries < 1:
+            raise ValueError(f"`max_entries` must be at least 1, got {max_entries}")
+        self.path = path
+        self.max_entries = max_entries
+        self.num_hits = 0
+        self.num_misses = 0
+        self.num_evictions = 0
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        with self._connection:
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS generations "
+                "(key TEXT PRIMARY KEY, response TEXT NOT NULL, last_used INTEGER NOT NULL) WITHOUT ROWID"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS generations_last_used ON generations (last_used)")
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, str]:
+        """Map each of the given keys that is cached to its response, marking them as recently used."""
+        unique_keys = list(dict.fromkeys(keys))
+        responses = {}
+        with self._lock:
+            for start in range(0, len(unique_keys), _MAX_QUERY_PARAMETERS):
+                chunk = unique_keys[start : start + _MAX_QUERY_PARAMETERS]
+                rows = self._connection.execute(
+                    f"SELECT key, response FROM generations WHERE key IN ({', '.join('?' * len(chunk))})", chunk
+                )
+                responses.update(rows)
+            if responses:
+                now = time.time_ns()
+                with self._connection:
+                    self._connection.executemany(
+                        "UPDATE generations SET last_used = ? WHERE key = ?", [(now, key) for key in responses]
+                    )
+            self.num_hits += len(responses)
+            self.num_misses += len(unique_keys) - len(responses)
+        return responses
+
+    def put_many(self, responses: Dict[str, str]):
+        """Add (or replace) responses, evicting the least recently used ones beyond `max_entries`."""
+        if not responses:
+            return
+        now = time.time_ns()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO generations (key, response, last_used) VALUES (?, ?, ?)",
+                [(key, response, now) for key, response in responses.items()],
+            )
+            if self.max_entries is not None:
+                (num_entries,) = self._connection.execute("SELECT COUNT(*) FROM generations").fetchone()
+                if num_entries > self.max_entries:
+                    self._connection.execute(
+                        "DELETE FROM generations WHERE key IN "
+                        "(SELECT key FROM generations ORDER BY last_used LIMIT ?)",
+                        (num_entries - self.max_entries,),
+                    )
+                    self.num_evictions += num_entries - self.max_entries
+
+    def __len__(self) -> int:
+        with self._lock:
+            (num_entries,) = self._connection.execute("SELECT COUNT(*) FROM generations").fetchone()
+        return num_entries
+
+    def format_stats(self) -> str:
+        num_lookups = self.num_hits + self.num_misses
+        hit_rate = self.num_hits / num_lookups if num_lookups else 0.0
+        return (
+            f"Generation cache {self.path}: {self.num_hits} hits, {self.num_misses} misses ({hit_rate:.1%} hit rate), "
+            f"{self.num_evictions} evictions, {len(self)} cached responses"
+        )
+
+    def close(self):
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
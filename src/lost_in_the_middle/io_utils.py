@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+import hashlib
+import json
+import logging
+import os
+import queue
+import threading
+from collections import Counter
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from xopen import xopen
+
+logger = logging.getLogger(__name__)
+
+_CLOSE = object()
+
+
+class BackgroundWriter:
+    """Write lines to a (possibly compressed) file from a background thread.
+
+    Compression happens on the writer thread, so the caller can keep parsing and building
+    output while previous lines are being written. The queue is bounded to keep memory flat.
+    """
+
+    def __init__(self, path, max_queue_size: int = 1024):
+        self.path = path
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._error = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name=f"BackgroundWriter({path})", daemon=True)
+        self._thread.start()
+
+    def write(self, line: str):
+        if self._closed:
+            raise ValueError(f"Cannot write to closed BackgroundWriter for {self.path}")
+        if self._error is not None:
+            raise self._error
+        self._queue.put(line)
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        self._queue.put(_CLOSE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _run(self):
+        try:
+            with xopen(self.path, "w") as fout:
+                while True:
+                    line = self._queue.get()
+                    if line is _CLOSE:
+                        return
+                    fout.write(line)
+        except BaseException as e:
+            self._error = e
+            # Keep draining, so that producers blocked on a full queue are released.
+            while self._queue.get() is not _CLOSE:
+                pass
+
+
+def get_example_keys(examples: Iterable[dict]) -> List[str]:
+    """Stable keys for input examples: a hash of their content, plus an occurrence number for repeated examples.
+
+    Keys don't depend on the position of examples in the input file, nor on the order they're processed in.
+    """
+    keys = []
+    num_occurrences = Counter()
+    for example in examples:
+        digest = hashlib.blake2b(json.dumps(example, sort_keys=True).encode("utf-8"), digest_size=16).hexdigest()
+        keys.append(f"{digest}-{num_occurrences[digest]}")
+        num_occurrences[digest] += 1
+    return keys
+
+
+class CheckpointedOutput:
+    """Output records of a long run, appended (and flushed to disk) batch by batch so that the run can be resumed.
+
+    Records are appended to `{output_path}.partial`, an uncompressed JSON lines file, with the key of their
+    example (see `get_example_keys`). Its first line holds `metadata`, the settings of the run, which must
+    match when resuming. With `resume`, records already in the partial file are kept (dropping a last line
+    cut short by a crash), and `key in checkpoint` tells which examples to skip.
+
+    `finalize` writes the records, in the order of the given keys, to `output_path` (compressed according
+    to its extension) through a temporary file that atomically replaces it, so readers never see a
+    half-written file. The partial file is then removed.
+    """
+
+    def __init__(self, output_path, resume: bool = False, metadata: Optional[Dict] = None):
+        self.output_path = str(output_path)
+        self.partial_path = f"{self.output_path}.partial"
+        self.metadata = metadata or {}
+        # Byte offset of the record of each example key in the partial file.
+        self._offsets = {}
+        if os.path.exists(self.partial_path):
+            if not resume:
+                raise ValueError(
+                    f"Found partial output {self.partial_path} of an earlier run, resume it or delete it first"
+                )
+            size = self._load()
+        else:
+            size = 0
+        self._file = open(self.partial_path, "ab")
+        self._size = size
+        if size == 0:
+            self._write_line({"metadata": self.metadata})
+            self._sync()
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._offsets
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def write_batch(self, keys: Sequence[str], records: Sequence[dict]):
+        if len(keys) != len(records):
+            raise ValueError(f"Got {len(records)} records for {len(keys)} keys")
+        for key, record in zip(keys, records):
+            self._offsets[key] = self._size
+            self._write_line({"example_key": key, "record": record})
+        self._sync()
+
+    def finalize(self, keys: Sequence[str]):
+        """Write the records of `keys`, in order, to `output_path`, and remove the partial file."""
+        num_missing = sum(1 for key in keys if key not in self._offsets)
+        if num_missing:
+            raise ValueError(
+                f"Cannot finalize {self.output_path}: {num_missing} of {len(keys)} examples have no record"
+            )
+        self.close()
+        # Keep the extension, which xopen picks the compression from.
+        directory, name = os.path.split(self.output_path)
+        temporary_path = os.path.join(directory, f".tmp.{name}")
+        with open(self.partial_path, "rb") as fin, xopen(temporary_path, "w") as fout:
+            for key in keys:
+                fin.seek(self._offsets[key])
+                fout.write(json.dumps(json.loads(fin.readline())["record"]) + "\n")
+        with open(temporary_path, "rb") as f:
+            os.fsync(f.fileno())
+        os.replace(temporary_path, self.output_path)
+        os.remove(self.partial_path)
+
+    def close(self):
+        """Close the partial file, keeping it to resume from."""
+        if not self._file.closed:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _load(self) -> int:
+        """Read the example keys of the records in the partial file, returning the size of its complete lines."""
+        offset = 0
+        with open(self.partial_path, "rb") as fin:
+            for line in fin:
+                try:
+                    # A line without a newline was cut short by a crash while writing it.
+                    entry = json.loads(line) if line.endswith(b"\n") else None
+                except ValueError:
+                    entry = None
+                if entry is None:
+                    break
+                if offset == 0:
+                    if entry.get("metadata") != json.loads(json.dumps(self.metadata)):
+                        raise ValueError(
+                            f"Cannot resume {self.partial_path}: it was written with {entry.get('metadata')}, "
+                            f"not {self.metadata}"
+                        )
+                else:
+                    self._offsets[entry["example_key"]] = offset
+                offset += len(line)
+        size = os.path.getsize(self.partial_path)
+        if offset < size:
+            logger.warning(f"Dropping {size - offset} bytes of an incomplete record at the end of {self.partial_path}")
+            os.truncate(self.partial_path, offset)
+        logger.info(f"Resuming {self.partial_path}, which has records for {len(self._offsets)} examples")
+        return offset
+
+    def _write_line(self, entry: dict):
+        line = (json.dumps(entry) + "\n").encode("utf-8")
+        self._file.write(line)
+        self._size += len(line)
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
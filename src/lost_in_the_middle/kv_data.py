@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""Key-value retrieval data: random UUID keys and values, drawn from a seeded generator.
+
+Examples are generated in chunks of `EXAMPLES_PER_CHUNK`, each from its own generator seeded with
+`(seed, chunk_index)`, so the data only depends on the seed and the number of keys and examples, not on
+how many processes generate it. The random bytes of a whole chunk are drawn at once, and formatted as
+(version 4, like `uuid.uuid4`) UUIDs in bulk.
+
+Besides JSON lines, examples can be stored as fixed-width records in a `.npy` file: the 16 bytes of each
+key and value, and the index of the gold record. It's about 2.5 times smaller than the (uncompressed)
+JSON lines, and `KVRecordFile` memory-maps it, formatting only the examples that are read.
+"""
+import json
+from typing import Dict, Iterator, List
+
+import numpy as np
+from xopen import xopen
+
+EXAMPLES_PER_CHUNK = 64
+UUID_NUM_BYTES = 16
+# Positions of the hex digits in a formatted UUID (xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx).
+_HEX_DIGIT_POSITIONS = np.array([position for position in range(36) if position not in (8, 13, 18, 23)])
+
+
+def get_kv_record_dtype(num_keys: int) -> np.dtype:
+    """A KV retrieval example: the bytes of each (key, value) record, and the index of the record to retrieve."""
+    return np.dtype([("records", np.uint8, (num_keys, 2, UUID_NUM_BYTES)), ("gold_index", np.int32)])
+
+
+def generate_kv_chunk(seed: int, chunk_index: int, num_examples: int, num_keys: int) -> np.ndarray:
+    """Examples of chunk `chunk_index` (a structured array with `get_kv_record_dtype(num_keys)`).
+
+    Keys aren't checked for duplicates: with 122 random bits per key, they have a probability of about
+    2^-100 (and prompt building rejects them).
+    """
+    if num_keys < 2:
+        raise ValueError(f"`num_keys` must be at least 2, got {num_keys}")
+    rng = np.random.default_rng([seed, chunk_index])
+    random_bytes = rng.bytes(num_examples * num_keys * 2 * UUID_NUM_BYTES)
+    records = np.frombuffer(random_bytes, dtype=np.uint8).reshape(num_examples, num_keys, 2, UUID_NUM_BYTES).copy()
+    # Set the version (4) and variant bits, as `uuid.uuid4` does.
+    records[..., 6] = (records[..., 6] & 0x0F) | 0x40
+    records[..., 8] = (records[..., 8] & 0x3F) | 0x80
+    chunk = np.empty(num_examples, dtype=get_kv_record_dtype(num_keys))
+    chunk["records"] = records
+    chunk["gold_index"] = rng.integers(num_keys, size=num_examples)
+    return chunk
+
+
+def format_uuids(uuid_bytes: np.ndarray) -> np.ndarray:
+    """Format an array of shape (..., 16) of UUID bytes as an array of shape (...) of UUID strings."""
+    shape = uuid_bytes.shape[:-1]
+    hex_digits = np.frombuffer(np.ascontiguousarray(uuid_bytes).tobytes().hex().encode("ascii"), dtype=np.uint8)
+    formatted = np.full((hex_digits.size // (2 * UUID_NUM_BYTES), 36), ord("-"), dtype=np.uint8)
+    formatted[:, _HEX_DIGIT_POSITIONS] = hex_digits.reshape(-1, 2 * UUID_NUM_BYTES)
+    return formatted.view("S36").reshape(shape).astype(str)
+
+
+def get_kv_examples(chunk: np.ndarray) -> List[Dict]:
+    """The examples of a chunk of records, as written to (and read from) JSON lines data files."""
+    examples = []
+    for ordered_kv_records, gold_index in zip(format_uuids(chunk["records"]).tolist(), chunk["gold_index"].tolist()):
+        key, value = ordered_kv_records[gold_index]
+        examples.append({"ordered_kv_records": ordered_kv_records, "key": key, "value": value})
+    return examples
+
+
+def write_kv_jsonl(path, chunk: np.ndarray):
+    with xopen(path, "w") as fout:
+        for example in get_kv_examples(chunk):
+            fout.write(json.dumps(example) + "\n")
+
+
+def is_kv_record_file(path) -> bool:
+    return str(path).endswith(".npy")
+
+
+def create_kv_record_file(path, num_examples: int, num_keys: int):
+    """Create a `.npy` file for `num_examples` records, to be filled in with `write_kv_record_chunk`."""
+    records = np.lib.format.open_memmap(path, mode="w+", dtype=get_kv_record_dtype(num_keys), shape=(num_examples,))
+    records.flush()
+    del records
+
+
+def write_kv_record_chunk(path, start: int, chunk: np.ndarray):
+    records = np.load(path, mmap_mode="r+")
+    records[start : start + len(chunk)] = chunk
+    records.flush()
+    del records
+
+
+class KVRecordFile:
+    """Memory-mapped KV retrieval examples in a `.npy` file (see `create_kv_record_file`)."""
+
+    def __init__(self, path):
+        self.path = path
+        self.records = np.load(path, mmap_mode="r")
+        if self.records.dtype.names != ("records", "gold_index"):
+            raise ValueError(f"{path} doesn't hold KV retrieval records, its dtype is {self.records.dtype}")
+
+    @property
+    def num_keys(self) -> int:
+        return self.records.dtype["records"].shape[0]
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, index: int) -> Dict:
+        return get_kv_examples(self.records[index : index + 1])[0]
+
+    def iter_examples(self, shard_index: int = 0, num_shards: int = 1) -> Iterator[Dict]:
+        """The examples on rows `shard_index`, `shard_index + num_shards`, ..., formatted chunk by chunk."""
+        records = self.records[shard_index::num_shards]
+        for start in range(0, len(records), EXAMPLES_PER_CHUNK):
+            yield from get_kv_examples(records[start : start + EXAMPLES_PER_CHUNK])
+
+
+def iter_kv_examples(input_path, shard_index: int = 0, num_shards: int = 1) -> Iterator[Dict]:
+    """The KV retrieval examples of a JSON lines or `.npy` data file (on the lines of the given shard)."""
+    if is_kv_record_file(input_path):
+        yield from KVRecordFile(input_path).iter_examples(shard_index, num_shards)
+        return
+    with xopen(input_path) as fin:
+        for line_index, line in enumerate(fin):
+            if line_index % num_shards == shard_index:
+                yield json.loads(line)
@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
 import string
-from typing import List
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Sequence
 
 import regex
 
+try:
+    import ahocorasick
+except ImportError:
+    ahocorasick = None
+
+_ARTICLES_REGEX = regex.compile(r"\b(a|an|the)\b")
+_PUNCTUATION_TRANSLATION_TABLE = str.maketrans("", "", string.punctuation)
+
 
 def normalize_answer(s: str) -> str:
     """Normalization from the SQuAD evaluation script.
@@ -12,14 +23,13 @@ def normalize_answer(s: str) -> str:
     """
 
     def remove_articles(text):
-        return regex.sub(r"\b(a|an|the)\b", " ", text)
+        return _ARTICLES_REGEX.sub(" ", text)
 
     def white_space_fix(text):
         return " ".join(text.split())
 
     def remove_punc(text):
-        exclude = set(string.punctuation)
-        return "".join(ch for ch in text if ch not in exclude)
+        return text.translate(_PUNCTUATION_TRANSLATION_TABLE)
 
     def lower(text):
         return text.lower()
@@ -27,11 +37,190 @@ def normalize_answer(s: str) -> str:
     return white_space_fix(remove_articles(remove_punc(lower(s))))
 
 
+@lru_cache(maxsize=2**16)
+def _normalize_ground_truth(ground_truth: str) -> str:
+    # Gold answers repeat across examples, groupings and gold positions, so they're only normalized once.
+    return normalize_answer(ground_truth).lower()
+
+
 def best_subspan_em(prediction: str, ground_truths: List[str]) -> float:
-    normalized_prediction = normalize_answer(prediction)
+    normalized_prediction = normalize_answer(prediction).lower()
 
     for ground_truth in ground_truths:
-        normalized_ground_truth = normalize_answer(ground_truth)
-        if normalized_ground_truth.lower() in normalized_prediction.lower():
+        if _normalize_ground_truth(ground_truth) in normalized_prediction:
             return 1.0
     return 0.0
+
+
+def best_subspan_em_batch(
+    predictions: Sequence[str],
+    ground_truths: Sequence[List[str]],
+    num_workers: int = 1,
+    chunk_size: int = 4096,
+) -> List[float]:
+    """Score a batch of predictions; the i-th prediction is scored against `ground_truths[i]`.
+
+    Results are identical to calling `best_subspan_em` on each prediction. With `num_workers > 1`,
+    chunks of `chunk_size` predictions are scored in a process pool.
+    """
+    if len(predictions) != len(ground_truths):
+        raise ValueError(
+            f"Got {len(predictions)} predictions but {len(ground_truths)} lists of ground truths, expected the same"
+        )
+    if num_workers < 1:
+        raise ValueError(f"`num_workers` must be at least 1, got {num_workers}")
+
+    if num_workers == 1 or len(predictions) <= chunk_size:
+        return _best_subspan_em_chunk((predictions, ground_truths))
+
+    chunks = [
+        (predictions[start : start + chunk_size], ground_truths[start : start + chunk_size])
+        for start in range(0, len(predictions), chunk_size)
+    ]
+    scores = []
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for chunk_scores in executor.map(_best_subspan_em_chunk, chunks):
+            scores.extend(chunk_scores)
+    return scores
+
+
+def _best_subspan_em_chunk(chunk) -> List[float]:
+    predictions, ground_truths = chunk
+    return [
+        best_subspan_em(prediction, example_ground_truths)
+        for prediction, example_ground_truths in zip(predictions, ground_truths)
+    ]
+
+
+class AnswerMatcher:
+    """Aho–Corasick automaton over normalized gold answers, for subspan exact match in a single pass.
+
+    Answers can be added under a key (e.g., the index of their example), so that one automaton
+    serves a whole dataset; `match(..., key=k)` then only reports answers added under `k`.
+    Matching is equivalent to `best_subspan_em`, including empty normalized answers matching anything.
+
+    Uses the C implementation from `pyahocorasick` if it's installed, and a pure-Python automaton
+    otherwise (which is only faster than the per-answer loop for very large alias lists).
+    """
+
+    def __init__(self, use_pyahocorasick: Optional[bool] = None):
+        if use_pyahocorasick is None:
+            use_pyahocorasick = ahocorasick is not None
+        if use_pyahocorasick and ahocorasick is None:
+            raise ValueError("`pyahocorasick` is not installed")
+        self.use_pyahocorasick = use_pyahocorasick
+        self._keys_by_answer = {}
+        self._empty_answer_keys = set()
+        self._automaton = None
+        # Pure-Python automaton: per-state transitions, failure links, answer keys ending at the state,
+        # and the next state along the failure chain with answer keys (or -1 if there is none).
+        self._transitions = [{}]
+        self._failure_links = [0]
+        self._outputs = [set()]
+        self._output_links = [-1]
+        self._built = False
+
+    @classmethod
+    def from_answers(cls, answers: List[str], **kwargs) -> "AnswerMatcher":
+        matcher = cls(**kwargs)
+        for answer in answers:
+            matcher.add(answer)
+        matcher.build()
+        return matcher
+
+    @classmethod
+    def from_ground_truths(cls, ground_truths: Sequence[List[str]], **kwargs) -> "AnswerMatcher":
+        """Build one automaton for a dataset, keying the answers of `ground_truths[i]` by `i`."""
+        matcher = cls(**kwargs)
+        for key, answers in enumerate(ground_truths):
+            for answer in answers:
+                matcher.add(answer, key=key)
+        matcher.build()
+        return matcher
+
+    def add(self, answer: str, key=None):
+        if self._built:
+            raise ValueError("Cannot add answers to an AnswerMatcher after it has been built")
+        normalized_answer = _normalize_ground_truth(answer)
+        if not normalized_answer:
+            self._empty_answer_keys.add(key)
+        else:
+            self._keys_by_answer.setdefault(normalized_answer, set()).add(key)
+
+    def build(self):
+        if self._built:
+            raise ValueError("AnswerMatcher has already been built")
+        if self.use_pyahocorasick:
+            self._automaton = ahocorasick.Automaton()
+            for normalized_answer, keys in self._keys_by_answer.items():
+                self._automaton.add_word(normalized_answer, keys)
+            if self._keys_by_answer:
+                self._automaton.make_automaton()
+        else:
+            self._build_automaton()
+        self._built = True
+
+    def _build_automaton(self):
+        transitions = self._transitions
+        for normalized_answer, keys in self._keys_by_answer.items():
+            state = 0
+            for character in normalized_answer:
+                next_state = transitions[state].get(character)
+                if next_state is None:
+                    next_state = len(transitions)
+                    transitions.append({})
+                    self._failure_links.append(0)
+                    self._outputs.append(set())
+                    self._output_links.append(-1)
+                    transitions[state][character] = next_state
+                state = next_state
+            self._outputs[state].update(keys)
+
+        # Breadth-first, so that failure links always point at already-processed (shallower) states.
+        queue = deque(transitions[0].values())
+        while queue:
+            state = queue.popleft()
+            for character, next_state in transitions[state].items():
+                failure_state = self._failure_links[state]
+                while failure_state and character not in transitions[failure_state]:
+                    failure_state = self._failure_links[failure_state]
+                failure_state = transitions[failure_state].get(character, 0)
+                self._failure_links[next_state] = failure_state
+                self._output_links[next_state] = (
+                    failure_state if self._outputs[failure_state] else self._output_links[failure_state]
+                )
+                queue.append(next_state)
+
+    def match(self, normalized_prediction: str, key=None) -> bool:
+        """Whether any answer (under `key`, if given) occurs in the already-normalized prediction."""
+        if not self._built:
+            raise ValueError("AnswerMatcher must be built before matching")
+        if self._empty_answer_keys and (key is None or key in self._empty_answer_keys):
+            return True
+        if not self._keys_by_answer:
+            return False
+
+        if self.use_pyahocorasick:
+            for _, keys in self._automaton.iter(normalized_prediction):
+                if key is None or key in keys:
+                    return True
+            return False
+
+        transitions = self._transitions
+        failure_links = self._failure_links
+        outputs = self._outputs
+        output_links = self._output_links
+        state = 0
+        for character in normalized_prediction:
+            while state and character not in transitions[state]:
+                state = failure_links[state]
+            state = transitions[state].get(character, 0)
+            output_state = state if outputs[state] else output_links[state]
+            while output_state != -1:
+                if key is None or key in outputs[output_state]:
+                    return True
+                output_state = output_links[output_state]
+        return False
+
+    def best_subspan_em(self, prediction: str, key=None) -> float:
+        return 1.0 if self.match(normalize_answer(prediction).lower(), key=key) else 0.0
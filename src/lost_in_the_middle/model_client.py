@@ -0,0 +1,21 @@
+#!/usr/bin/env python3
+"""Send requests to a model server (see `model_server`).
+
+This module doesn't import torch or the engine, so that clients start quickly.
+"""
+import json
+import socket
+from typing import Dict
+
+
+def send_request(socket_path, request: Dict) -> Dict:
+    """Send a request to the server listening on `socket_path`, and wait for its reply."""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(str(socket_path))
+        with client.makefile("rwb") as stream:
+            stream.write((json.dumps(request) + "\n").encode("utf-8"))
+            stream.flush()
+            reply = stream.readline()
+    if not reply:
+        raise ValueError(f"The server on {socket_path} closed the connection without replying")
+    return json.loads(reply)
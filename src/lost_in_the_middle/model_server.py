@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""Keep a model loaded in a long-lived process, and run generation jobs sent to it over a Unix domain socket.
+
+Each run of the response scripts imports torch and loads the model before generating a single token. A
+`ModelServer` loads the model once (see `ResidentBackend`), and runs the jobs it receives one after the
+other with `generate_all_responses`, so each job only pays for its own prompts. Jobs sent while another
+one runs wait in a queue, in the order they arrived.
+
+The protocol is one JSON request per connection, answered with one JSON reply (see
+`model_client.send_request`):
+
+- `{"type": "responses", "task": ..., "input_path": ..., "output_path": ..., "gold_indices": [...],
+  "task_options": {...}, "generation_kwargs": {...}}` answers a data file, like `scripts/get_responses.py`
+  (`task_options` are the arguments of `get_task_kwargs`; paths are read by the server, so they should be
+  absolute);
+- `{"type": "prompts", "prompts": [...], "generation_kwargs": {...}}` answers a list of prompts, and
+  replies with their responses;
+- `{"type": "status"}` replies with the model, and the number of queued and finished jobs;
+- `{"type": "shutdown"}` stops accepting jobs, and stops the server once the queued jobs are done.
+
+Replies have `"status": "ok"` (with the seconds a job waited in the queue and ran), or `"status": "error"`
+and the error message. A failing job doesn't stop the server.
+"""
+import json
+import logging
+import os
+import queue
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from typing import Dict, Optional
+
+from xopen import xopen
+
+from lost_in_the_middle.engine import (
+    GenerationJob,
+    PromptTask,
+    generate_all_responses,
+    get_generation_jobs,
+    get_task_kwargs,
+)
+from lost_in_the_middle.generation_cache import GenerationCache
+
+logger = logging.getLogger(__name__)
+
+# Keyword arguments of `generate_all_responses` that jobs can set (the others are set by the server).
+GENERATION_KWARGS = (
+    "temperature",
+    "top_p",
+    "batch_size",
+    "max_new_tokens",
+    "max_batch_tokens",
+    "sort_by_length",
+    "reuse_prefix_cache",
+    "resume",
+    "num_decode_workers",
+    "stop_patterns",
+    "continuous_batching",
+)
+# How long a connection can take to send its request.
+REQUEST_TIMEOUT_SECONDS = 60.0
+
+
+class ResidentBackend:
+    """A backend whose model and tokenizer are loaded on the first `load`, and reused by every later one."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self._model_and_tokenizer = None
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.backend, name)
+
+    def load(self):
+        with self._lock:
+            if self._model_and_tokenizer is None:
+                self._model_and_tokenizer = self.backend.load()
+            return self._model_and_tokenizer
+
+
+class _QueuedJob:
+    def __init__(self, request: Dict):
+        self.request = request
+        self.queued_at = time.perf_counter()
+        self.reply: Optional[Dict] = None
+        self.done = threading.Event()
+
+
+class ModelServer:
+    """Run the generation jobs sent to `socket_path` with `backend`, whose model is loaded once.
+
+    `serve_forever` accepts connections until `request_shutdown` (or a `shutdown` request), then lets the
+    queued jobs finish. With a `generation_cache`, every job reads and adds to it.
+    """
+
+    def __init__(self, backend, socket_path, generation_cache: Optional[GenerationCache] = None):
+        self.backend = ResidentBackend(backend)
+        self.socket_path = str(socket_path)
+        self.generation_cache = generation_cache
+        self.num_finished_jobs = 0
+        self.num_failed_jobs = 0
+        self._jobs = queue.Queue()
+        self._running_job: Optional[_QueuedJob] = None
+        self._shutting_down = False
+        self._lock = threading.Lock()
+        self._server = None
+        # Set once the server listens on its socket.
+        self.ready = threading.Event()
+
+    def load(self):
+        """Load the model now, rather than on the first job."""
+        start = time.perf_counter()
+        self.backend.load()
+        logger.info(f"Loaded {self.backend.model_name} in {time.perf_counter() - start:.1f} s")
+
+    def serve_forever(self):
+        self._bind()
+        worker = threading.Thread(target=self._run_jobs, name="model-server-jobs")
+        worker.start()
+        logger.info(f"Serving {self.backend.model_name} on {self.socket_path}")
+        self.ready.set()
+        try:
+            self._server.serve_forever()
+        finally:
+            self.request_shutdown()
+            worker.join()
+            # Waits for the connections of the last jobs to get their replies.
+            self._server.server_close()
+            os.unlink(self.socket_path)
+            logger.info(f"Stopped serving, after {self.num_finished_jobs} jobs ({self.num_failed_jobs} failed)")
+
+    def request_shutdown(self):
+        """Stop accepting jobs, and stop the server once the queued jobs are done. Doesn't block."""
+        with self._lock:
+            if self._shutting_down:
+                return
+            self._shutting_down = True
+            self._jobs.put(None)
+        logger.info(f"Shutting down once {self._jobs.qsize() - 1} queued jobs are done")
+
+    def get_status(self) -> Dict:
+        return {
+            "status": "ok",
+            "model": self.backend.model_name,
+            "running": self._running_job is not None,
+            "num_queued_jobs": self._jobs.qsize() - int(self._shutting_down),
+            "num_finished_jobs": self.num_finished_jobs,
+            "num_failed_jobs": self.num_failed_jobs,
+            "shutting_down": self._shutting_down,
+        }
+
+    def handle_request(self, request: Dict) -> Dict:
+        """Reply to a request, waiting for its job to run if it's a generation job."""
+        request_type = request.get("type")
+        if request_type == "status":
+            return self.get_status()
+        if request_type == "shutdown":
+            self.request_shutdown()
+            return {"status": "ok"}
+        if request_type not in ("responses", "prompts"):
+            return {"status": "error", "error": f"Unknown request type {request_type}"}
+        job = _QueuedJob(request)
+        with self._lock:
+            if self._shutting_down:
+                return {"status": "error", "error": "The server is shutting down, and doesn't accept new jobs"}
+            self._jobs.put(job)
+        job.done.wait()
+        return job.reply
+
+    def _bind(self):
+        if os.path.exists(self.socket_path):
+            # A socket file left by a server that didn't stop cleanly can be replaced, but not a live one.
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+                try:
+                    client.connect(self.socket_path)
+                except (ConnectionRefusedError, FileNotFoundError):
+                    os.unlink(self.socket_path)
+                else:
+                    raise ValueError(f"Another server is already listening on {self.socket_path}")
+        server = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            timeout = REQUEST_TIMEOUT_SECONDS
+
+            def handle(self):
+                try:
+                    request = json.loads(self.rfile.readline())
+                    if not isinstance(request, dict):
+                        raise ValueError("expected a JSON object")
+                except (ValueError, OSError) as e:
+                    reply = {"status": "error", "error": f"Invalid request: {e}"}
+                else:
+                    reply = server.handle_request(request)
+                self.wfile.write((json.dumps(reply) + "\n").encode("utf-8"))
+
+        self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+
+    def _run_jobs(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            self._running_job = job
+            queue_seconds = time.perf_counter() - job.queued_at
+            logger.info(f"Running a {job.request['type']} job, after {queue_seconds:.1f} s in the queue")
+            start = time.perf_counter()
+            try:
+                reply = {"status": "ok", **self._run_job(job.request)}
+                self.num_finished_jobs += 1
+            except Exception as e:
+                logger.exception("Job failed")
+                reply = {"status": "error", "error": f"{type(e).__name__}: {e}"}
+                self.num_failed_jobs += 1
+            reply.update(queue_seconds=queue_seconds, run_seconds=time.perf_counter() - start)
+            self._running_job = None
+            job.reply = reply
+            job.done.set()
+        if self._server is not None:
+            self._server.shutdown()
+
+    def _run_job(self, request: Dict) -> Dict:
+        generation_kwargs = request.get("generation_kwargs", {})
+        unknown_kwargs = set(generation_kwargs) - set(GENERATION_KWARGS)
+        if unknown_kwargs:
+            raise ValueError(f"Jobs can't set {', '.join(sorted(unknown_kwargs))}")
+        if request["type"] == "responses":
+            jobs = get_generation_jobs(
+                request["task"],
+                request["input_path"],
+                request["output_path"],
+                request.get("gold_indices"),
+                **get_task_kwargs(request["task"], **request.get("task_options", {})),
+            )
+            self._generate(jobs, generation_kwargs)
+            return {"output_paths": [str(job.output_path) for job in jobs]}
+        with tempfile.TemporaryDirectory() as directory:
+            input_path = os.path.join(directory, "prompts.jsonl")
+            output_path = os.path.join(directory, "responses.jsonl")
+            with xopen(input_path, "w") as fout:
+                for prompt in request["prompts"]:
+                    fout.write(json.dumps({"prompt": prompt}) + "\n")
+            self._generate([GenerationJob(PromptTask(), input_path, output_path)], generation_kwargs)
+            with xopen(output_path) as fin:
+                return {"responses": [json.loads(line)["model_answer"] for line in fin]}
+
+    def _generate(self, jobs, generation_kwargs):
+        generate_all_responses(jobs, self.backend, generation_cache=self.generation_cache, **generation_kwargs)
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+"""Content-addressed store of passages, so data files can reference passages by id.
+
+The same Wikipedia passages appear in every gold-position variant and document-count setting, so
+data builders can write each passage once to a `PassageStore` and replace the `title` and `text` of
+each context with a `passage_id`. `DocumentBatch.from_dicts(..., passage_store=store)` resolves them
+again when building prompts.
+"""
+import hashlib
+import pathlib
+import sqlite3
+from typing import Dict, Iterable, List, Tuple
+
+# SQLite limits the number of parameters per statement (999 in older versions).
+_MAX_QUERY_PARAMETERS = 900
+
+
+def get_passage_id(title: str, text: str) -> str:
+    """Content address of a passage. Passages with the same title and text share an id."""
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(title.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(text.encode("utf-8"))
+    return digest.hexdigest()
+
+
+class PassageStore:
+    """SQLite-backed mapping from passage id to (title, text)."""
+
+    def __init__(self, path, readonly: bool = False):
+        self.path = path
+        self.readonly = readonly
+        if readonly:
+            if not pathlib.Path(path).exists():
+                raise ValueError(f"Passage store {path} does not exist")
+            self._connection = sqlite3.connect(f"{pathlib.Path(path).resolve().as_uri()}?mode=ro", uri=True)
+        else:
+            self._connection = sqlite3.connect(path)
+            # Data builds are re-runnable, so trade durability for write speed.
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=OFF")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS passages (id TEXT PRIMARY KEY, title TEXT NOT NULL, text TEXT NOT NULL) "
+                "WITHOUT ROWID"
+            )
+        self._pending = {}
+
+    def add(self, title: str, text: str) -> str:
+        """Add a passage (if it isn't already stored) and return its id."""
+        if self.readonly:
+            raise ValueError(f"Cannot add passages to read-only passage store {self.path}")
+        passage_id = get_passage_id(title, text)
+        self._pending[passage_id] = (title, text)
+        if len(self._pending) >= 10000:
+            self.flush()
+        return passage_id
+
+    def flush(self):
+        if not self._pending:
+            return
+        with self._connection:
+            self._connection.executemany(
+                "INSERT OR IGNORE INTO passages (id, title, text) VALUES (?, ?, ?)",
+                [(passage_id, title, text) for passage_id, (title, text) in self._pending.items()],
+            )
+        self._pending = {}
+
+    def get(self, passage_id: str) -> Tuple[str, str]:
+        return self.get_many([passage_id])[passage_id]
+
+    def get_many(self, passage_ids: Iterable[str]) -> Dict[str, Tuple[str, str]]:
+        """Map each of the given ids to its (title, text). Raises `KeyError` if any id isn't stored."""
+        unique_passage_ids = list(dict.fromkeys(passage_ids))
+        passages = {
+            passage_id: self._pending[passage_id] for passage_id in unique_passage_ids if passage_id in self._pending
+        }
+        missing_passage_ids = [passage_id for passage_id in unique_passage_ids if passage_id not in passages]
+        for start in range(0, len(missing_passage_ids), _MAX_QUERY_PARAMETERS):
+            chunk = missing_passage_ids[start : start + _MAX_QUERY_PARAMETERS]
+            rows = self._connection.execute(
+                f"SELECT id, title, text FROM passages WHERE id IN ({', '.join('?' * len(chunk))})", chunk
+            )
+            for passage_id, title, text in rows:
+                passages[passage_id] = (title, text)
+        if len(passages) != len(unique_passage_ids):
+            missing = [passage_id for passage_id in unique_passage_ids if passage_id not in passages]
+            raise KeyError(f"Passages {missing} not found in passage store {self.path}")
+        return passages
+
+    def __len__(self) -> int:
+        if not self.readonly:
+            self.flush()
+        (num_passages,) = self._connection.execute("SELECT COUNT(*) FROM passages").fetchone()
+        return num_passages
+
+    def close(self):
+        if not self.readonly:
+            self.flush()
+        self._connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+def store_passages(ctxs: List[dict], passage_store: PassageStore) -> List[dict]:
+    """Add the title and text of each context to the store, and replace them with a `passage_id` reference."""
+    referenced_ctxs = []
+    for ctx in ctxs:
+        passage_id = passage_store.add(ctx["title"], ctx["text"])
+        referenced_ctx = {key: value for key, value in ctx.items() if key not in ("title", "text")}
+        referenced_ctx["passage_id"] = passage_id
+        referenced_ctxs.append(referenced_ctx)
+    return referenced_ctxs
+
+
+def resolve_passages(ctxs: List[dict], passage_store: PassageStore) -> List[dict]:
+    """Inverse of `store_passages`: fill in the title and text of contexts that reference a `passage_id`."""
+    passages = passage_store.get_many(ctx["passage_id"] for ctx in ctxs if "passage_id" in ctx)
+    if not passages:
+        return ctxs
+    resolved_ctxs = []
+    for ctx in ctxs:
+        if "passage_id" not in ctx:
+            resolved_ctxs.append(ctx)
+            continue
+        title, text = passages[ctx["passage_id"]]
+        resolved_ctx = {"title": title, "text": text}
+        resolved_ctx.update((key, value) for key, value in ctx.items() if key != "passage_id")
+        resolved_ctxs.append(resolved_ctx)
+    return resolved_ctxs
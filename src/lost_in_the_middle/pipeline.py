@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""Overlap the stages of batched generation: preparing inputs, generating, and decoding and writing outputs.
+
+`prefetch` prepares the inputs of the next batches on a background thread while the current batch
+generates, and `OrderedWorkers` decodes and writes outputs on worker threads (writes stay in batch
+order). `StageTimes` adds up the time spent in each stage across threads; when stages overlap, their
+sum is more than the wall-clock time of the run.
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, TypeVar
+
+T = TypeVar("T")
+U = TypeVar("U")
+
+_DONE = object()
+
+
+class StageTimes:
+    def __init__(self):
+        self.seconds: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def add(self, stage: str, seconds: float):
+        with self._lock:
+            self.seconds[stage] = self.seconds.get(stage, 0.0) + seconds
+
+    def format_report(self) -> str:
+        wall_seconds = time.perf_counter() - self._start
+        stages = ", ".join(f"{stage} {seconds:.2f} s" for stage, seconds in self.seconds.items())
+        return (
+            f"Stage times: {stages} ({sum(self.seconds.values()):.2f} s in total), "
+            f"in {wall_seconds:.2f} s of wall-clock time"
+        )
+
+
+def prefetch(function: Callable[[T], U], items: Iterable[T], max_prefetch: int = 1) -> Iterator[U]:
+    """Yield `function(item)` for each item, computing up to `max_prefetch` results ahead on a background thread.
+
+    Exceptions raised by `function` are re-raised by the iterator.
+    """
+    results = queue.Queue(maxsize=max_prefetch)
+    stop = threading.Event()
+
+    def run():
+        try:
+            for item in items:
+                if stop.is_set():
+                    return
+                results.put((function(item), None))
+        except BaseException as e:
+            results.put((None, e))
+            return
+        results.put((_DONE, None))
+
+    thread = threading.Thread(target=run, name="prefetch", daemon=True)
+    thread.start()
+    try:
+        while True:
+            result, error = results.get()
+            if error is not None:
+                raise error
+            if result is _DONE:
+                return
+            yield result
+    finally:
+        # Let the thread finish if iteration stopped early, without blocking on a full queue.
+        stop.set()
+        while thread.is_alive():
+            try:
+                results.get(timeout=0.01)
+            except queue.Empty:
+                pass
+
+
+class OrderedWorkers:
+    """Run `process` on a pool of threads and `write` on one thread, in the order items were submitted.
+
+    At most `max_pending` items are in flight: `submit` waits for the oldest one once there are more, and
+    re-raises its exception, if any.
+    """
+
+    def __init__(self, process: Callable[[T], U], write: Callable[[U], None], num_workers: int, max_pending: int):
+        if num_workers < 1:
+            raise ValueError(f"`num_workers` must be at least 1, got {num_workers}")
+        self.process = process
+        self.write = write
+        self.max_pending = max_pending
+        self._process_pool = ThreadPoolExecutor(max_workers=num_workers, thread_name_prefix="process")
+        self._write_pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="write")
+        self._pending = []
+
+    def submit(self, item: T):
+        processed = self._process_pool.submit(self.process, item)
+        self._pending.append(self._write_pool.submit(self._write_when_processed, processed))
+        while len(self._pending) > self.max_pending:
+            self._pending.pop(0).result()
+
+    def _write_when_processed(self, processed: Future):
+        self.write(processed.result())
+
+    def close(self):
+        """Wait for every submitted item to be written, re-raising the first exception, if any."""
+        try:
+            while self._pending:
+                self._pending.pop(0).result()
+        finally:
+            self._process_pool.shutdown(wait=True)
+            self._write_pool.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            # Don't mask the original exception with a later one.
+            self._process_pool.shutdown(wait=True, cancel_futures=True)
+            self._write_pool.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""Reuse the past key/values of a prompt prefix that every prompt shares.
+
+Every QA (or KV retrieval) prompt starts with the same instructions, and chat formatting adds a shared
+system prompt before them. `SharedPrefixCache` prefills the shared prefix once and gives each batch a
+copy of its past key/values, so `model.generate` only prefills the rest of each prompt.
+
+The shared prefix is computed on token ids, so it is exactly a prefix of every tokenized prompt (even if
+the tokenizer merges across the end of the shared text).
+"""
+import copy
+from typing import Dict, Iterable, List, Sequence
+
+import torch
+
+
+def get_shared_prefix(input_ids: Iterable[Sequence[int]]) -> List[int]:
+    """The longest prefix of token ids shared by every prompt, leaving at least one token of each prompt after it.
+
+    Generation needs at least one uncached prompt token to compute the logits of the first new token.
+    """
+    shared_prefix = None
+    min_length = None
+    for prompt_input_ids in input_ids:
+        if shared_prefix is None:
+            shared_prefix = list(prompt_input_ids)
+            min_length = len(prompt_input_ids)
+            continue
+        length = 0
+        max_length = min(len(shared_prefix), len(prompt_input_ids))
+        while length < max_length and shared_prefix[length] == prompt_input_ids[length]:
+            length += 1
+        del shared_prefix[length:]
+        min_length = min(min_length, len(prompt_input_ids))
+    if shared_prefix is None:
+        return []
+    return shared_prefix[: max(0, min_length - 1)]
+
+
+class SharedPrefixCache:
+    """The past key/values of a prefix of token ids, computed once and copied for each batch of prompts."""
+
+    def __init__(self, model, prefix_input_ids: Sequence[int]):
+        if not prefix_input_ids:
+            raise ValueError("Must provide a non-empty prefix to cache")
+        self.prefix_input_ids = list(prefix_input_ids)
+        self.device = model.device
+        with torch.no_grad():
+            outputs = model(input_ids=torch.tensor([self.prefix_input_ids], device=self.device), use_cache=True)
+        self.past_key_values = outputs.past_key_values
+
+    def __len__(self) -> int:
+        return len(self.prefix_input_ids)
+
+    def prepare_inputs(self, batch_input_ids: Sequence[Sequence[int]], pad_token_id: int) -> Dict:
+        """Inputs to `model.generate` for a batch of tokenized prompts, which must all start with the prefix.
+
+        Padding goes between the prefix and the rest of each prompt, so the cached prefix is at the same
+        positions in every row. Padding is masked out (and skipped by position ids), so the outputs are the
+        same as for left-padded prompts.
+        """
+        num_prefix_tokens = len(self.prefix_input_ids)
+        suffixes = []
+        for prompt_input_ids in batch_input_ids:
+            if len(prompt_input_ids) <= num_prefix_tokens or (
+                list(prompt_input_ids[:num_prefix_tokens]) != self.prefix_input_ids
+            ):
+                raise ValueError("Every prompt must start with the cached prefix, followed by at least one token")
+            suffixes.append(list(prompt_input_ids[num_prefix_tokens:]))
+
+        max_suffix_length = max(len(suffix) for suffix in suffixes)
+        input_ids = []
+        attention_mask = []
+        for suffix in suffixes:
+            num_padding_tokens = max_suffix_length - len(suffix)
+            input_ids.append(self.prefix_input_ids + [pad_token_id] * num_padding_tokens + suffix)
+            attention_mask.append([1] * num_prefix_tokens + [0] * num_padding_tokens + [1] * len(suffix))
+
+        # `generate` appends to the cache, so each batch gets its own copy.
+        past_key_values = copy.deepcopy(self.past_key_values)
+        past_key_values.batch_repeat_interleave(len(suffixes))
+        return {
+            "input_ids": torch.tensor(input_ids, device=self.device),
+            "attention_mask": torch.tensor(attention_mask, device=self.device),
+            "past_key_values": past_key_values,
+        }
@@ -1,10 +1,27 @@
 #!/usr/bin/env python3
+import dataclasses
 import pathlib
+import string
+from collections import OrderedDict
 from copy import deepcopy
-from typing import List, Optional, Tuple, Type, TypeVar
+from functools import lru_cache
+from typing import (
+    Callable,
+    Dict,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Type,
+    TypeVar,
+    Union,
+)
 
 from pydantic.dataclasses import dataclass
 
+from lost_in_the_middle.passage_store import PassageStore, resolve_passages
+
 PROMPTS_ROOT = (pathlib.Path(__file__).parent / "prompts").resolve()
 
 T = TypeVar("T")
@@ -33,41 +50,486 @@ class Document:
         return cls(**dict(data, id=id, score=score))
 
 
+class DocumentBatch:
+    """The documents of one example, stored column-wise.
+
+    `from_dicts` skips the copying and pydantic validation of `Document.from_dict`, so it's much cheaper
+    to build for trusted input (e.g., files produced by `make_qa_data_from_retrieval_results.py`). Pass
+    `validate=True` to go through `Document.from_dict` for untrusted input. The prompt functions accept a
+    `DocumentBatch` anywhere they accept a list of `Document`s.
+    """
+
+    __slots__ = ("titles", "texts", "ids", "scores", "hasanswers", "isgolds", "original_retrieval_indices")
+
+    def __init__(
+        self,
+        titles: List[str],
+        texts: List[str],
+        ids: Optional[List[Optional[str]]] = None,
+        scores: Optional[List[Optional[float]]] = None,
+        hasanswers: Optional[List[Optional[bool]]] = None,
+        isgolds: Optional[List[Optional[bool]]] = None,
+        original_retrieval_indices: Optional[List[Optional[int]]] = None,
+    ):
+        num_documents = len(titles)
+        if len(texts) != num_documents:
+            raise ValueError(f"Got {num_documents} titles but {len(texts)} texts, expected the same")
+        self.titles = titles
+        self.texts = texts
+        self.ids = ids if ids is not None else [None] * num_documents
+        self.scores = scores if scores is not None else [None] * num_documents
+        self.hasanswers = hasanswers if hasanswers is not None else [None] * num_documents
+        self.isgolds = isgolds if isgolds is not None else [None] * num_documents
+        self.original_retrieval_indices = (
+            original_retrieval_indices if original_retrieval_indices is not None else [None] * num_documents
+        )
+
+    @classmethod
+    def from_dicts(
+        cls, data: List[dict], validate: bool = False, passage_store: Optional[PassageStore] = None
+    ) -> "DocumentBatch":
+        if passage_store is not None:
+            # Contexts written with a passage store reference their title and text by `passage_id`.
+            data = resolve_passages(data, passage_store)
+        if validate:
+            return cls.from_documents([Document.from_dict(document_data) for document_data in data])
+        return cls(
+            titles=[document_data["title"] for document_data in data],
+            texts=[document_data["text"] for document_data in data],
+            ids=[document_data.get("id") for document_data in data],
+            # Convert scores to float if they're provided, same as `Document.from_dict`.
+            scores=[
+                None if document_data.get("score") is None else float(document_data["score"]) for document_data in data
+            ],
+            hasanswers=[document_data.get("hasanswer") for document_data in data],
+            isgolds=[document_data.get("isgold") for document_data in data],
+            original_retrieval_indices=[document_data.get("original_retrieval_index") for document_data in data],
+        )
+
+    @classmethod
+    def from_documents(cls, documents: List[Document]) -> "DocumentBatch":
+        return cls(
+            titles=[document.title for document in documents],
+            texts=[document.text for document in documents],
+            ids=[document.id for document in documents],
+            scores=[document.score for document in documents],
+            hasanswers=[document.hasanswer for document in documents],
+            isgolds=[document.isgold for document in documents],
+            original_retrieval_indices=[document.original_retrieval_index for document in documents],
+        )
+
+    def __len__(self) -> int:
+        return len(self.titles)
+
+    def __bool__(self) -> bool:
+        return bool(self.titles)
+
+    def take(self, indices: Sequence[int]) -> "DocumentBatch":
+        """A new batch with the documents at `indices`, in that order."""
+        return DocumentBatch(*[[column[index] for index in indices] for column in self._columns()])
+
+    def to_documents(self) -> List[Document]:
+        return [Document(*values) for values in zip(*self._columns())]
+
+    def to_dicts(self) -> List[dict]:
+        """Same as `dataclasses.asdict` on each `Document`."""
+        field_names = [field.name for field in dataclasses.fields(Document)]
+        return [dict(zip(field_names, values)) for values in zip(*self._columns())]
+
+    def _columns(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+
+class PromptTemplate:
+    """A `.prompt` template, pre-split into literal text and replacement fields.
+
+    Rendering joins the literal pieces with the field values, which produces exactly the same
+    string as `str.format` on the original template text.
+    """
+
+    __slots__ = ("template", "_literals", "_fields")
+
+    def __init__(self, template: str):
+        literals = []
+        fields = []
+        pending_literal_text = ""
+        for literal_text, field_name, format_spec, conversion in string.Formatter().parse(template):
+            # Escaped braces split the literal text without a field in between, so accumulate it.
+            pending_literal_text += literal_text
+            if field_name is None:
+                continue
+            if not field_name.isidentifier() or format_spec or conversion:
+                raise ValueError(f"Only plain named replacement fields are supported, got {{{field_name}}}")
+            literals.append(pending_literal_text)
+            fields.append(field_name)
+            pending_literal_text = ""
+        literals.append(pending_literal_text)
+        self.template = template
+        self._literals = tuple(literals)
+        self._fields = tuple(fields)
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return self._fields
+
+    def render(self, **values) -> str:
+        literals = self._literals
+        parts = [literals[0]]
+        for field_name, literal_text in zip(self._fields, literals[1:]):
+            parts.append(format(values[field_name]))
+            parts.append(literal_text)
+        return "".join(parts)
+
+    def render_with_offsets(self, **values) -> Tuple[str, Dict[str, int]]:
+        """Like `render`, but also return the character offset of (the first occurrence of) each field."""
+        literals = self._literals
+        parts = [literals[0]]
+        offsets = {}
+        length = len(literals[0])
+        for field_name, literal_text in zip(self._fields, literals[1:]):
+            value = format(values[field_name])
+            offsets.setdefault(field_name, length)
+            parts.append(value)
+            parts.append(literal_text)
+            length += len(value) + len(literal_text)
+        return "".join(parts), offsets
+
+
+@lru_cache(maxsize=None)
+def get_prompt_template(prompt_filename: str) -> PromptTemplate:
+    """Load and pre-split a template from `PROMPTS_ROOT`. Each file is read at most once per process."""
+    with open(PROMPTS_ROOT / prompt_filename) as f:
+        return PromptTemplate(f.read().rstrip("\n"))
+
+
 def get_qa_prompt(
-    question: str, documents: List[Document], mention_random_ordering: bool, query_aware_contextualization: bool
+    question: str,
+    documents: Union[List[Document], DocumentBatch],
+    mention_random_ordering: bool,
+    query_aware_contextualization: bool,
 ):
-    if not question:
-        raise ValueError(f"Provided `question` must be truthy, got: {question}")
-    if not documents:
-        raise ValueError(f"Provided `documents` must be truthy, got: {documents}")
+    return render_qa_prompts(
+        [question],
+        [documents],
+        mention_random_ordering=mention_random_ordering,
+        query_aware_contextualization=query_aware_contextualization,
+    )[0]
 
+
+def render_qa_prompts(
+    questions: Sequence[str],
+    documents_batches: Sequence[Union[List[Document], DocumentBatch]],
+    mention_random_ordering: bool = False,
+    query_aware_contextualization: bool = False,
+) -> List[str]:
+    """Batched version of `get_qa_prompt`; the i-th prompt uses `questions[i]` and `documents_batches[i]`."""
+    if len(questions) != len(documents_batches):
+        raise ValueError(
+            f"Got {len(questions)} questions but {len(documents_batches)} batches of documents, expected the same"
+        )
+    prompt_template = get_qa_prompt_template(mention_random_ordering, query_aware_contextualization)
+
+    prompts = []
+    for question, documents in zip(questions, documents_batches):
+        if not question:
+            raise ValueError(f"Provided `question` must be truthy, got: {question}")
+        if not documents:
+            raise ValueError(f"Provided `documents` must be truthy, got: {documents}")
+        prompts.append(prompt_template.render(question=question, search_results=format_documents(documents)))
+    return prompts
+
+
+def get_qa_prompt_template(mention_random_ordering: bool, query_aware_contextualization: bool) -> PromptTemplate:
     if mention_random_ordering and query_aware_contextualization:
         raise ValueError("Mentioning random ordering cannot be currently used with query aware contextualization")
 
     if mention_random_ordering:
-        prompt_filename = "qa_ordered_randomly.prompt"
-    elif query_aware_contextualization:
-        prompt_filename = "qa_with_query_aware_contextualization.prompt"
+        return get_prompt_template("qa_ordered_randomly.prompt")
+    if query_aware_contextualization:
+        return get_prompt_template("qa_with_query_aware_contextualization.prompt")
+    return get_prompt_template("qa.prompt")
+
+
+def format_documents(documents: Union[List[Document], DocumentBatch]) -> str:
+    """Format the documents into the search results block of a QA prompt."""
+    if isinstance(documents, DocumentBatch):
+        titles_and_texts = zip(documents.titles, documents.texts)
     else:
-        prompt_filename = "qa.prompt"
+        titles_and_texts = ((document.title, document.text) for document in documents)
+    return "\n".join(
+        [
+            f"Document [{document_index}](Title: {title}) {text}"
+            for document_index, (title, text) in enumerate(titles_and_texts, start=1)
+        ]
+    )
 
-    with open(PROMPTS_ROOT / prompt_filename) as f:
-        prompt_template = f.read().rstrip("\n")
 
-    # Format the documents into strings
-    formatted_documents = []
-    for document_index, document in enumerate(documents):
-        formatted_documents.append(f"Document [{document_index+1}](Title: {document.title}) {document.text}")
-    return prompt_template.format(question=question, search_results="\n".join(formatted_documents))
+class TokenCounter:
+    """Counts tokens with a (fast) Hugging Face tokenizer, caching the count of each text.
 
+    The same documents appear in the prompts of every gold position and every document count, so
+    sharing one counter across calls to `pack_qa_prompt` tokenizes each document once.
+    """
 
-def get_closedbook_qa_prompt(question: str):
+    def __init__(self, tokenizer, max_cache_size: int = 2**18):
+        # Token offsets in the packed prompt come from the offset mapping, which only fast tokenizers have.
+        if not getattr(tokenizer, "is_fast", False):
+            raise ValueError(f"Packing prompts requires a fast tokenizer, got {type(tokenizer).__name__}")
+        self.tokenizer = tokenizer
+        self.max_cache_size = max_cache_size
+        self.num_hits = 0
+        self.num_misses = 0
+        self._cache = OrderedDict()
+
+    def count(self, texts: Sequence[str]) -> List[int]:
+        """The number of tokens in each text, without special tokens."""
+        cache = self._cache
+        missing_texts = list(dict.fromkeys(text for text in texts if text not in cache))
+        if missing_texts:
+            # Tokenize all of the missing texts in a single batch.
+            for text, input_ids in zip(
+                missing_texts, self.tokenizer(missing_texts, add_special_tokens=False)["input_ids"]
+            ):
+                cache[text] = len(input_ids)
+        counts = []
+        for text in texts:
+            cache.move_to_end(text)
+            counts.append(cache[text])
+        self.num_misses += len(missing_texts)
+        self.num_hits += len(texts) - len(missing_texts)
+        while len(cache) > self.max_cache_size:
+            cache.popitem(last=False)
+        return counts
+
+
+class PackedQAPrompt(NamedTuple):
+    prompt: str
+    # The documents in the prompt, in order. A trimmed document has its trimmed text.
+    documents: DocumentBatch
+    # The [start, end) token indices of each document in the tokenized prompt (with special tokens).
+    document_token_spans: List[Tuple[int, int]]
+    num_prompt_tokens: int
+    # Index of the gold document in `documents`, if there is one.
+    gold_index: Optional[int]
+    num_dropped_documents: int
+    num_trimmed_tokens: int
+
+
+def pack_qa_prompt(
+    question: str,
+    documents: Union[List[Document], DocumentBatch],
+    token_counter: TokenCounter,
+    max_prompt_tokens: int,
+    gold_index: Optional[int] = None,
+    trim_documents: bool = False,
+    mention_random_ordering: bool = False,
+    query_aware_contextualization: bool = False,
+    format_prompt: Optional[Callable[[str], str]] = None,
+) -> PackedQAPrompt:
+    """Build a QA prompt of at most `max_prompt_tokens` tokens (including special tokens) by dropping documents.
+
+    Rather than letting the model truncate the input (which cuts the end of the prompt, and may cut the
+    question), distractors are dropped from the lowest-ranked up. The gold document (`gold_index`, by default
+    the document with `isgold`) is always kept, at the same relative position among the kept documents
+    (e.g., a gold document in the middle stays in the middle). With `trim_documents`, the first dropped
+    distractor is instead trimmed to fill the rest of the budget.
+
+    `format_prompt` (e.g., instruct or chat formatting) is applied to the QA prompt before it is measured,
+    and must include the QA prompt verbatim.
+    """
     if not question:
         raise ValueError(f"Provided `question` must be truthy, got: {question}")
-    with open(PROMPTS_ROOT / "closedbook_qa.prompt") as f:
-        prompt_template = f.read().rstrip("\n")
+    if not documents:
+        raise ValueError(f"Provided `documents` must be truthy, got: {documents}")
+    if not isinstance(documents, DocumentBatch):
+        documents = DocumentBatch.from_documents(documents)
+    if gold_index is None:
+        gold_index = next((index for index, isgold in enumerate(documents.isgolds) if isgold), None)
+    elif not 0 <= gold_index < len(documents):
+        raise ValueError(f"`gold_index` must be a valid index into {len(documents)} documents, got {gold_index}")
+    prompt_template = get_qa_prompt_template(mention_random_ordering, query_aware_contextualization)
+    if format_prompt is None:
+        format_prompt = _identity
+
+    # Documents in the order that they're kept: the gold document, and then the distractors by rank.
+    keep_order = [index for index in range(len(documents)) if index != gold_index]
+    if gold_index is not None:
+        keep_order.insert(0, gold_index)
+    num_body_tokens = token_counter.count(
+        [f"(Title: {documents.titles[index]}) {documents.texts[index]}" for index in keep_order]
+    )
+    num_header_tokens = token_counter.count([f"Document [{number}]" for number in range(1, len(documents) + 1)])
+    num_template_tokens = len(
+        token_counter.tokenizer(format_prompt(prompt_template.render(question=question, search_results="")))[
+            "input_ids"
+        ]
+    )
+
+    def render(num_kept_documents, num_trimmed_text_tokens=0):
+        return _render_packed_qa_prompt(
+            question,
+            documents,
+            keep_order[:num_kept_documents],
+            keep_order[num_kept_documents] if num_trimmed_text_tokens > 0 else None,
+            num_trimmed_text_tokens,
+            gold_index,
+            prompt_template,
+            format_prompt,
+            token_counter.tokenizer,
+        )
+
+    # Estimate the largest number of documents that fits from the cached counts (documents are joined
+    # by newlines).
+    num_kept_documents = 0
+    estimated_num_tokens = num_template_tokens
+    while num_kept_documents < len(keep_order):
+        next_estimated_num_tokens = (
+            estimated_num_tokens
+            + num_header_tokens[num_kept_documents]
+            + num_body_tokens[num_kept_documents]
+            + (num_kept_documents > 0)
+        )
+        if next_estimated_num_tokens > max_prompt_tokens:
+            break
+        estimated_num_tokens = next_estimated_num_tokens
+        num_kept_documents += 1
+
+    # Correct the estimate against the exact tokenization of the rendered prompt. The cached counts don't
+    # see merges across the boundaries of documents, so they can be off by about a token per document.
+    packed_prompt = render(num_kept_documents) if num_kept_documents > 0 else None
+    while packed_prompt is not None and packed_prompt.num_prompt_tokens > max_prompt_tokens:
+        num_kept_documents -= 1
+        packed_prompt = render(num_kept_documents) if num_kept_documents > 0 else None
+    while (
+        packed_prompt is not None
+        and num_kept_documents < len(keep_order)
+        and max_prompt_tokens - packed_prompt.num_prompt_tokens
+        >= num_header_tokens[num_kept_documents] + num_body_tokens[num_kept_documents] - 2 * num_kept_documents
+    ):
+        next_packed_prompt = render(num_kept_documents + 1)
+        if next_packed_prompt.num_prompt_tokens > max_prompt_tokens:
+            break
+        packed_prompt = next_packed_prompt
+        num_kept_documents += 1
+
+    # Trim the first dropped document to fill the rest of the budget. The gold document is never trimmed.
+    if trim_documents and num_kept_documents < len(keep_order) and (gold_index is None or num_kept_documents > 0):
+        trimmed_index = keep_order[num_kept_documents]
+        (num_title_tokens,) = token_counter.count([f"(Title: {documents.titles[trimmed_index]}) "])
+        num_trimmed_text_tokens = (
+            max_prompt_tokens
+            - (packed_prompt.num_prompt_tokens if packed_prompt is not None else num_template_tokens)
+            - num_header_tokens[num_kept_documents]
+            - num_title_tokens
+            - (num_kept_documents > 0)
+        )
+        while num_trimmed_text_tokens > 0:
+            trimmed_packed_prompt = render(num_kept_documents, num_trimmed_text_tokens)
+            num_overflow_tokens = trimmed_packed_prompt.num_prompt_tokens - max_prompt_tokens
+            if num_overflow_tokens <= 0:
+                return trimmed_packed_prompt
+            num_trimmed_text_tokens -= num_overflow_tokens
+
+    if packed_prompt is None:
+        raise ValueError(
+            f"`max_prompt_tokens` ({max_prompt_tokens}) is too small to fit the question and "
+            f"{'the gold document' if gold_index is not None else 'any document'}"
+        )
+    return packed_prompt
+
+
+def _identity(prompt: str) -> str:
+    return prompt
+
+
+def _render_packed_qa_prompt(
+    question,
+    documents,
+    kept_indices,
+    trimmed_index,
+    num_trimmed_text_tokens,
+    gold_index,
+    prompt_template,
+    format_prompt,
+    tokenizer,
+) -> PackedQAPrompt:
+    distractor_indices = sorted(index for index in kept_indices if index != gold_index)
+    num_trimmed_tokens = 0
+    if trimmed_index is not None:
+        # The trimmed document is the lowest-ranked kept distractor, so it goes last.
+        distractor_indices.append(trimmed_index)
+    new_gold_index = None
+    document_indices = distractor_indices
+    if gold_index is not None:
+        # Place the gold document at the same relative position, rounding halves up.
+        num_documents = len(distractor_indices) + 1
+        if len(documents) == 1:
+            new_gold_index = 0
+        else:
+            new_gold_index = (2 * gold_index * (num_documents - 1) + len(documents) - 1) // (2 * (len(documents) - 1))
+        document_indices = distractor_indices[:new_gold_index] + [gold_index] + distractor_indices[new_gold_index:]
+    packed_documents = documents.take(document_indices)
+
+    if trimmed_index is not None:
+        trimmed_position = document_indices.index(trimmed_index)
+        text = packed_documents.texts[trimmed_position]
+        text_offsets = tokenizer(text, add_special_tokens=False, return_offsets_mapping=True)["offset_mapping"]
+        if num_trimmed_text_tokens < len(text_offsets):
+            packed_documents.texts[trimmed_position] = text[: text_offsets[num_trimmed_text_tokens - 1][1]]
+            num_trimmed_tokens = len(text_offsets) - num_trimmed_text_tokens
+
+    search_results = format_documents(packed_documents)
+    qa_prompt, field_offsets = prompt_template.render_with_offsets(question=question, search_results=search_results)
+    prompt = format_prompt(qa_prompt)
+    qa_prompt_offset = prompt.find(qa_prompt)
+    if qa_prompt_offset == -1:
+        raise ValueError("`format_prompt` must include the QA prompt verbatim")
+
+    # Character spans of each document in the prompt. `format_documents` joins the documents with newlines.
+    document_character_spans = []
+    start = qa_prompt_offset + field_offsets["search_results"]
+    for document_number, (title, text) in enumerate(zip(packed_documents.titles, packed_documents.texts), start=1):
+        length = len(f"Document [{document_number}](Title: {title}) {text}")
+        document_character_spans.append((start, start + length))
+        start += length + 1
 
-    return prompt_template.format(question=question)
+    # Map character spans to token spans: a document's tokens are those that overlap its characters.
+    encoding = tokenizer(prompt, return_offsets_mapping=True)
+    token_offsets = encoding["offset_mapping"]
+    document_token_spans = []
+    token_index = 0
+    for character_start, character_end in document_character_spans:
+        while token_index < len(token_offsets) and token_offsets[token_index][1] <= character_start:
+            token_index += 1
+        token_start = token_index
+        while token_index < len(token_offsets) and token_offsets[token_index][0] < character_end:
+            token_index += 1
+        document_token_spans.append((token_start, token_index))
+
+    return PackedQAPrompt(
+        prompt=prompt,
+        documents=packed_documents,
+        document_token_spans=document_token_spans,
+        num_prompt_tokens=len(encoding["input_ids"]),
+        gold_index=new_gold_index,
+        num_dropped_documents=len(documents) - len(packed_documents),
+        num_trimmed_tokens=num_trimmed_tokens,
+    )
+
+
+def get_closedbook_qa_prompt(question: str):
+    return render_closedbook_qa_prompts([question])[0]
+
+
+def render_closedbook_qa_prompts(questions: Sequence[str]) -> List[str]:
+    """Batched version of `get_closedbook_qa_prompt`."""
+    prompt_template = get_prompt_template("closedbook_qa.prompt")
+    prompts = []
+    for question in questions:
+        if not question:
+            raise ValueError(f"Provided `question` must be truthy, got: {question}")
+        prompts.append(prompt_template.render(question=question))
+    return prompts
 
 
 def get_kv_retrieval_prompt(
@@ -75,30 +537,74 @@ def get_kv_retrieval_prompt(
     key: str,
     query_aware_contextualization: bool = False,
 ):
-    if not data:
-        raise ValueError(f"Provided `data` must be truthy, got: {data}")
-    if not key:
-        raise ValueError(f"Provided `key` must be truthy, got: {key}")
-    if key not in [x[0] for x in data]:
-        raise ValueError(f"Did not find provided `key` {key} in data {data}")
-    if len(data) != len(set([x[0] for x in data])):
-        raise ValueError(f"`data` has duplicate keys: {data}")
-    if len(data) < 2:
-        raise ValueError(f"Must have at least 2 items in data: {data}")
+    return render_kv_prompts([data], [key], query_aware_contextualization=query_aware_contextualization)[0]
 
-    if query_aware_contextualization:
-        with open(PROMPTS_ROOT / "kv_retrieval_with_query_aware_contextualization.prompt") as f:
-            prompt_template = f.read().rstrip("\n")
-    else:
-        with open(PROMPTS_ROOT / "kv_retrieval.prompt") as f:
-            prompt_template = f.read().rstrip("\n")
-
-    # Format the KV data into a string
-    formatted_kv_records = ""
-    for index, record in enumerate(data):
-        start_character = "{" if index == 0 else " "
-        data_string = f'"{record[0]}": "{record[1]}"'
-        end_character = ",\n" if index != len(data) - 1 else "}"
-        formatted_kv_records += start_character + data_string + end_character
-
-    return prompt_template.format(formatted_kv_records=formatted_kv_records, key=key)
+
+def render_kv_prompts(
+    data_batches: Sequence[List[Tuple[str, str]]],
+    keys: Sequence[str],
+    query_aware_contextualization: bool = False,
+) -> List[str]:
+    """Batched version of `get_kv_retrieval_prompt`; the i-th prompt retrieves `keys[i]` from `data_batches[i]`."""
+    if len(data_batches) != len(keys):
+        raise ValueError(f"Got {len(data_batches)} batches of data but {len(keys)} keys, expected the same")
+    return [
+        KVRecords(data, key).render_prompt(query_aware_contextualization=query_aware_contextualization)
+        for data, key in zip(data_batches, keys)
+    ]
+
+
+class KVRecords:
+    """The records of a KV retrieval example, validated and formatted once.
+
+    Prompts with the record of `key` moved to any position (`render_prompt(gold_index=...)`) splice the
+    formatted records, rather than formatting (and validating) them again.
+    """
+
+    __slots__ = ("data", "key", "key_index", "formatted_records")
+
+    def __init__(self, data: Sequence[Tuple[str, str]], key: str):
+        if not data:
+            raise ValueError(f"Provided `data` must be truthy, got: {data}")
+        if not key:
+            raise ValueError(f"Provided `key` must be truthy, got: {key}")
+        # A single pass over the records finds the key and (by their number) duplicate keys.
+        record_indices = {record[0]: index for index, record in enumerate(data)}
+        if key not in record_indices:
+            raise ValueError(f"Did not find provided `key` {key} in data {data}")
+        if len(record_indices) != len(data):
+            raise ValueError(f"`data` has duplicate keys: {data}")
+        if len(data) < 2:
+            raise ValueError(f"Must have at least 2 items in data: {data}")
+        self.data = data
+        self.key = key
+        self.key_index = record_indices[key]
+        self.formatted_records = [f'"{record[0]}": "{record[1]}"' for record in data]
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def move_key(self, items: Sequence[T], gold_index: int) -> List[T]:
+        """`items` (one per record, e.g., `data`) with the item of the key's record moved to `gold_index`."""
+        if not 0 <= gold_index < len(items):
+            raise ValueError(f"`gold_index` must be in [0, {len(items)}), got {gold_index}")
+        key_index = self.key_index
+        if gold_index <= key_index:
+            return [*items[:gold_index], items[key_index], *items[gold_index:key_index], *items[key_index + 1 :]]
+        return [*items[:key_index], *items[key_index + 1 : gold_index + 1], items[key_index], *items[gold_index + 1 :]]
+
+    def render_prompt(self, gold_index: Optional[int] = None, query_aware_contextualization: bool = False) -> str:
+        """The prompt with the records in order, or with the key's record moved to `gold_index`."""
+        if query_aware_contextualization:
+            prompt_template = get_prompt_template("kv_retrieval_with_query_aware_contextualization.prompt")
+        else:
+            prompt_template = get_prompt_template("kv_retrieval.prompt")
+        formatted_records = self.formatted_records
+        if gold_index is not None:
+            formatted_records = self.move_key(formatted_records, gold_index)
+        return prompt_template.render(formatted_kv_records="{" + ",\n ".join(formatted_records) + "}", key=self.key)
+
+
+def format_kv_records(data: List[Tuple[str, str]]) -> str:
+    """Format the KV data into a JSON-like string, one record per line."""
+    return "{" + ",\n ".join([f'"{record[0]}": "{record[1]}"' for record in data]) + "}"
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""Columnar storage for scored predictions.
+
+A results table is a NumPy `.npz` archive with one array per column. String columns are stored as
+int32 codes into a single string table (UTF-8 bytes + offsets) shared by all string columns, so
+repeated values (questions, model names, settings) are stored once. Columns are loaded lazily: only
+the columns that are accessed are read and decompressed.
+"""
+import json
+import math
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+_SCHEMA_KEY = "__schema__"
+_STRING_DATA_KEY = "__string_data__"
+_STRING_OFFSETS_KEY = "__string_offsets__"
+
+# Per-example model outputs and inputs, which aren't settings of the run.
+_NON_SETTINGS_KEYS = {"model", "model_answer", "model_prompt", "model_documents", "model_ordered_kv_records"}
+
+
+def get_model_settings(example: dict) -> str:
+    """The `model_*` generation settings of a prediction (e.g., temperature), as a canonical JSON string."""
+    return json.dumps(
+        {key: value for key, value in example.items() if key.startswith("model_") and key not in _NON_SETTINGS_KEYS},
+        sort_keys=True,
+    )
+
+
+def write_results_table(path, columns: Dict[str, Sequence]):
+    """Write columns of equal length to `path`.
+
+    Columns whose values are all strings (or None) are dictionary-encoded. Columns of bools, ints and
+    floats are stored as NumPy arrays; numeric columns with missing (None) values are stored as floats,
+    with NaN for missing values.
+    """
+    num_rows = None
+    schema = {}
+    arrays = {}
+    strings = {}
+    for name, values in columns.items():
+        if name.startswith("__"):
+            raise ValueError(f"Column names cannot start with `__`, got {name}")
+        if num_rows is None:
+            num_rows = len(values)
+        elif len(values) != num_rows:
+            raise ValueError(f"Column {name} has {len(values)} values, expected {num_rows}")
+
+        kind = _infer_column_kind(name, values)
+        schema[name] = kind
+        if kind == "string":
+            arrays[name] = np.array(
+                [-1 if value is None else strings.setdefault(value, len(strings)) for value in values], dtype=np.int32
+            )
+        elif kind == "float":
+            arrays[name] = np.array([math.nan if value is None else value for value in values], dtype=np.float64)
+        else:
+            arrays[name] = np.array(values, dtype={"bool": np.bool_, "int": np.int64}[kind])
+
+    encoded_strings = [string.encode("utf-8") for string in strings]
+    string_offsets = np.zeros(len(encoded_strings) + 1, dtype=np.int64)
+    np.cumsum([len(encoded_string) for encoded_string in encoded_strings], out=string_offsets[1:])
+    arrays[_STRING_DATA_KEY] = np.frombuffer(b"".join(encoded_strings), dtype=np.uint8)
+    arrays[_STRING_OFFSETS_KEY] = string_offsets
+    arrays[_SCHEMA_KEY] = np.frombuffer(json.dumps(schema).encode("utf-8"), dtype=np.uint8)
+    with open(path, "wb") as f:
+        np.savez_compressed(f, **arrays)
+
+
+def _infer_column_kind(name: str, values: Sequence) -> str:
+    present_values = [value for value in values if value is not None]
+    has_missing_values = len(present_values) != len(values)
+    if all(isinstance(value, str) for value in present_values):
+        return "string"
+    if all(isinstance(value, (bool, np.bool_)) for value in present_values):
+        return "float" if has_missing_values else "bool"
+    if all(isinstance(value, (int, float, np.number)) for value in present_values):
+        if has_missing_values or not all(isinstance(value, (int, np.integer)) for value in present_values):
+            return "float"
+        return "int"
+    raise ValueError(f"Column {name} must contain only strings or only numbers")
+
+
+class ResultsTable:
+    """Read-only, lazily-loaded view of a table written by `write_results_table`."""
+
+    def __init__(self, path):
+        self.path = path
+        self._npz = np.load(path, allow_pickle=False)
+        self._schema = json.loads(self._npz[_SCHEMA_KEY].tobytes().decode("utf-8"))
+        self._string_data = None
+        self._string_offsets = None
+        self._cache = {}
+
+    @property
+    def columns(self) -> List[str]:
+        return list(self._schema)
+
+    def __len__(self) -> int:
+        if not self._schema:
+            return 0
+        return len(self._npz[next(iter(self._schema))])
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._schema
+
+    def __getitem__(self, name: str):
+        """A NumPy array for numeric and bool columns, and a list of strings (or None) for string columns."""
+        if name not in self._schema:
+            raise KeyError(f"Unknown column {name}, expected one of {self.columns}")
+        if name not in self._cache:
+            values = self._npz[name]
+            if self._schema[name] == "string":
+                values = self._decode_strings(values)
+            self._cache[name] = values
+        return self._cache[name]
+
+    def codes(self, name: str) -> np.ndarray:
+        """The int32 string-table codes of a string column (-1 for None), for cheap grouping."""
+        if self._schema.get(name) != "string":
+            raise ValueError(f"Column {name} is not a string column")
+        return self._npz[name]
+
+    def _decode_strings(self, codes: np.ndarray) -> List[Optional[str]]:
+        if self._string_data is None:
+            self._string_data = self._npz[_STRING_DATA_KEY].tobytes()
+            self._string_offsets = self._npz[_STRING_OFFSETS_KEY]
+        decoded = {}
+        values = []
+        for code in codes.tolist():
+            if code == -1:
+                values.append(None)
+                continue
+            if code not in decoded:
+                start, end = self._string_offsets[code], self._string_offsets[code + 1]
+                decoded[code] = self._string_data[start:end].decode("utf-8")
+            values.append(decoded[code])
+        return values
+
+    def mean_by(self, metric: str, by: str = "gold_index") -> Dict:
+        """Average a metric column for each distinct value of another column, e.g., a position curve."""
+        metric_values = self[metric]
+        group_values = self[by]
+        if isinstance(group_values, np.ndarray):
+            group_values = group_values.tolist()
+        totals = {}
+        for group_value, metric_value in zip(group_values, metric_values.tolist()):
+            total, count = totals.get(group_value, (0.0, 0))
+            totals[group_value] = (total + metric_value, count + 1)
+        return {
+            group_value: total / count
+            for group_value, (total, count) in sorted(totals.items(), key=lambda item: (item[0] is None, item[0]))
+        }
+
+    def close(self):
+        self._npz.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
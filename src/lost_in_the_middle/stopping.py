@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+"""Stop each sequence of a batch as soon as its response is complete, rather than at `max_new_tokens`.
+
+Only the first line of a QA response is evaluated, and only the quoted value of a KV retrieval response,
+so generating past them is wasted decode steps. Stop patterns are regular expressions matched against the
+text generated so far: `StopPatternCriteria` marks each sequence of a batch as done once one of them
+matches (`generate` then only pads that sequence, and stops when every sequence is done, or at the
+end-of-sequence token as before), and `truncate_at_stop` cuts responses right after the first match, since
+the last token can run past it.
+"""
+import re
+from typing import List, Optional, Sequence
+
+import torch
+from transformers import StoppingCriteria
+
+
+def compile_stop_patterns(stop_patterns: Sequence[str]) -> List[re.Pattern]:
+    return [re.compile(stop_pattern) for stop_pattern in stop_patterns]
+
+
+def find_stop(text: str, stop_patterns: Sequence[re.Pattern]) -> Optional[int]:
+    """Where the first match of any of the stop patterns in `text` ends, or None if none match."""
+    match_ends = [match.end() for match in (pattern.search(text) for pattern in stop_patterns) if match]
+    return min(match_ends) if match_ends else None
+
+
+def truncate_at_stop(text: str, stop_patterns: Sequence[re.Pattern]) -> str:
+    stop = find_stop(text, stop_patterns)
+    return text if stop is None else text[:stop]
+
+
+class StopPatternCriteria(StoppingCriteria):
+    """Marks each sequence of a batch as done once the text generated after its prompt matches a stop pattern.
+
+    `all_stop_patterns[i]` are the stop patterns of sequence `i` (e.g., those of its example). `stopped_at[i]`
+    is the number of new tokens sequence `i` had when it matched (None if it never did).
+    """
+
+    def __init__(self, all_stop_patterns: Sequence[Sequence[re.Pattern]], tokenizer, prompt_length: int):
+        self.all_stop_patterns = all_stop_patterns
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stopped_at: List[Optional[int]] = []
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs) -> torch.BoolTensor:
+        if not self.stopped_at:
+            self.stopped_at = [None] * input_ids.shape[0]
+        num_new_tokens = input_ids.shape[1] - self.prompt_length
+        rows = [row for row, stopped_at in enumerate(self.stopped_at) if stopped_at is None]
+        if rows:
+            texts = self.tokenizer.batch_decode(input_ids[rows, self.prompt_length :], skip_special_tokens=True)
+            for row, text in zip(rows, texts):
+                if find_stop(text, self.all_stop_patterns[row]) is not None:
+                    self.stopped_at[row] = num_new_tokens
+        return torch.tensor(
+            [stopped_at is not None for stopped_at in self.stopped_at], dtype=torch.bool, device=input_ids.device
+        )
+
+
+class StopReport:
+    """How many decode steps and tokens stop patterns saved, compared to generating up to `max_new_tokens`.
+
+    Decode steps are per batch (a batch runs until its last sequence is done). Saved tokens are an upper
+    bound: without stop patterns, some of the stopped sequences would still have ended early at an
+    end-of-sequence token.
+    """
+
+    def __init__(self, max_new_tokens: int):
+        self.max_new_tokens = max_new_tokens
+        self.num_sequences = 0
+        self.num_stopped_sequences = 0
+        self.max_num_saved_tokens = 0
+        self.num_decode_steps = 0
+        self.num_batches = 0
+
+    def add(self, criteria: StopPatternCriteria, num_new_tokens: int):
+        """Add a batch that generated `num_new_tokens` (for its longest sequence) with `criteria`."""
+        stopped_at = [stopped_at for stopped_at in criteria.stopped_at if stopped_at is not None]
+        self.num_sequences += len(criteria.stopped_at)
+        self.num_stopped_sequences += len(stopped_at)
+        self.max_num_saved_tokens += sum(self.max_new_tokens - num_tokens for num_tokens in stopped_at)
+        self.num_decode_steps += num_new_tokens
+        self.num_batches += 1
+
+    def format_report(self) -> str:
+        max_num_decode_steps = self.num_batches * self.max_new_tokens
+        saved_fraction = 1 - self.num_decode_steps / max_num_decode_steps if max_num_decode_steps else 0.0
+        return (
+            f"Stop patterns ended {self.num_stopped_sequences} of {self.num_sequences} sequences early, saving up to "
+            f"{self.max_num_saved_tokens} decode tokens; batches ran {self.num_decode_steps} of "
+            f"{max_num_decode_steps} decode steps ({saved_fraction:.1%} saved)"
+        )
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""Prefill and decode throughput of `model.generate`.
+
+`ThroughputMeter.generate` times the first forward pass of each call (the prefill, which also produces
+the first new token) separately from the remaining steps (the decode). Prefill throughput counts the
+(non-padding) prompt tokens that aren't already in passed-in past key/values, and decode throughput counts
+the new tokens after the first one, up to and including the end-of-sequence token of each sequence (sequences
+stopped by stopping criteria are padded after their last token, which isn't counted either).
+"""
+import time
+from typing import Iterable, Optional, Union
+
+import torch
+from transformers import LogitsProcessor, LogitsProcessorList
+
+
+class _StepTimer(LogitsProcessor):
+    """Records when the logits of each generation step are ready."""
+
+    def __init__(self):
+        self.step_times = []
+
+    def __call__(self, input_ids, scores):
+        if scores.is_cuda:
+            torch.cuda.synchronize(scores.device)
+        self.step_times.append(time.perf_counter())
+        return scores
+
+
+class ThroughputMeter:
+    def __init__(self):
+        self.num_prefill_tokens = 0
+        self.prefill_seconds = 0.0
+        self.num_decode_tokens = 0
+        self.decode_seconds = 0.0
+
+    def generate(self, model, inputs, **generate_kwargs) -> torch.Tensor:
+        """Call `model.generate(**inputs, **generate_kwargs)`, adding its prefill and decode to the totals."""
+        timer = _StepTimer()
+        logits_processor = LogitsProcessorList(generate_kwargs.pop("logits_processor", None) or [])
+        logits_processor.append(timer)
+        eos_token_id = generate_kwargs.get("eos_token_id", model.generation_config.eos_token_id)
+        if isinstance(eos_token_id, int):
+            eos_token_id = [eos_token_id]
+        pad_token_id = generate_kwargs.get("pad_token_id", model.generation_config.pad_token_id)
+        # Sequences that end early (at an end-of-sequence token, or by stopping criteria) are then padded.
+        end_token_ids = [*(eos_token_id or []), *([] if pad_token_id is None else [pad_token_id])]
+        input_ids = inputs["input_ids"]
+        attention_mask = inputs.get("attention_mask")
+        num_prompt_tokens = int(attention_mask.sum()) if attention_mask is not None else input_ids.numel()
+        past_key_values = inputs.get("past_key_values")
+        if past_key_values is not None:
+            # Cached tokens (e.g., a shared prompt prefix) aren't prefilled again. `generate` appends to the
+            # cache, so this is counted beforehand.
+            num_prompt_tokens -= past_key_values.get_seq_length() * input_ids.shape[0]
+
+        start = time.perf_counter()
+        with torch.no_grad():
+            outputs = model.generate(**inputs, logits_processor=logits_processor, **generate_kwargs)
+        end = time.perf_counter()
+
+        self.num_prefill_tokens += num_prompt_tokens
+        prefill_end = timer.step_times[0] if timer.step_times else end
+        self.prefill_seconds += prefill_end - start
+        num_new_tokens = count_new_tokens(outputs[:, input_ids.shape[1] :], end_token_ids or None)
+        self.num_decode_tokens += max(0, num_new_tokens - outputs.shape[0])
+        self.decode_seconds += end - prefill_end
+        return outputs
+
+    @property
+    def prefill_tokens_per_second(self) -> float:
+        return self.num_prefill_tokens / self.prefill_seconds if self.prefill_seconds else 0.0
+
+    @property
+    def decode_tokens_per_second(self) -> float:
+        return self.num_decode_tokens / self.decode_seconds if self.decode_seconds else 0.0
+
+    def format_report(self) -> str:
+        return (
+            f"Prefill: {self.num_prefill_tokens} prompt tokens in {self.prefill_seconds:.2f} s "
+            f"({self.prefill_tokens_per_second:.1f} tokens/s), "
+            f"decode: {self.num_decode_tokens} new tokens in {self.decode_seconds:.2f} s "
+            f"({self.decode_tokens_per_second:.1f} tokens/s)"
+        )
+
+
+def count_new_tokens(new_token_ids: torch.Tensor, eos_token_id: Optional[Union[int, Iterable[int]]] = None) -> int:
+    """Count generated tokens, up to and including the first end-of-sequence token of each sequence."""
+    if eos_token_id is None:
+        return new_token_ids.numel()
+    eos_token_ids = torch.tensor(
+        [eos_token_id] if isinstance(eos_token_id, int) else list(eos_token_id), device=new_token_ids.device
+    )
+    is_eos = torch.isin(new_token_ids, eos_token_ids)
+    # Tokens after the first end-of-sequence token are padding.
+    is_padding = (is_eos.cumsum(dim=1) - is_eos.long()) > 0
+    return int((~is_padding).sum())
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+import pytest
+
+from lost_in_the_middle.batching import (
+    format_padding_report,
+    get_batches,
+    get_padding_stats,
+    restore_order,
+)
+
+
+def test_get_batches():
+    lengths = [5, 100, 7, 90, 6, 95]
+    assert get_batches(lengths, batch_size=2, sort_by_length=False) == [[0, 1], [2, 3], [4, 5]]
+    assert get_batches(lengths, batch_size=2) == [[1, 5], [3, 2], [4, 0]]
+    # Batches are limited by their padded size.
+    assert get_batches(lengths, batch_size=4, max_batch_tokens=300) == [[1, 5, 3], [2, 4, 0]]
+    # Prompts longer than `max_batch_tokens` get a batch of their own.
+    assert get_batches(lengths, batch_size=4, max_batch_tokens=50) == [[1], [5], [3], [2, 4, 0]]
+    assert get_batches([], batch_size=2) == []
+    with pytest.raises(ValueError):
+        get_batches(lengths, batch_size=0)
+
+
+def test_restore_order():
+    lengths = [5, 100, 7, 90, 6, 95]
+    batches = get_batches(lengths, batch_size=4, max_batch_tokens=300)
+    outputs = [f"output {index}" for batch in batches for index in batch]
+    assert restore_order(batches, outputs) == [f"output {index}" for index in range(len(lengths))]
+    with pytest.raises(ValueError):
+        restore_order(batches, outputs[:-1])
+
+
+def test_get_padding_stats():
+    lengths = [5, 100, 7, 90, 6, 95]
+    file_order_stats = get_padding_stats(lengths, get_batches(lengths, batch_size=2, sort_by_length=False))
+    assert file_order_stats.num_tokens == sum(lengths)
+    assert file_order_stats.num_padded_tokens == 2 * (100 + 90 + 95)
+    stats = get_padding_stats(lengths, get_batches(lengths, batch_size=2))
+    assert stats.num_padded_tokens == 2 * (100 + 90 + 6)
+    assert stats.padding_fraction < file_order_stats.padding_fraction
+    assert "in 3 scheduled batches" in format_padding_report(lengths, get_batches(lengths, batch_size=2), 2)
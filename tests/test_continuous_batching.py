@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+import random
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from lost_in_the_middle.continuous_batching import ContinuousBatcher  # noqa: E402
+from lost_in_the_middle.stopping import compile_stop_patterns  # noqa: E402
+
+# Tokens that the tiny Llama generates often enough for sequences to end at different steps.
+EOS_TOKEN_IDS = [5, 17, 30]
+
+
+def get_prompts(num_prompts=20):
+    rng = random.Random(0)
+    return [[1] + [rng.randrange(3, 100) for _ in range(rng.randint(2, 30))] for _ in range(num_prompts)]
+
+
+def get_unbatched_new_token_ids(model, prompt_input_ids, max_new_tokens):
+    outputs = model.generate(
+        input_ids=torch.tensor([prompt_input_ids]),
+        max_new_tokens=max_new_tokens,
+        do_sample=False,
+        eos_token_id=EOS_TOKEN_IDS,
+        pad_token_id=0,
+    )
+    # A single sequence isn't padded, so it ends right at its end token.
+    return outputs[0, len(prompt_input_ids) :].tolist()
+
+
+@pytest.mark.parametrize("max_batch_size", [1, 4])
+def test_continuous_batcher_matches_unbatched_greedy_generation(tiny_llama, max_batch_size):
+    prompts = get_prompts()
+    batcher = ContinuousBatcher(tiny_llama, max_batch_size, max_new_tokens=12, eos_token_ids=EOS_TOKEN_IDS)
+    new_token_ids = dict(batcher.generate(prompts))
+    expected_new_token_ids = [get_unbatched_new_token_ids(tiny_llama, prompt, 12) for prompt in prompts]
+    assert [new_token_ids[index] for index in range(len(prompts))] == expected_new_token_ids
+    # Sequences end at different steps, and finished ones are replaced as they end, rather than per batch.
+    assert len({len(ids) for ids in expected_new_token_ids}) > 1
+    assert batcher.num_prefills >= len(prompts) / max_batch_size
+    assert batcher.num_decode_rows == sum(len(ids) - 1 for ids in expected_new_token_ids)
+    assert batcher.throughput_meter.num_decode_tokens == sum(len(ids) - 1 for ids in expected_new_token_ids)
+
+
+def test_continuous_batcher_stops_at_stop_patterns(tiny_model_path):
+    tokenizer = transformers.AutoTokenizer.from_pretrained(tiny_model_path)
+    model = transformers.AutoModelForCausalLM.from_pretrained(tiny_model_path).eval()
+    prompts = tokenizer(["Question: who?", "Document [1](Title: Some title) some text", "who"])["input_ids"]
+    full = dict(ContinuousBatcher(model, 2, max_new_tokens=10).generate(prompts))
+    stopped = dict(
+        ContinuousBatcher(
+            model, 2, max_new_tokens=10, stop_patterns=compile_stop_patterns([r"^.{3}"]), tokenizer=tokenizer
+        ).generate(prompts, order=[2, 0, 1])
+    )
+    for index in range(len(prompts)):
+        response = tokenizer.decode(stopped[index], skip_special_tokens=True)
+        assert len(response) >= 3
+        # Only the last token ran past the stop.
+        assert len(tokenizer.decode(stopped[index][:-1], skip_special_tokens=True)) < 3
+        assert full[index][: len(stopped[index])] == stopped[index]
+
+
+def test_continuous_batcher_stops_at_the_stop_patterns_of_each_prompt(tiny_model_path):
+    tokenizer = transformers.AutoTokenizer.from_pretrained(tiny_model_path)
+    model = transformers.AutoModelForCausalLM.from_pretrained(tiny_model_path).eval()
+    prompts = tokenizer(["Question: who?", "who"])["input_ids"]
+    full = dict(ContinuousBatcher(model, 2, max_new_tokens=10).generate(prompts))
+    stopped = dict(
+        ContinuousBatcher(model, 2, max_new_tokens=10, tokenizer=tokenizer).generate(
+            prompts, all_stop_patterns=[compile_stop_patterns([r"^.{3}"]), []]
+        )
+    )
+    assert len(tokenizer.decode(stopped[0][:-1], skip_special_tokens=True)) < 3
+    assert full[0][: len(stopped[0])] == stopped[0]
+    assert stopped[1] == full[1]
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import importlib.util
+import json
+import pathlib
+import sys
+
+import numpy as np
+import pytest
+from xopen import xopen
+
+from lost_in_the_middle.passage_store import PassageStore, store_passages
+from lost_in_the_middle.prompting import (
+    DocumentBatch,
+    get_closedbook_qa_prompt,
+    get_qa_prompt,
+)
+
+SCRIPTS_DIR = pathlib.Path(__file__).resolve().parent.parent / "scripts"
+
+spec = importlib.util.spec_from_file_location("count_average_tokens", SCRIPTS_DIR / "count_average_tokens.py")
+count_average_tokens = importlib.util.module_from_spec(spec)
+# Registered so that worker processes can find the functions they're sent.
+sys.modules[spec.name] = count_average_tokens
+spec.loader.exec_module(count_average_tokens)
+
+
+def write_jsonl(path, examples):
+    with xopen(path, "w") as f:
+        for example in examples:
+            f.write(json.dumps(example) + "\n")
+
+
+def get_qa_examples(num_examples=7):
+    return [
+        {
+            "question": f"who {index}?",
+            "answers": ["x"],
+            "ctxs": [
+                {
+                    "title": f"Title {doc_index}",
+                    "text": "some text " * (index + doc_index + 1),
+                    "isgold": doc_index == 1,
+                }
+                for doc_index in range(3)
+            ],
+        }
+        for index in range(num_examples)
+    ]
+
+
+@pytest.fixture
+def tokenizer_path(tmp_path, bpe_tokenizer):
+    path = tmp_path / "tokenizer"
+    bpe_tokenizer.save_pretrained(path)
+    return path
+
+
+def test_count_tokens_of_prompt_files(tmp_path, bpe_tokenizer, tokenizer_path):
+    prompts = [f"Question: who {index}? Answer:" + " some text" * index for index in range(7)]
+    input_path = tmp_path / "prompts.jsonl.gz"
+    write_jsonl(input_path, [{"question": f"who {index}?", "prompt": prompt} for index, prompt in enumerate(prompts)])
+
+    expected_lengths = [len(bpe_tokenizer(prompt)["input_ids"]) for prompt in prompts]
+    for num_workers in [1, 2]:
+        lengths = count_average_tokens.count_tokens(
+            input_path, str(tokenizer_path), chunk_size=2, num_workers=num_workers
+        )
+        assert lengths.tolist() == expected_lengths
+    # Without a tokenizer, whitespace-separated words are counted.
+    words = count_average_tokens.count_tokens(input_path, None, chunk_size=3, num_workers=1)
+    assert words.tolist() == [len(prompt.split()) for prompt in prompts]
+
+
+def test_count_tokens_of_qa_data(tmp_path, bpe_tokenizer, tokenizer_path):
+    examples = get_qa_examples()
+    input_path = tmp_path / "qa_data.jsonl"
+    write_jsonl(input_path, examples)
+    expected_lengths = [
+        len(
+            bpe_tokenizer(
+                get_qa_prompt(
+                    example["question"],
+                    DocumentBatch.from_dicts(example["ctxs"]),
+                    mention_random_ordering=False,
+                    query_aware_contextualization=False,
+                )
+            )["input_ids"]
+        )
+        for example in examples
+    ]
+    lengths_by_num_workers = [
+        count_average_tokens.count_tokens(input_path, str(tokenizer_path), chunk_size=2, num_workers=num_workers)
+        for num_workers in [1, 2]
+    ]
+    assert lengths_by_num_workers[0].tolist() == expected_lengths
+    assert lengths_by_num_workers[1].tolist() == expected_lengths
+
+    closedbook_lengths = count_average_tokens.count_tokens(
+        input_path, str(tokenizer_path), chunk_size=2, num_workers=1, closedbook=True
+    )
+    assert closedbook_lengths.tolist() == [
+        len(bpe_tokenizer(get_closedbook_qa_prompt(example["question"]))["input_ids"]) for example in examples
+    ]
+
+    # Documents written as `passage_id` references are resolved from the passage store.
+    passage_store = PassageStore(tmp_path / "passages.sqlite")
+    referenced_examples = [dict(example, ctxs=store_passages(example["ctxs"], passage_store)) for example in examples]
+    passage_store.close()
+    referenced_input_path = tmp_path / "qa_data_with_passage_ids.jsonl"
+    write_jsonl(referenced_input_path, referenced_examples)
+    referenced_lengths = count_average_tokens.count_tokens(
+        referenced_input_path,
+        str(tokenizer_path),
+        chunk_size=2,
+        num_workers=2,
+        passage_store_path=str(tmp_path / "passages.sqlite"),
+    )
+    assert referenced_lengths.tolist() == expected_lengths
+
+
+def test_count_tokens_rejects_mixed_inputs(tmp_path):
+    examples = get_qa_examples(num_examples=2)
+    examples[1]["prompt"] = "Question: who? Answer:"
+    input_path = tmp_path / "mixed.jsonl"
+    write_jsonl(input_path, examples)
+    with pytest.raises(ValueError):
+        count_average_tokens.count_tokens(input_path, None, chunk_size=2, num_workers=1)
+
+
+def test_format_histogram():
+    lengths = np.array([1, 2, 2, 3, 10])
+    lines = count_average_tokens.format_histogram(lengths, num_bins=3, bar_width=10)
+    assert len(lines) == 3
+    assert [int(line.split(")")[1].split()[0]) for line in lines] == [4, 0, 1]
+    # The fullest bin has a full bar.
+    assert lines[0].endswith(" " + "#" * 10)
+    assert not lines[1].endswith("#")
+
+
+def test_main_logs_the_unit(tmp_path, caplog):
+    input_path = tmp_path / "prompts.jsonl"
+    write_jsonl(input_path, [{"prompt": "one two three"}, {"prompt": "four five"}])
+    with caplog.at_level("INFO"):
+        count_average_tokens.main(input_path, None, 2, 1024, 1, 2, False, False, False, None)
+    assert "Average number of whitespace-separated words per prompt: 2.5" in caplog.text
+    assert "1 prompts (50.00%) have more than 2 whitespace-separated words" in caplog.text
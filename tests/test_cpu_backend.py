@@ -0,0 +1,40 @@
+#!/usr/bin/env python3
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from lost_in_the_middle.cpu_backend import (  # noqa: E402
+    configure_cpu_threads,
+    prepare_cpu_model,
+)
+
+
+def test_configure_cpu_threads():
+    num_threads = torch.get_num_threads()
+    configure_cpu_threads(num_threads=1)
+    assert torch.get_num_threads() == 1
+    configure_cpu_threads(num_threads=num_threads)
+    with pytest.raises(ValueError):
+        configure_cpu_threads(num_threads=0)
+
+
+@pytest.mark.filterwarnings("ignore::DeprecationWarning", "ignore::UserWarning")
+def test_prepare_cpu_model(tiny_llama):
+    input_ids = torch.tensor([[1, 5, 6, 7, 8, 9]])
+    expected_outputs = tiny_llama.generate(input_ids=input_ids, max_new_tokens=5, do_sample=False)
+
+    bfloat16_model = prepare_cpu_model(tiny_llama, dtype="bfloat16")
+    assert bfloat16_model.lm_head.weight.dtype == torch.bfloat16
+    assert bfloat16_model.generate(input_ids=input_ids, max_new_tokens=5, do_sample=False).shape == (1, 11)
+
+    quantized_model = prepare_cpu_model(tiny_llama.float(), quantize_int8=True)
+    assert isinstance(quantized_model.lm_head, torch.ao.nn.quantized.dynamic.Linear)
+    outputs = quantized_model.generate(input_ids=input_ids, max_new_tokens=5, do_sample=False)
+    # Quantization error can change the greedy choice on a random model, but not the shape.
+    assert outputs.shape == expected_outputs.shape
+
+    with pytest.raises(ValueError):
+        prepare_cpu_model(tiny_llama, dtype="bfloat16", quantize_int8=True)
+    with pytest.raises(ValueError):
+        prepare_cpu_model(tiny_llama, dtype="float16")
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+import json
+import os
+import pathlib
+import subprocess
+import sys
+
+import pytest
+from xopen import xopen
+
+from lost_in_the_middle.data_parallel import (
+    check_shard,
+    create_manifest,
+    in_shard,
+    load_manifest,
+    merge_shard_outputs,
+    write_manifest,
+)
+
+SCRIPTS_DIR = pathlib.Path(__file__).resolve().parent.parent / "scripts"
+
+
+def write_jsonl(path, examples):
+    with xopen(path, "w") as f:
+        for example in examples:
+            f.write(json.dumps(example) + "\n")
+
+
+def read_jsonl(path):
+    with xopen(path) as fin:
+        return [json.loads(line) for line in fin]
+
+
+def test_shards_cover_every_line_once():
+    num_shards = 3
+    shards = [[line_index for line_index in range(10) if in_shard(line_index, shard, num_shards)] for shard in range(3)]
+    assert shards == [[0, 3, 6, 9], [1, 4, 7], [2, 5, 8]]
+    with pytest.raises(ValueError):
+        check_shard(3, num_shards)
+    with pytest.raises(ValueError):
+        check_shard(0, 0)
+
+
+def test_merge_shard_outputs(tmp_path):
+    input_path = tmp_path / "input.jsonl.gz"
+    output_path = tmp_path / "output.jsonl.gz"
+    input_examples = [{"question": f"q{index}"} for index in range(7)]
+    write_jsonl(input_path, input_examples)
+
+    manifest = create_manifest(input_path, output_path, 3, ["--task", "qa"], ["cpu"] * 3)
+    assert [shard["num_examples"] for shard in manifest["shards"]] == [3, 2, 2]
+    assert manifest["shards"][0]["output_path"].endswith(".jsonl.gz")
+    write_manifest(manifest)
+    assert load_manifest(output_path) == manifest
+
+    with pytest.raises(ValueError):
+        merge_shard_outputs(manifest)
+    for shard in manifest["shards"]:
+        shard_examples = input_examples[shard["shard_index"] :: 3]
+        write_jsonl(
+            shard["output_path"], [{**example, "model_answer": example["question"]} for example in shard_examples]
+        )
+        shard["status"] = "done"
+    merge_shard_outputs(manifest)
+    assert read_jsonl(output_path) == [{**example, "model_answer": example["question"]} for example in input_examples]
+
+    # Outputs that don't line up with the input are caught.
+    write_jsonl(manifest["shards"][1]["output_path"], [{"question": "q4"}, {"question": "q1"}])
+    with pytest.raises(ValueError):
+        merge_shard_outputs(manifest)
+
+
+def test_data_parallel_matches_single_process(tmp_path, tiny_model_path):
+    input_path = tmp_path / "qa.jsonl"
+    input_examples = [
+        {
+            "question": f"who {index}?",
+            "answers": ["x"],
+            "ctxs": [
+                {
+                    "title": f"Title {doc_index}",
+                    "text": "some text " * (index + doc_index + 1),
+                    "isgold": doc_index == 1,
+                }
+                for doc_index in range(4)
+            ],
+        }
+        for index in range(5)
+    ]
+    write_jsonl(input_path, input_examples)
+    worker_args = ["--task", "qa", "--model", str(tiny_model_path), "--max-new-tokens", "4", "--use-random-ordering"]
+    env = {**os.environ, "PYTHONPATH": str(pathlib.Path(__file__).resolve().parent.parent / "src")}
+
+    subprocess.run(
+        [sys.executable, str(SCRIPTS_DIR / "get_responses.py"), *worker_args, "--device", "cpu"]
+        + ["--input-path", str(input_path), "--output-path", str(tmp_path / "single.jsonl")],
+        env=env,
+        check=True,
+    )
+    launch = [
+        sys.executable,
+        str(SCRIPTS_DIR / "get_responses_data_parallel.py"),
+        *worker_args,
+        "--device",
+        "cpu",
+        "--num-workers",
+        "2",
+        "--input-path",
+        str(input_path),
+        "--output-path",
+        str(tmp_path / "parallel.jsonl"),
+    ]
+    subprocess.run(launch, env=env, check=True)
+    assert read_jsonl(tmp_path / "parallel.jsonl") == read_jsonl(tmp_path / "single.jsonl")
+    manifest = load_manifest(tmp_path / "parallel.jsonl")
+    assert [shard["status"] for shard in manifest["shards"]] == ["done", "done"]
+
+    # A launch that already ran is only resumed on request.
+    assert subprocess.run(launch, env=env, capture_output=True).returncode != 0
+    subprocess.run(launch + ["--resume"], env=env, check=True)
@@ -0,0 +1,287 @@
+#!/usr/bin/env python3
+import json
+
+import pytest
+from xopen import xopen
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from lost_in_the_middle.engine import (  # noqa: E402
+    GenerationJob,
+    HFBackend,
+    KVTask,
+    MPTBackend,
+    QATask,
+    TaskExample,
+    generate_all_responses,
+    generate_responses,
+)
+from lost_in_the_middle.generation_cache import GenerationCache  # noqa: E402
+from lost_in_the_middle.stopping import (  # noqa: E402
+    compile_stop_patterns,
+    truncate_at_stop,
+)
+
+
+def write_qa_data(path, num_examples=5):
+    with xopen(path, "w") as f:
+        for index in range(num_examples):
+            ctxs = [
+                {
+                    "title": f"Title {doc_index}",
+                    "text": "some text " * (index + doc_index + 1),
+                    "isgold": doc_index == 1,
+                }
+                for doc_index in range(3)
+            ]
+            f.write(json.dumps({"question": f"who {index}?", "answers": ["x"], "ctxs": ctxs}) + "\n")
+
+
+def write_kv_data(path, num_examples=3):
+    with xopen(path, "w") as f:
+        for index in range(num_examples):
+            records = [[f"key-{index}-{record_index}", f"value-{record_index}"] for record_index in range(4)]
+            key, value = records[2]
+            f.write(json.dumps({"ordered_kv_records": records, "key": key, "value": value}) + "\n")
+
+
+def read_jsonl(path):
+    with xopen(path) as fin:
+        return [json.loads(line) for line in fin]
+
+
+def get_unbatched_responses(model_path, prompts, max_new_tokens):
+    tokenizer = transformers.AutoTokenizer.from_pretrained(model_path)
+    model = transformers.AutoModelForCausalLM.from_pretrained(model_path).eval()
+    responses = []
+    for prompt in prompts:
+        input_ids = tokenizer(prompt, return_tensors="pt")["input_ids"]
+        outputs = model.generate(input_ids=input_ids, max_new_tokens=max_new_tokens, do_sample=False)
+        responses.append(tokenizer.decode(outputs[0, input_ids.shape[1] :], skip_special_tokens=True))
+    return responses
+
+
+@pytest.mark.parametrize("reuse_prefix_cache", [False, True])
+def test_generate_qa_responses(tmp_path, tiny_model_path, reuse_prefix_cache):
+    input_path = tmp_path / "qa.jsonl.gz"
+    write_qa_data(input_path)
+    output_path = tmp_path / "predictions" / "qa-predictions.jsonl.gz"
+    generate_responses(
+        QATask(),
+        HFBackend(str(tiny_model_path), device="cpu"),
+        input_path,
+        output_path,
+        batch_size=2,
+        max_new_tokens=4,
+        reuse_prefix_cache=reuse_prefix_cache,
+    )
+
+    input_examples = read_jsonl(input_path)
+    output_examples = read_jsonl(output_path)
+    assert [example["question"] for example in output_examples] == [example["question"] for example in input_examples]
+    expected_responses = get_unbatched_responses(
+        tiny_model_path, [example["model_prompt"] for example in output_examples], max_new_tokens=4
+    )
+    for input_example, output_example, expected_response in zip(input_examples, output_examples, expected_responses):
+        assert output_example["model_answer"] == expected_response
+        assert output_example["model_prompt"].endswith(f"Question: {input_example['question']}\nAnswer:")
+        assert [document["title"] for document in output_example["model_documents"]] == [
+            "Title 0",
+            "Title 1",
+            "Title 2",
+        ]
+        assert output_example["model"] == str(tiny_model_path)
+        assert output_example["model_temperature"] == 0.0
+        assert output_example["model_use_random_ordering"] is False
+
+
+def test_generate_closedbook_and_kv_responses(tmp_path, tiny_model_path):
+    input_path = tmp_path / "qa.jsonl"
+    write_qa_data(input_path, num_examples=2)
+    generate_responses(
+        QATask(closedbook=True),
+        HFBackend(str(tiny_model_path), device="cpu"),
+        input_path,
+        tmp_path / "closedbook.jsonl",
+    )
+    for output_example in read_jsonl(tmp_path / "closedbook.jsonl"):
+        assert "Document" not in output_example["model_prompt"]
+        assert output_example["model_documents"] == []
+
+    input_path = tmp_path / "kv.jsonl"
+    write_kv_data(input_path)
+    generate_responses(
+        KVTask(gold_index=0),
+        HFBackend(str(tiny_model_path), device="cpu"),
+        input_path,
+        tmp_path / "kv-predictions.jsonl",
+    )
+    for output_example in read_jsonl(tmp_path / "kv-predictions.jsonl"):
+        assert output_example["model_ordered_kv_records"][0] == [output_example["key"], output_example["value"]]
+        assert output_example["model_prompt"].index(output_example["key"]) < output_example["model_prompt"].index(
+            output_example["ordered_kv_records"][0][0]
+        )
+
+
+def test_generate_all_responses_sweeps_gold_indices(tmp_path, tiny_model_path):
+    input_path = tmp_path / "kv.jsonl"
+    write_kv_data(input_path)
+    for gold_index in [0, 3]:
+        generate_responses(
+            KVTask(gold_index=gold_index),
+            HFBackend(str(tiny_model_path), device="cpu"),
+            input_path,
+            tmp_path / f"separate-{gold_index}.jsonl",
+            max_new_tokens=4,
+        )
+
+    backend = HFBackend(str(tiny_model_path), device="cpu")
+    load = backend.load
+    num_loads = []
+    backend.load = lambda: num_loads.append(1) or load()
+    generate_all_responses(
+        [
+            GenerationJob(KVTask(gold_index=gold_index), input_path, tmp_path / f"sweep-{gold_index}.jsonl")
+            for gold_index in [0, 3]
+        ],
+        backend,
+        max_new_tokens=4,
+    )
+    assert len(num_loads) == 1
+    for gold_index in [0, 3]:
+        sweep_examples = read_jsonl(tmp_path / f"sweep-{gold_index}.jsonl")
+        assert sweep_examples == read_jsonl(tmp_path / f"separate-{gold_index}.jsonl")
+        for output_example in sweep_examples:
+            assert output_example["model_ordered_kv_records"][gold_index][0] == output_example["key"]
+
+
+def test_mpt_backend_formats_instruct_prompts():
+    assert MPTBackend("mosaicml/mpt-30b", device="cpu").format_prompt("Question?") == "Question?"
+    assert MPTBackend("mosaicml/mpt-30b-instruct", device="cpu").format_prompt("Question?") == (
+        "Below is an instruction that describes a task. Write a response that appropriately completes the request.\n"
+        "### Instruction:\nQuestion?\n### Response:\n"
+    )
+    with pytest.raises(ValueError):
+        MPTBackend("mosaicml/mpt-30b", device="cuda", quantize_int8=True)
+
+
+def test_mpt_backend_rejects_prefix_cache_and_continuous_batching(tmp_path):
+    input_path = tmp_path / "qa.jsonl"
+    write_qa_data(input_path, num_examples=2)
+    backend = MPTBackend("mosaicml/mpt-30b", device="cpu")
+    # MPT keeps its past key/values as tuples, so these fail before the model is loaded.
+    assert not backend.supports_prefix_cache
+    assert not backend.supports_continuous_batching
+    for kwargs in [{"reuse_prefix_cache": True}, {"continuous_batching": True}]:
+        with pytest.raises(ValueError):
+            generate_responses(QATask(), backend, input_path, tmp_path / "out.jsonl", **kwargs)
+
+
+def test_generate_responses_with_generation_cache(tmp_path, tiny_model_path):
+    input_path = tmp_path / "qa.jsonl"
+    write_qa_data(input_path, num_examples=3)
+    # A repeated example is only generated once.
+    with open(input_path) as f:
+        first_line = f.readline()
+    with open(input_path, "a") as f:
+        f.write(first_line)
+
+    with GenerationCache(tmp_path / "cache.sqlite") as cache:
+        generate_responses(
+            QATask(),
+            HFBackend(str(tiny_model_path), device="cpu"),
+            input_path,
+            tmp_path / "first.jsonl",
+            max_new_tokens=4,
+            generation_cache=cache,
+        )
+        assert (cache.num_hits, cache.num_misses, len(cache)) == (0, 3, 3)
+
+        generate_responses(
+            QATask(),
+            HFBackend(str(tiny_model_path), device="cpu"),
+            input_path,
+            tmp_path / "second.jsonl",
+            max_new_tokens=4,
+            generation_cache=cache,
+        )
+        assert (cache.num_hits, cache.num_misses, len(cache)) == (3, 3, 3)
+
+    first_examples = read_jsonl(tmp_path / "first.jsonl")
+    assert len(first_examples) == 4
+    assert first_examples[0]["model_answer"] == first_examples[3]["model_answer"]
+    assert read_jsonl(tmp_path / "second.jsonl") == first_examples
+
+
+def test_generate_responses_with_stop_patterns(tmp_path, tiny_model_path):
+    input_path = tmp_path / "qa.jsonl"
+    write_qa_data(input_path, num_examples=4)
+    for name, stop_patterns in [("full", []), ("stopped", [r"^.{3}"])]:
+        generate_responses(
+            QATask(),
+            HFBackend(str(tiny_model_path), device="cpu"),
+            input_path,
+            tmp_path / f"{name}.jsonl",
+            max_new_tokens=10,
+            stop_patterns=stop_patterns,
+        )
+    for full_example, stopped_example in zip(
+        read_jsonl(tmp_path / "full.jsonl"), read_jsonl(tmp_path / "stopped.jsonl")
+    ):
+        assert len(full_example["model_answer"]) > 3
+        assert stopped_example["model_answer"] == full_example["model_answer"][:3]
+
+
+def test_generate_responses_with_continuous_batching(tmp_path, tiny_model_path):
+    input_path = tmp_path / "qa.jsonl"
+    write_qa_data(input_path, num_examples=5)
+    for name, continuous_batching in [("static", False), ("continuous", True)]:
+        generate_responses(
+            QATask(),
+            HFBackend(str(tiny_model_path), device="cpu"),
+            input_path,
+            tmp_path / f"{name}.jsonl",
+            batch_size=2,
+            max_new_tokens=6,
+            stop_patterns=[r"^.{3}"],
+            continuous_batching=continuous_batching,
+        )
+    assert read_jsonl(tmp_path / "continuous.jsonl") == read_jsonl(tmp_path / "static.jsonl")
+    with pytest.raises(ValueError):
+        generate_responses(
+            QATask(),
+            HFBackend(str(tiny_model_path), device="cpu"),
+            input_path,
+            tmp_path / "sampled.jsonl",
+            temperature=0.7,
+            continuous_batching=True,
+        )
+
+
+def test_kv_task_reads_record_files(tmp_path):
+    from lost_in_the_middle.kv_data import (
+        create_kv_record_file,
+        generate_kv_chunk,
+        write_kv_jsonl,
+        write_kv_record_chunk,
+    )
+
+    chunk = generate_kv_chunk(seed=0, chunk_index=0, num_examples=3, num_keys=5)
+    write_kv_jsonl(tmp_path / "kv.jsonl", chunk)
+    create_kv_record_file(tmp_path / "kv.npy", num_examples=3, num_keys=5)
+    write_kv_record_chunk(tmp_path / "kv.npy", 0, chunk)
+    task = KVTask(gold_index=2)
+    assert task.load_examples(tmp_path / "kv.npy") == task.load_examples(tmp_path / "kv.jsonl")
+
+
+def test_kv_stop_patterns_skip_the_key():
+    key, value = "9f1c2a3b-0000-4000-8000-000000000001", "77b0d4e5-0000-4000-8000-000000000002"
+    example = TaskExample(input_example={"key": key, "value": value}, prompt="", context=None)
+    stop_patterns = compile_stop_patterns(KVTask(gold_index=0).get_stop_patterns(example))
+    # Models often repeat the key before the value.
+    response = f' The value corresponding to the key "{key}" is "{value}". The next key is "{key}".'
+    assert truncate_at_stop(response, stop_patterns) == f' The value corresponding to the key "{key}" is "{value}"'
+    assert truncate_at_stop(f' "{value}",\n  "{key}"', stop_patterns) == f' "{value}"'
+    # Only the exact key is skipped, not other keys that start with it.
+    assert truncate_at_stop(f' "{key}0" and "{value}"', stop_patterns) == f' "{key}0"'
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+import importlib.util
+import json
+import pathlib
+import subprocess
+import sys
+
+from xopen import xopen
+
+SCRIPTS_DIR = pathlib.Path(__file__).resolve().parent.parent / "scripts"
+
+spec = importlib.util.spec_from_file_location("evaluate_all_qa_responses", SCRIPTS_DIR / "evaluate_all_qa_responses.py")
+evaluate_all_qa_responses = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(evaluate_all_qa_responses)
+
+
+def write_predictions(path, model_answers, new_gold_indices=None):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with xopen(path, "w") as f:
+        for index, model_answer in enumerate(model_answers):
+            example = {"question": f"who {index}?", "answers": ["Paris"], "model_answer": model_answer}
+            if new_gold_indices is not None:
+                example["new_gold_index"] = new_gold_indices[index]
+            f.write(json.dumps(example) + "\n")
+
+
+def test_infer_settings():
+    # Paths follow the naming in EXPERIMENTS.md.
+    infer_settings = evaluate_all_qa_responses.infer_settings
+    assert infer_settings(pathlib.Path("20_total_documents/nq-open-gold_at_4-uf-llama-predictions.jsonl.gz")) == {
+        "setting": "20_total_documents/nq-open-uf-llama-predictions",
+        "num_total_documents": 20,
+        "model": "llama",
+        "unlimiformer": True,
+        "layer": -1,
+    }
+    layer_settings = infer_settings(pathlib.Path("10_total_documents/nq-open-gold_at_0-llama-predictions-16.jsonl"))
+    assert layer_settings["setting"] == "10_total_documents/nq-open-llama-predictions-16"
+    assert (layer_settings["model"], layer_settings["unlimiformer"], layer_settings["layer"]) == ("llama", False, 16)
+    randomized_settings = infer_settings(
+        pathlib.Path("50_total_documents/nq-open-randomized-uf-llama-predictions.jsonl")
+    )
+    assert randomized_settings["setting"] == "50_total_documents/nq-open-randomized-uf-llama-predictions"
+    assert infer_settings(pathlib.Path("closed_book/llama-predictions.jsonl"))["num_total_documents"] == 0
+    assert infer_settings(pathlib.Path("open_oracle/llama-predictions.jsonl"))["num_total_documents"] == 1
+    assert infer_settings(pathlib.Path("llama-predictions.jsonl"))["setting"] == "llama-predictions"
+
+    infer_file_gold_index = evaluate_all_qa_responses.infer_file_gold_index
+    assert infer_file_gold_index("20_total_documents/nq-open-gold_at_19-llama-predictions.jsonl") == 19
+    assert infer_file_gold_index("closed_book/llama-predictions.jsonl") is None
+
+
+def test_evaluate_file_with_cache(tmp_path):
+    evaluate_file_with_cache = evaluate_all_qa_responses.evaluate_file_with_cache
+    cache_dir = tmp_path / "cache"
+    cache_dir.mkdir()
+    # The same predictions at two gold indices have the same content, and differ only in their names.
+    gold_at_0_path = tmp_path / "nq-open-gold_at_0-llama-predictions.jsonl"
+    gold_at_4_path = tmp_path / "nq-open-gold_at_4-llama-predictions.jsonl"
+    for path in [gold_at_0_path, gold_at_4_path]:
+        write_predictions(path, ["Paris", "Lyon\nParis"])
+
+    assert evaluate_file_with_cache(gold_at_0_path, cache_dir) == ([(0, "best_subspan_em", 0.5, 2)], False)
+    assert evaluate_file_with_cache(gold_at_4_path, cache_dir) == ([(4, "best_subspan_em", 0.5, 2)], False)
+    assert evaluate_file_with_cache(gold_at_0_path, cache_dir) == ([(0, "best_subspan_em", 0.5, 2)], True)
+    assert evaluate_file_with_cache(gold_at_4_path, cache_dir) == ([(4, "best_subspan_em", 0.5, 2)], True)
+
+    # Changed predictions are rescored.
+    write_predictions(gold_at_0_path, ["Paris", "Paris"])
+    assert evaluate_file_with_cache(gold_at_0_path, cache_dir) == ([(0, "best_subspan_em", 1.0, 2)], False)
+
+    # Randomized runs are scored per `new_gold_index` of each record.
+    random_path = tmp_path / "nq-open-randomized-llama-predictions.jsonl"
+    write_predictions(random_path, ["Paris", "Lyon", "Paris"], new_gold_indices=[1, 1, 0])
+    assert evaluate_file_with_cache(random_path, cache_dir) == (
+        [(0, "best_subspan_em", 1.0, 1), (1, "best_subspan_em", 0.5, 2)],
+        False,
+    )
+
+
+def test_evaluate_all_qa_responses(tmp_path):
+    input_dir = tmp_path / "qa_predictions"
+    for gold_index, model_answers in [(0, ["Paris", "Paris"]), (4, ["Paris", "Lyon"])]:
+        write_predictions(
+            input_dir / "5_total_documents" / f"nq-open-gold_at_{gold_index}-llama-predictions.jsonl", model_answers
+        )
+    # Outputs of the evaluation scripts are skipped.
+    write_predictions(input_dir / "5_total_documents" / "nq-open-gold_at_0-llama-predictions-scored.jsonl", ["Lyon"])
+    output_path = tmp_path / "position_curves.tsv"
+    command = [
+        sys.executable,
+        str(SCRIPTS_DIR / "evaluate_all_qa_responses.py"),
+        "--input-dir",
+        str(input_dir),
+        "--output-path",
+        str(output_path),
+        "--num-workers",
+        "1",
+    ]
+    for _ in range(2):
+        # The second run loads every result from the cache.
+        subprocess.run(command, check=True)
+        with open(output_path) as f:
+            header, *lines = [line.rstrip("\n").split("\t") for line in f]
+        rows = [dict(zip(header, line)) for line in lines]
+        assert [(row["setting"], row["gold_index"], float(row["value"])) for row in rows] == [
+            ("5_total_documents/nq-open-llama-predictions", "0", 1.0),
+            ("5_total_documents/nq-open-llama-predictions", "4", 0.5),
+        ]
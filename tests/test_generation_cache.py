@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+import pytest
+
+from lost_in_the_middle.generation_cache import GenerationCache, get_generation_key
+
+
+def test_get_generation_key():
+    model = {"model": "m", "revision": "abc", "precision": "float32"}
+    decoding = {"temperature": 0.0, "top_p": 1.0, "max_new_tokens": 100}
+    key = get_generation_key(model, "prompt", decoding)
+    assert key == get_generation_key(dict(reversed(model.items())), "prompt", decoding)
+    assert key != get_generation_key(model, "prompt ", decoding)
+    assert key != get_generation_key({**model, "revision": "def"}, "prompt", decoding)
+    assert key != get_generation_key(model, "prompt", {**decoding, "max_new_tokens": 50})
+
+
+def test_generation_cache_evicts_least_recently_used(tmp_path):
+    path = tmp_path / "cache.sqlite"
+    with GenerationCache(path, max_entries=3) as cache:
+        cache.put_many({"a": "A", "b": "B", "c": "C"})
+        assert cache.get_many(["a", "x", "a"]) == {"a": "A"}
+        cache.put_many({"d": "D"})
+        assert len(cache) == 3
+        assert cache.num_evictions == 1
+        assert set(cache.get_many(["a", "b", "c", "d"])) in ({"a", "c", "d"}, {"a", "b", "d"})
+        assert (cache.num_hits, cache.num_misses) == (4, 2)
+        assert "4 hits, 2 misses" in cache.format_stats()
+
+    # Responses persist across runs.
+    with GenerationCache(path) as cache:
+        assert cache.get_many(["a", "d"]) == {"a": "A", "d": "D"}
+
+    with pytest.raises(ValueError):
+        GenerationCache(path, max_entries=0)
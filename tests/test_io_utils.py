@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import json
+
+import pytest
+from xopen import xopen
+
+from lost_in_the_middle.io_utils import (
+    BackgroundWriter,
+    CheckpointedOutput,
+    get_example_keys,
+)
+
+
+def test_background_writer(tmp_path):
+    output_path = tmp_path / "output.jsonl.gz"
+    lines = [f"line {i}\n" for i in range(10000)]
+    with BackgroundWriter(output_path, max_queue_size=16) as writer:
+        for line in lines:
+            writer.write(line)
+    with xopen(output_path) as fin:
+        assert fin.readlines() == lines
+
+    with pytest.raises(ValueError):
+        writer.write("after close\n")
+
+
+def test_background_writer_propagates_errors(tmp_path):
+    writer = BackgroundWriter(tmp_path / "missing_directory" / "output.jsonl", max_queue_size=1)
+    with pytest.raises(OSError):
+        for i in range(100):
+            writer.write(f"line {i}\n")
+        writer.close()
+
+
+def test_get_example_keys():
+    examples = [{"question": "a", "answers": ["x"]}, {"answers": ["x"], "question": "a"}, {"question": "b"}]
+    keys = get_example_keys(examples)
+    # Keys don't depend on the order of fields, and repeated examples get distinct keys.
+    assert len(set(keys)) == 3
+    assert keys[0].split("-")[0] == keys[1].split("-")[0]
+    assert get_example_keys(examples[::-1])[0] == keys[2]
+
+
+def test_checkpointed_output_resumes(tmp_path):
+    output_path = tmp_path / "responses.jsonl.gz"
+    records = [{"index": index, "model_answer": f"answer {index}"} for index in range(6)]
+    keys = get_example_keys(records)
+    metadata = {"model": "tiny", "temperature": 0.0}
+
+    checkpoint = CheckpointedOutput(output_path, metadata=metadata)
+    checkpoint.write_batch([keys[4], keys[1]], [records[4], records[1]])
+    checkpoint.close()
+    # Simulate a crash while writing a record.
+    with open(checkpoint.partial_path, "ab") as f:
+        f.write(b'{"example_key": "')
+    assert not output_path.exists()
+
+    with pytest.raises(ValueError):
+        CheckpointedOutput(output_path, metadata=metadata)
+    with pytest.raises(ValueError):
+        CheckpointedOutput(output_path, resume=True, metadata={"model": "other", "temperature": 0.0})
+
+    checkpoint = CheckpointedOutput(output_path, resume=True, metadata=metadata)
+    assert len(checkpoint) == 2
+    assert [key in checkpoint for key in keys] == [False, True, False, False, True, False]
+    with pytest.raises(ValueError):
+        checkpoint.finalize(keys)
+    checkpoint.close()
+    checkpoint = CheckpointedOutput(output_path, resume=True, metadata=metadata)
+    checkpoint.write_batch([keys[5], keys[0], keys[3], keys[2]], [records[5], records[0], records[3], records[2]])
+    checkpoint.finalize(keys)
+
+    with xopen(output_path) as fin:
+        assert [json.loads(line) for line in fin] == records
+    assert not (tmp_path / "responses.jsonl.gz.partial").exists()
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["responses.jsonl.gz"]
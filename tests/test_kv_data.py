@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+import json
+import os
+import pathlib
+import subprocess
+import sys
+import uuid
+
+import numpy as np
+from xopen import xopen
+
+from lost_in_the_middle.kv_data import (
+    EXAMPLES_PER_CHUNK,
+    KVRecordFile,
+    create_kv_record_file,
+    format_uuids,
+    generate_kv_chunk,
+    get_kv_examples,
+    iter_kv_examples,
+    write_kv_jsonl,
+    write_kv_record_chunk,
+)
+
+SCRIPTS_DIR = pathlib.Path(__file__).resolve().parent.parent / "scripts"
+
+
+def test_generate_kv_chunk():
+    chunk = generate_kv_chunk(seed=0, chunk_index=3, num_examples=5, num_keys=10)
+    assert chunk["records"].shape == (5, 10, 2, 16)
+    assert np.array_equal(chunk, generate_kv_chunk(seed=0, chunk_index=3, num_examples=5, num_keys=10))
+    assert not np.array_equal(chunk, generate_kv_chunk(seed=1, chunk_index=3, num_examples=5, num_keys=10))
+
+    uuids = format_uuids(chunk["records"])
+    assert uuids.shape == (5, 10, 2)
+    for uuid_bytes, formatted in zip(chunk["records"].reshape(-1, 16), uuids.ravel()):
+        assert formatted == str(uuid.UUID(bytes=uuid_bytes.tobytes()))
+        assert uuid.UUID(formatted).version == 4
+
+    for example, gold_index in zip(get_kv_examples(chunk), chunk["gold_index"]):
+        assert len(example["ordered_kv_records"]) == 10
+        assert example["ordered_kv_records"][gold_index] == [example["key"], example["value"]]
+
+
+def test_kv_record_file_matches_jsonl(tmp_path):
+    chunks = [generate_kv_chunk(0, chunk_index, 3, num_keys=4) for chunk_index in range(2)]
+    create_kv_record_file(tmp_path / "kv.npy", num_examples=6, num_keys=4)
+    for chunk_index, chunk in enumerate(chunks):
+        write_kv_record_chunk(tmp_path / "kv.npy", 3 * chunk_index, chunk)
+    write_kv_jsonl(tmp_path / "kv.jsonl.gz", np.concatenate(chunks))
+
+    record_file = KVRecordFile(tmp_path / "kv.npy")
+    assert (len(record_file), record_file.num_keys) == (6, 4)
+    examples = list(iter_kv_examples(tmp_path / "kv.jsonl.gz"))
+    assert list(iter_kv_examples(tmp_path / "kv.npy")) == examples
+    assert record_file[4] == examples[4]
+    assert list(iter_kv_examples(tmp_path / "kv.npy", shard_index=1, num_shards=4)) == examples[1::4]
+    assert list(iter_kv_examples(tmp_path / "kv.jsonl.gz", shard_index=1, num_shards=4)) == examples[1::4]
+
+
+def test_make_kv_retrieval_data_doesnt_depend_on_num_workers(tmp_path):
+    env = {**os.environ, "PYTHONPATH": str(pathlib.Path(__file__).resolve().parent.parent / "src")}
+    num_examples = EXAMPLES_PER_CHUNK + 5
+    for name, num_workers in [("kv.jsonl.gz", 1), ("kv-parallel.jsonl.gz", 2), ("kv.npy", 2)]:
+        subprocess.run(
+            [sys.executable, str(SCRIPTS_DIR / "make_kv_retrieval_data.py"), "--num-keys", "3"]
+            + ["--num-examples", str(num_examples), "--num-workers", str(num_workers)]
+            + ["--output-path", str(tmp_path / name)],
+            env=env,
+            check=True,
+        )
+    with xopen(tmp_path / "kv.jsonl.gz") as fin:
+        examples = [json.loads(line) for line in fin]
+    assert len(examples) == num_examples
+    assert list(iter_kv_examples(tmp_path / "kv-parallel.jsonl.gz")) == examples
+    assert list(iter_kv_examples(tmp_path / "kv.npy")) == examples
+    assert sorted(os.listdir(tmp_path)) == ["kv-parallel.jsonl.gz", "kv.jsonl.gz", "kv.npy"]
@@ -0,0 +1,110 @@
+#!/usr/bin/env python3
+import random
+import string
+
+import pytest
+import regex
+
+from lost_in_the_middle.metrics import (
+    AnswerMatcher,
+    ahocorasick,
+    best_subspan_em,
+    best_subspan_em_batch,
+    normalize_answer,
+)
+
+PREDICTIONS = [
+    "The first Nobel Prize in Physics was awarded to Wilhelm Conrad Röntgen.",
+    "  Based on the documents, it was Henri Becquerel!",
+    "an apple a day, keeps THE doctor away",
+    "",
+    "Thé answer is: 42 (forty-two)",
+]
+GROUND_TRUTHS = [
+    ["Wilhelm Conrad Röntgen"],
+    ["Marie Curie", "Pierre Curie"],
+    ["the Doctor"],
+    ["anything"],
+    ["forty two", "42"],
+]
+
+
+def reference_normalize_answer(s):
+    def remove_articles(text):
+        return regex.sub(r"\b(a|an|the)\b", " ", text)
+
+    def white_space_fix(text):
+        return " ".join(text.split())
+
+    def remove_punc(text):
+        exclude = set(string.punctuation)
+        return "".join(ch for ch in text if ch not in exclude)
+
+    return white_space_fix(remove_articles(remove_punc(s.lower())))
+
+
+@pytest.mark.parametrize("text", PREDICTIONS + [answer for answers in GROUND_TRUTHS for answer in answers])
+def test_normalize_answer(text):
+    assert normalize_answer(text) == reference_normalize_answer(text)
+
+
+def test_best_subspan_em():
+    assert [best_subspan_em(prediction, answers) for prediction, answers in zip(PREDICTIONS, GROUND_TRUTHS)] == [
+        1.0,
+        0.0,
+        1.0,
+        0.0,
+        1.0,
+    ]
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_best_subspan_em_batch(num_workers):
+    predictions = PREDICTIONS * 5
+    ground_truths = GROUND_TRUTHS * 5
+    scores = best_subspan_em_batch(predictions, ground_truths, num_workers=num_workers, chunk_size=3)
+    assert scores == [best_subspan_em(prediction, answers) for prediction, answers in zip(predictions, ground_truths)]
+
+    with pytest.raises(ValueError):
+        best_subspan_em_batch(predictions, ground_truths[:-1])
+
+
+MATCHER_BACKENDS = [
+    pytest.param(False, id="python"),
+    pytest.param(
+        True,
+        id="pyahocorasick",
+        marks=pytest.mark.skipif(ahocorasick is None, reason="pyahocorasick is not installed"),
+    ),
+]
+
+
+@pytest.mark.parametrize("use_pyahocorasick", MATCHER_BACKENDS)
+def test_answer_matcher(use_pyahocorasick):
+    kwargs = {"use_pyahocorasick": use_pyahocorasick}
+    for prediction, answers in zip(PREDICTIONS, GROUND_TRUTHS):
+        matcher = AnswerMatcher.from_answers(answers, **kwargs)
+        assert matcher.best_subspan_em(prediction) == best_subspan_em(prediction, answers)
+
+    matcher = AnswerMatcher.from_ground_truths(GROUND_TRUTHS, **kwargs)
+    for key, (prediction, answers) in enumerate(zip(PREDICTIONS, GROUND_TRUTHS)):
+        assert matcher.best_subspan_em(prediction, key=key) == best_subspan_em(prediction, answers)
+    # Only the answers under the requested key are considered.
+    assert matcher.best_subspan_em(PREDICTIONS[0], key=4) == 0.0
+    assert matcher.best_subspan_em(PREDICTIONS[0]) == 1.0
+
+    # Empty normalized answers are contained in every prediction.
+    assert AnswerMatcher.from_answers(["the", "unrelated"], **kwargs).best_subspan_em("no match here") == 1.0
+    matcher = AnswerMatcher.from_ground_truths([["the"], ["unrelated"]], **kwargs)
+    assert matcher.best_subspan_em("no match here", key=1) == 0.0
+
+
+@pytest.mark.parametrize("use_pyahocorasick", MATCHER_BACKENDS)
+def test_answer_matcher_matches_best_subspan_em_on_random_strings(use_pyahocorasick):
+    rng = random.Random(0)
+    alphabet = "ab c"
+    for _ in range(500):
+        answers = ["".join(rng.choices(alphabet, k=rng.randint(1, 4))) for _ in range(rng.randint(1, 6))]
+        prediction = "".join(rng.choices(alphabet, k=rng.randint(0, 30)))
+        matcher = AnswerMatcher.from_answers(answers, use_pyahocorasick=use_pyahocorasick)
+        assert matcher.best_subspan_em(prediction) == best_subspan_em(prediction, answers)
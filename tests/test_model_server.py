@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+import json
+import threading
+import time
+
+import pytest
+from xopen import xopen
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from lost_in_the_middle.engine import (  # noqa: E402
+    HFBackend,
+    KVTask,
+    PromptTask,
+    generate_responses,
+)
+from lost_in_the_middle.model_client import send_request  # noqa: E402
+from lost_in_the_middle.model_server import ModelServer  # noqa: E402
+
+
+def write_kv_data(path, num_examples=3):
+    with xopen(path, "w") as f:
+        for index in range(num_examples):
+            records = [[f"key-{index}-{record_index}", f"value-{record_index}"] for record_index in range(4)]
+            key, value = records[2]
+            f.write(json.dumps({"ordered_kv_records": records, "key": key, "value": value}) + "\n")
+
+
+def read_jsonl(path):
+    with xopen(path) as fin:
+        return [json.loads(line) for line in fin]
+
+
+@pytest.fixture
+def server(tmp_path, tiny_model_path):
+    backend = HFBackend(str(tiny_model_path), device="cpu")
+    load = backend.load
+    backend.num_loads = 0
+
+    def counting_load():
+        backend.num_loads += 1
+        return load()
+
+    backend.load = counting_load
+    server = ModelServer(backend, tmp_path / "server.sock")
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    server.ready.wait()
+    yield server
+    server.request_shutdown()
+    thread.join()
+
+
+def test_model_server_runs_queued_jobs_with_one_model(tmp_path, tiny_model_path, server):
+    input_path = tmp_path / "kv.jsonl"
+    write_kv_data(input_path)
+    generation_kwargs = {"max_new_tokens": 4}
+    replies = {}
+
+    def send(name, request):
+        replies[name] = send_request(server.socket_path, request)
+
+    # Concurrent jobs are queued, and run one after the other with the same model.
+    threads = [
+        threading.Thread(
+            target=send,
+            args=(
+                "kv",
+                {
+                    "type": "responses",
+                    "task": "kv",
+                    "input_path": str(input_path),
+                    "output_path": str(tmp_path / "kv-{gold_index}.jsonl"),
+                    "gold_indices": [0, 3],
+                    "generation_kwargs": generation_kwargs,
+                },
+            ),
+        ),
+        threading.Thread(
+            target=send,
+            args=(
+                "prompts",
+                {"type": "prompts", "prompts": ["Question: who?", "who"], "generation_kwargs": generation_kwargs},
+            ),
+        ),
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert replies["kv"]["status"] == "ok"
+    assert replies["kv"]["output_paths"] == [str(tmp_path / "kv-0.jsonl"), str(tmp_path / "kv-3.jsonl")]
+    assert replies["prompts"]["status"] == "ok"
+    assert server.backend.backend.num_loads == 1
+
+    for gold_index in [0, 3]:
+        generate_responses(
+            KVTask(gold_index=gold_index),
+            HFBackend(str(tiny_model_path), device="cpu"),
+            input_path,
+            tmp_path / f"expected-{gold_index}.jsonl",
+            **generation_kwargs,
+        )
+        assert read_jsonl(tmp_path / f"kv-{gold_index}.jsonl") == read_jsonl(tmp_path / f"expected-{gold_index}.jsonl")
+    with xopen(tmp_path / "prompts.jsonl", "w") as f:
+        f.write(json.dumps({"prompt": "Question: who?"}) + "\n" + json.dumps({"prompt": "who"}) + "\n")
+    generate_responses(
+        PromptTask(),
+        HFBackend(str(tiny_model_path), device="cpu"),
+        tmp_path / "prompts.jsonl",
+        tmp_path / "expected-prompts.jsonl",
+        **generation_kwargs,
+    )
+    expected_responses = [example["model_answer"] for example in read_jsonl(tmp_path / "expected-prompts.jsonl")]
+    assert replies["prompts"]["responses"] == expected_responses
+
+    status = send_request(server.socket_path, {"type": "status"})
+    assert (status["num_finished_jobs"], status["num_failed_jobs"], status["num_queued_jobs"]) == (2, 0, 0)
+
+
+def test_model_server_reports_failed_jobs_and_shuts_down(tmp_path, server):
+    reply = send_request(
+        server.socket_path,
+        {
+            "type": "responses",
+            "task": "kv",
+            "input_path": str(tmp_path / "missing.jsonl"),
+            "output_path": str(tmp_path / "missing-predictions.jsonl"),
+            "gold_indices": [0],
+        },
+    )
+    assert reply["status"] == "error" and "missing.jsonl" in reply["error"]
+    reply = send_request(
+        server.socket_path, {"type": "prompts", "prompts": ["who"], "generation_kwargs": {"model": "x"}}
+    )
+    assert reply["status"] == "error" and "model" in reply["error"]
+    assert send_request(server.socket_path, {"type": "status"})["num_failed_jobs"] == 2
+
+    assert send_request(server.socket_path, {"type": "shutdown"}) == {"status": "ok"}
+    # The server stops, and removes its socket.
+    for _ in range(500):
+        if not (tmp_path / "server.sock").exists():
+            break
+        time.sleep(0.01)
+    assert not (tmp_path / "server.sock").exists()
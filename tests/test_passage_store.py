@@ -0,0 +1,56 @@
+#!/usr/bin/env python3
+import pytest
+
+from lost_in_the_middle.passage_store import (
+    PassageStore,
+    get_passage_id,
+    resolve_passages,
+    store_passages,
+)
+from lost_in_the_middle.prompting import DocumentBatch
+
+
+def test_passage_store(tmp_path):
+    path = tmp_path / "passages.sqlite"
+    with PassageStore(path) as passage_store:
+        passage_id = passage_store.add("Title", "Some text.")
+        # Adding the same passage again is a no-op.
+        assert passage_store.add("Title", "Some text.") == passage_id
+        assert passage_store.add("Title", "Other text.") != passage_id
+        # Pending passages are readable before they're flushed.
+        assert passage_store.get(passage_id) == ("Title", "Some text.")
+        assert len(passage_store) == 2
+
+    with PassageStore(path, readonly=True) as passage_store:
+        assert passage_store.get(get_passage_id("Title", "Some text.")) == ("Title", "Some text.")
+        with pytest.raises(KeyError):
+            passage_store.get(get_passage_id("Title", "Missing text."))
+        with pytest.raises(ValueError):
+            passage_store.add("Title", "Some text.")
+
+    with pytest.raises(ValueError):
+        PassageStore(tmp_path / "missing.sqlite", readonly=True)
+
+
+def test_passage_store_get_many_in_chunks(tmp_path):
+    with PassageStore(tmp_path / "passages.sqlite") as passage_store:
+        passage_ids = [passage_store.add(f"Title {i}", f"Text {i}") for i in range(2000)]
+    with PassageStore(tmp_path / "passages.sqlite", readonly=True) as passage_store:
+        passages = passage_store.get_many(passage_ids)
+    assert [passages[passage_id] for passage_id in passage_ids] == [(f"Title {i}", f"Text {i}") for i in range(2000)]
+
+
+def test_store_and_resolve_passages(tmp_path):
+    ctxs = [
+        {"id": "1", "title": "Title 1", "text": "Text 1", "score": "1.0", "hasanswer": False, "isgold": False},
+        {"title": "Gold", "text": "Gold text", "hasanswer": True, "isgold": True},
+    ]
+    with PassageStore(tmp_path / "passages.sqlite") as passage_store:
+        referenced_ctxs = store_passages(ctxs, passage_store)
+        assert all("title" not in ctx and "text" not in ctx for ctx in referenced_ctxs)
+        assert resolve_passages(referenced_ctxs, passage_store) == ctxs
+
+        expected_documents = DocumentBatch.from_dicts(ctxs, validate=True)
+        for validate in (False, True):
+            documents = DocumentBatch.from_dicts(referenced_ctxs, validate=validate, passage_store=passage_store)
+            assert documents.to_dicts() == expected_documents.to_dicts()
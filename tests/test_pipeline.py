@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+import random
+import threading
+import time
+
+import pytest
+
+from lost_in_the_middle.pipeline import OrderedWorkers, StageTimes, prefetch
+
+
+def test_prefetch():
+    thread_names = set()
+
+    def square(x):
+        thread_names.add(threading.current_thread().name)
+        return x * x
+
+    assert list(prefetch(square, range(10), max_prefetch=2)) == [x * x for x in range(10)]
+    assert thread_names == {"prefetch"}
+
+    def fail_at_3(x):
+        if x == 3:
+            raise RuntimeError("failed")
+        return x
+
+    results = []
+    with pytest.raises(RuntimeError):
+        for result in prefetch(fail_at_3, range(10)):
+            results.append(result)
+    assert results == [0, 1, 2]
+
+    # Stopping early doesn't hang.
+    for result in prefetch(square, range(1000)):
+        if result > 10:
+            break
+
+
+def test_ordered_workers():
+    rng = random.Random(0)
+    delays = [rng.random() * 0.01 for _ in range(50)]
+    written = []
+
+    def process(index):
+        time.sleep(delays[index])
+        return index
+
+    with OrderedWorkers(process, written.append, num_workers=4, max_pending=8) as workers:
+        for index in range(50):
+            workers.submit(index)
+    assert written == list(range(50))
+
+    def fail(index):
+        raise ValueError(f"failed on {index}")
+
+    with pytest.raises(ValueError):
+        with OrderedWorkers(fail, written.append, num_workers=2, max_pending=2) as workers:
+            for index in range(10):
+                workers.submit(index)
+
+
+def test_stage_times():
+    stage_times = StageTimes()
+    with stage_times.time("generate"):
+        time.sleep(0.01)
+    stage_times.add("decode", 0.5)
+    assert stage_times.seconds["generate"] >= 0.01
+    assert stage_times.seconds["decode"] == 0.5
+    assert "generate" in stage_times.format_report()
@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from lost_in_the_middle.prefix_cache import (  # noqa: E402
+    SharedPrefixCache,
+    get_shared_prefix,
+)
+
+
+def test_get_shared_prefix():
+    assert get_shared_prefix([[1, 2, 3, 4], [1, 2, 3, 5, 6], [1, 2, 3, 4, 7]]) == [1, 2, 3]
+    # At least one token of each prompt is left after the prefix.
+    assert get_shared_prefix([[1, 2, 3], [1, 2, 3, 4]]) == [1, 2]
+    assert get_shared_prefix([[1, 2], [3, 4]]) == []
+    assert get_shared_prefix([]) == []
+
+
+def test_shared_prefix_cache_matches_left_padding(tiny_llama):
+    model = tiny_llama
+    prefix = [1, 5, 6, 7, 8, 9, 10]
+    batch_input_ids = [prefix + suffix for suffix in [[11, 12, 13], [14, 15, 16, 17, 18, 19], [20]]]
+
+    max_length = max(len(prompt_input_ids) for prompt_input_ids in batch_input_ids)
+    input_ids = torch.tensor(
+        [[0] * (max_length - len(prompt_input_ids)) + prompt_input_ids for prompt_input_ids in batch_input_ids]
+    )
+    expected_outputs = model.generate(
+        input_ids=input_ids, attention_mask=(input_ids != 0).long(), max_new_tokens=10, do_sample=False
+    )
+
+    prefix_cache = SharedPrefixCache(model, get_shared_prefix(batch_input_ids))
+    assert len(prefix_cache) == len(prefix)
+    # The cache is reused (and not modified) across batches.
+    for _ in range(2):
+        inputs = prefix_cache.prepare_inputs(batch_input_ids, pad_token_id=0)
+        outputs = model.generate(**inputs, max_new_tokens=10, do_sample=False)
+        assert outputs[:, inputs["input_ids"].shape[1] :].tolist() == expected_outputs[:, input_ids.shape[1] :].tolist()
+        assert prefix_cache.past_key_values.get_seq_length() == len(prefix)
+
+    with pytest.raises(ValueError):
+        prefix_cache.prepare_inputs([[1, 2, 3]], pad_token_id=0)
+    with pytest.raises(ValueError):
+        prefix_cache.prepare_inputs([prefix], pad_token_id=0)
@@ -1,11 +1,23 @@
 #!/usr/bin/env python3
+import dataclasses
+
 import pytest
 
 from lost_in_the_middle.prompting import (
+    PROMPTS_ROOT,
     Document,
+    DocumentBatch,
+    KVRecords,
+    PromptTemplate,
+    TokenCounter,
     get_closedbook_qa_prompt,
     get_kv_retrieval_prompt,
+    get_prompt_template,
     get_qa_prompt,
+    pack_qa_prompt,
+    render_closedbook_qa_prompts,
+    render_kv_prompts,
+    render_qa_prompts,
 )
 
 
@@ -159,3 +171,219 @@ def test_get_kv_retrieval_prompt_with_query_aware_contextualization():
         ]
     )
     assert prompt == gold
+
+
+@pytest.mark.parametrize("prompt_path", sorted(PROMPTS_ROOT.glob("*.prompt")), ids=lambda path: path.name)
+def test_prompt_template_matches_str_format(prompt_path):
+    template_text = prompt_path.read_text().rstrip("\n")
+    values = {
+        "question": "test {question}",
+        "search_results": "Document [1](Title: a) {b}",
+        "formatted_kv_records": '{"k": "v"}',
+        "key": "k",
+    }
+    prompt_template = get_prompt_template(prompt_path.name)
+    assert prompt_template.render(**values) == template_text.format(**values)
+    assert get_prompt_template(prompt_path.name) is prompt_template
+
+
+def test_prompt_template_escaped_braces_and_adjacent_fields():
+    template_text = "{{literal}} {a}{b}\n{a}"
+    assert PromptTemplate(template_text).render(a=1, b="x") == template_text.format(a=1, b="x")
+    assert PromptTemplate("").render() == ""
+    with pytest.raises(ValueError):
+        PromptTemplate("{a!r}")
+
+
+def test_render_qa_prompts_matches_get_qa_prompt():
+    questions = ["first question", "second question"]
+    documents_batches = [
+        [Document(title="first doc", text="first doc text"), Document(title="second doc", text="second doc text")],
+        [Document(title="third doc", text="third doc text")],
+    ]
+    for mention_random_ordering, query_aware_contextualization in [(False, False), (True, False), (False, True)]:
+        prompts = render_qa_prompts(
+            questions,
+            documents_batches,
+            mention_random_ordering=mention_random_ordering,
+            query_aware_contextualization=query_aware_contextualization,
+        )
+        assert prompts == [
+            get_qa_prompt(
+                question,
+                documents,
+                mention_random_ordering=mention_random_ordering,
+                query_aware_contextualization=query_aware_contextualization,
+            )
+            for question, documents in zip(questions, documents_batches)
+        ]
+
+    with pytest.raises(ValueError):
+        render_qa_prompts(questions, documents_batches[:1])
+    with pytest.raises(ValueError):
+        render_qa_prompts(["question", ""], documents_batches)
+
+
+def test_render_closedbook_qa_prompts():
+    questions = ["first question", "second question"]
+    assert render_closedbook_qa_prompts(questions) == [get_closedbook_qa_prompt(question) for question in questions]
+
+
+def test_render_kv_prompts_matches_get_kv_retrieval_prompt():
+    data_batches = [
+        [("test key1", "test value1"), ("test key2", "test value2"), ("test key3", "test value3")],
+        [("test key4", "test value4"), ("test key5", "test value5")],
+    ]
+    keys = ["test key2", "test key4"]
+    for query_aware_contextualization in [False, True]:
+        prompts = render_kv_prompts(data_batches, keys, query_aware_contextualization=query_aware_contextualization)
+        assert prompts == [
+            get_kv_retrieval_prompt(data, key, query_aware_contextualization=query_aware_contextualization)
+            for data, key in zip(data_batches, keys)
+        ]
+
+    with pytest.raises(ValueError):
+        render_kv_prompts(data_batches, ["test key5", "test key4"])
+
+
+def test_kv_records_move_key():
+    data = [[f"key{index}", f"value{index}"] for index in range(5)]
+    for key_index in range(5):
+        kv_records = KVRecords(data, f"key{key_index}")
+        for gold_index in range(5):
+            moved_data = list(data)
+            moved_data.insert(gold_index, moved_data.pop(key_index))
+            assert kv_records.move_key(data, gold_index) == moved_data
+            for query_aware_contextualization in [False, True]:
+                assert kv_records.render_prompt(
+                    gold_index=gold_index, query_aware_contextualization=query_aware_contextualization
+                ) == get_kv_retrieval_prompt(
+                    moved_data, f"key{key_index}", query_aware_contextualization=query_aware_contextualization
+                )
+    assert kv_records.render_prompt() == get_kv_retrieval_prompt(data, "key4")
+
+    with pytest.raises(ValueError):
+        kv_records.move_key(data, 5)
+    with pytest.raises(ValueError):
+        KVRecords(data, "key5")
+    with pytest.raises(ValueError):
+        KVRecords(data + [["key0", "value5"]], "key1")
+    with pytest.raises(ValueError):
+        KVRecords(data[:1], "key0")
+
+
+def test_document_batch_from_dicts():
+    documents_data = [
+        {
+            "id": "9459602",
+            "title": "Science and technology in Germany",
+            "text": "some text here",
+            "score": "0.97236913",
+            "hasanswer": False,
+            "original_retrieval_index": 65,
+            "isgold": False,
+        },
+        {"title": "gold title", "text": "gold text", "hasanswer": True, "isgold": True},
+    ]
+    documents = [Document.from_dict(document_data) for document_data in documents_data]
+    for validate in [False, True]:
+        document_batch = DocumentBatch.from_dicts(documents_data, validate=validate)
+        assert len(document_batch) == 2
+        assert document_batch.to_documents() == documents
+        assert document_batch.to_dicts() == [dataclasses.asdict(document) for document in documents]
+
+    document_batch = DocumentBatch.from_dicts(documents_data)
+    assert document_batch.take([1, 0]).to_documents() == documents[::-1]
+    assert document_batch.isgolds == [False, True]
+    assert not DocumentBatch.from_dicts([])
+
+    # Only the validated path rejects malformed documents.
+    malformed_documents_data = [dict(documents_data[0], title=1)]
+    DocumentBatch.from_dicts(malformed_documents_data)
+    with pytest.raises(ValueError):
+        DocumentBatch.from_dicts(malformed_documents_data, validate=True)
+
+
+def test_get_qa_prompt_with_document_batch():
+    documents = [
+        Document(title="first doc", text="first doc text"),
+        Document(title="second doc", text="second doc text"),
+    ]
+    for mention_random_ordering, query_aware_contextualization in [(False, False), (True, False), (False, True)]:
+        assert get_qa_prompt(
+            "test question",
+            DocumentBatch.from_documents(documents),
+            mention_random_ordering=mention_random_ordering,
+            query_aware_contextualization=query_aware_contextualization,
+        ) == get_qa_prompt(
+            "test question",
+            documents,
+            mention_random_ordering=mention_random_ordering,
+            query_aware_contextualization=query_aware_contextualization,
+        )
+    with pytest.raises(ValueError):
+        get_qa_prompt(
+            "test question",
+            DocumentBatch.from_documents([]),
+            mention_random_ordering=False,
+            query_aware_contextualization=False,
+        )
+
+
+@pytest.mark.parametrize("trim_documents", [False, True])
+def test_pack_qa_prompt(trim_documents, bpe_tokenizer):
+    tokenizer = bpe_tokenizer
+    token_counter = TokenCounter(tokenizer)
+    words = ["alpha", "beta", "gamma", "delta", "epsilon"]
+    documents = DocumentBatch(
+        titles=[f"Title {index}" for index in range(20)],
+        texts=[" ".join(words[(index + offset) % 5] for offset in range(10 + index)) for index in range(20)],
+        isgolds=[index == 10 for index in range(20)],
+    )
+    full_prompt = get_qa_prompt("who?", documents, mention_random_ordering=False, query_aware_contextualization=False)
+    num_full_prompt_tokens = len(tokenizer(full_prompt)["input_ids"])
+
+    # Everything fits, so the prompt is unchanged.
+    packed_prompt = pack_qa_prompt("who?", documents, token_counter, num_full_prompt_tokens)
+    assert packed_prompt.prompt == full_prompt
+    assert packed_prompt.num_dropped_documents == 0
+    assert packed_prompt.gold_index == 10
+
+    for max_prompt_tokens in [num_full_prompt_tokens // 2, num_full_prompt_tokens // 4]:
+        packed_prompt = pack_qa_prompt(
+            "who?", documents, token_counter, max_prompt_tokens, trim_documents=trim_documents
+        )
+        input_ids = tokenizer(packed_prompt.prompt)["input_ids"]
+        assert len(input_ids) == packed_prompt.num_prompt_tokens <= max_prompt_tokens
+        assert packed_prompt.num_dropped_documents > 0
+        if trim_documents:
+            # Trimming only ever fills budget that dropping whole documents leaves unused.
+            dropped_packed_prompt = pack_qa_prompt("who?", documents, token_counter, max_prompt_tokens)
+            assert packed_prompt.num_prompt_tokens >= dropped_packed_prompt.num_prompt_tokens
+            assert packed_prompt.num_dropped_documents <= dropped_packed_prompt.num_dropped_documents
+        else:
+            assert packed_prompt.num_trimmed_tokens == 0
+        assert packed_prompt.prompt == get_qa_prompt(
+            "who?", packed_prompt.documents, mention_random_ordering=False, query_aware_contextualization=False
+        )
+        # The gold document stays near the middle.
+        num_documents = len(packed_prompt.documents)
+        assert packed_prompt.documents.isgolds[packed_prompt.gold_index]
+        assert packed_prompt.gold_index == round(10 * (num_documents - 1) / 19)
+        # Lower-ranked distractors are dropped (or trimmed) first.
+        distractor_titles = [title for title in packed_prompt.documents.titles if title != "Title 10"]
+        assert distractor_titles == [f"Title {index}" for index in range(20) if index != 10][: len(distractor_titles)]
+        for document_number, ((start, end), title, text) in enumerate(
+            zip(packed_prompt.document_token_spans, packed_prompt.documents.titles, packed_prompt.documents.texts),
+            start=1,
+        ):
+            assert tokenizer.decode(input_ids[start:end]) == f"Document [{document_number}](Title: {title}) {text}"
+    trimmed_packed_prompt = pack_qa_prompt(
+        "who?", documents, token_counter, num_full_prompt_tokens // 2, trim_documents=True
+    )
+    assert trimmed_packed_prompt.num_trimmed_tokens > 0
+    # Documents are only tokenized once.
+    assert token_counter.num_misses < 2 * len(documents) + 5
+
+    with pytest.raises(ValueError):
+        pack_qa_prompt("who?", documents, token_counter, 10)
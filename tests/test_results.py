@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+import math
+
+import numpy as np
+import pytest
+
+from lost_in_the_middle.results import (
+    ResultsTable,
+    get_model_settings,
+    write_results_table,
+)
+
+
+def test_results_table_round_trip(tmp_path):
+    path = tmp_path / "results.npz"
+    columns = {
+        "question": ["first question", "second question", "first question", "Röntgen?"],
+        "gold_index": [0, 4, 4, 0],
+        "model": ["llama", "llama", None, "llama"],
+        "model_answer": ["answer", "", "answer", "another answer"],
+        "metric_best_subspan_em": [1.0, 0.0, 1.0, 0.0],
+        "flag": [True, False, True, True],
+        "temperature": [0.0, None, 0.0, 0.7],
+    }
+    write_results_table(path, columns)
+
+    with ResultsTable(path) as table:
+        assert table.columns == list(columns)
+        assert len(table) == 4
+        assert "question" in table
+        for name in ["question", "model", "model_answer"]:
+            assert table[name] == columns[name]
+        assert table["gold_index"].dtype == np.int64
+        assert table["gold_index"].tolist() == columns["gold_index"]
+        assert table["flag"].dtype == np.bool_
+        assert table["metric_best_subspan_em"].tolist() == columns["metric_best_subspan_em"]
+        assert math.isnan(table["temperature"][1])
+        # Repeated strings share a code in the string table.
+        question_codes = table.codes("question")
+        assert question_codes[0] == question_codes[2]
+        assert table.mean_by("metric_best_subspan_em") == {0: 0.5, 4: 0.5}
+        assert table.mean_by("metric_best_subspan_em", by="model") == {"llama": 1 / 3, None: 1.0}
+        with pytest.raises(KeyError):
+            table["missing"]
+
+
+def test_write_results_table_validation(tmp_path):
+    with pytest.raises(ValueError):
+        write_results_table(tmp_path / "results.npz", {"a": [1, 2], "b": [1]})
+    with pytest.raises(ValueError):
+        write_results_table(tmp_path / "results.npz", {"a": [1, "2"]})
+    with pytest.raises(ValueError):
+        write_results_table(tmp_path / "results.npz", {"__schema__": [1]})
+
+    write_results_table(tmp_path / "empty.npz", {})
+    with ResultsTable(tmp_path / "empty.npz") as table:
+        assert len(table) == 0
+
+
+def test_get_model_settings():
+    example = {
+        "question": "question",
+        "model": "llama",
+        "model_answer": "answer",
+        "model_prompt": "prompt",
+        "model_top_p": 1.0,
+        "model_temperature": 0.0,
+    }
+    assert get_model_settings(example) == '{"model_temperature": 0.0, "model_top_p": 1.0}'
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from lost_in_the_middle.stopping import (  # noqa: E402
+    StopPatternCriteria,
+    StopReport,
+    compile_stop_patterns,
+    find_stop,
+    truncate_at_stop,
+)
+
+
+def test_truncate_at_stop():
+    qa_stop_patterns = compile_stop_patterns([r"\n"])
+    assert truncate_at_stop(" Paris\nQuestion: who?", qa_stop_patterns) == " Paris\n"
+    assert truncate_at_stop(" Paris", qa_stop_patterns) == " Paris"
+
+    kv_stop_patterns = compile_stop_patterns([r'"[^"]*"'])
+    assert find_stop(' "a1b2', kv_stop_patterns) is None
+    assert truncate_at_stop(' "a1b2",\n  "c3d4"', kv_stop_patterns) == ' "a1b2"'
+    # The earliest match of any pattern wins.
+    assert truncate_at_stop(' "a1\nb2"', compile_stop_patterns([r'"[^"]*"', r"\n"])) == ' "a1\n'
+
+
+def test_stop_pattern_criteria(tiny_model_path):
+    tokenizer = transformers.AutoTokenizer.from_pretrained(tiny_model_path)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    model = transformers.AutoModelForCausalLM.from_pretrained(tiny_model_path).eval()
+    inputs = tokenizer(
+        ["Question: who? Answer:", "Document [1](Title: Some title) some text"], return_tensors="pt", padding=True
+    )
+    prompt_length = inputs["input_ids"].shape[1]
+    generate_kwargs = {"max_new_tokens": 12, "do_sample": False, "pad_token_id": tokenizer.pad_token_id}
+    full_outputs = model.generate(**inputs, **generate_kwargs)
+    full_responses = tokenizer.batch_decode(full_outputs[:, prompt_length:], skip_special_tokens=True)
+
+    # Stop at the third character of each response.
+    stop_patterns = compile_stop_patterns([r"^.{3}"])
+    criteria = StopPatternCriteria([stop_patterns, stop_patterns], tokenizer, prompt_length)
+    outputs = model.generate(
+        **inputs, stopping_criteria=transformers.StoppingCriteriaList([criteria]), **generate_kwargs
+    )
+    responses = tokenizer.batch_decode(outputs[:, prompt_length:], skip_special_tokens=True)
+
+    assert outputs.shape[1] < full_outputs.shape[1]
+    assert all(stopped_at is not None for stopped_at in criteria.stopped_at)
+    assert [truncate_at_stop(response, stop_patterns) for response in responses] == [
+        truncate_at_stop(response, stop_patterns) for response in full_responses
+    ]
+
+    report = StopReport(max_new_tokens=12)
+    report.add(criteria, outputs.shape[1] - prompt_length)
+    assert report.num_stopped_sequences == 2
+    assert report.max_num_saved_tokens == sum(12 - stopped_at for stopped_at in criteria.stopped_at)
+    assert "2 of 2 sequences" in report.format_report()
+
+
+def test_stop_pattern_criteria_per_sequence(tiny_model_path):
+    tokenizer = transformers.AutoTokenizer.from_pretrained(tiny_model_path)
+    tokenizer.pad_token = tokenizer.eos_token
+    tokenizer.padding_side = "left"
+    model = transformers.AutoModelForCausalLM.from_pretrained(tiny_model_path).eval()
+    inputs = tokenizer(["Question: who? Answer:", "Question: who?"], return_tensors="pt", padding=True)
+    prompt_length = inputs["input_ids"].shape[1]
+    # The first sequence stops at its third character, and the second one never stops.
+    criteria = StopPatternCriteria([compile_stop_patterns([r"^.{3}"]), []], tokenizer, prompt_length)
+    model.generate(
+        **inputs,
+        stopping_criteria=transformers.StoppingCriteriaList([criteria]),
+        max_new_tokens=12,
+        do_sample=False,
+        pad_token_id=tokenizer.pad_token_id,
+    )
+    assert criteria.stopped_at[0] is not None
+    assert criteria.stopped_at[1] is None
@@ -0,0 +1,44 @@
+#!/usr/bin/env python3
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from lost_in_the_middle.throughput import (  # noqa: E402
+    ThroughputMeter,
+    count_new_tokens,
+)
+
+
+def test_count_new_tokens():
+    new_token_ids = torch.tensor([[5, 2, 0, 0], [5, 6, 7, 8], [2, 2, 2, 2]])
+    assert count_new_tokens(new_token_ids, eos_token_id=2) == 2 + 4 + 1
+    assert count_new_tokens(new_token_ids, eos_token_id=[2, 7]) == 2 + 3 + 1
+    assert count_new_tokens(new_token_ids) == 12
+
+
+def test_throughput_meter(tiny_llama):
+    input_ids = torch.tensor([[0, 0, 5, 6, 7], [1, 9, 10, 11, 12]])
+    inputs = {"input_ids": input_ids, "attention_mask": (input_ids != 0).long()}
+    expected_outputs = tiny_llama.generate(**inputs, max_new_tokens=6, do_sample=False, pad_token_id=0)
+
+    meter = ThroughputMeter()
+    for _ in range(2):
+        outputs = meter.generate(tiny_llama, inputs, max_new_tokens=6, do_sample=False, pad_token_id=0)
+        assert outputs.tolist() == expected_outputs.tolist()
+    assert meter.num_prefill_tokens == 2 * 8
+    new_token_ids = expected_outputs[:, input_ids.shape[1] :]
+    # Sequences are padded after the end-of-sequence token.
+    assert meter.num_decode_tokens == 2 * (count_new_tokens(new_token_ids, eos_token_id=[2, 0]) - 2)
+    assert meter.prefill_seconds > 0 and meter.decode_seconds > 0
+    assert "tokens/s" in meter.format_report()
+
+
+def test_throughput_meter_skips_cached_prefix(tiny_llama):
+    from lost_in_the_middle.prefix_cache import SharedPrefixCache
+
+    prefix_cache = SharedPrefixCache(tiny_llama, [1, 5, 6, 7])
+    inputs = prefix_cache.prepare_inputs([[1, 5, 6, 7, 8, 9], [1, 5, 6, 7, 10]], pad_token_id=0)
+    meter = ThroughputMeter()
+    meter.generate(tiny_llama, inputs, max_new_tokens=4, do_sample=False, pad_token_id=0)
+    assert meter.num_prefill_tokens == 2 + 1